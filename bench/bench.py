@@ -0,0 +1,351 @@
+"""
+Time the lua-* commands on generated Lua programs.
+
+    python3 bench/bench.py --out before.json
+    python3 bench/bench.py --out after.json
+    python3 bench/bench.py --compare before.json after.json
+
+A Lua 5.4.6 is built with debug info in bench/.build (downloaded from lua.org, or from the
+sources given by --lua-src). Every scenario is a Lua program generated with the sizes of
+SCENARIOS times --scale, that builds a deep stack, a big table, many coroutines... and then
+calls os.time. A `gdb --batch` worker sources luaGdb.py, stops in os_time and runs the commands
+of the scenario: the first run of a command is timed alone (cold caches), then the best of
+--repeat runs (warm caches), and one more run under tracemalloc gives the peak Python memory.
+
+The results are written as JSON. --compare prints the ratio of every command between two
+results and exits with 1 when one got slower or bigger than --threshold.
+
+TimeCommands is the part that runs inside gdb.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import string
+import subprocess
+import sys
+import tarfile
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+LUA_VERSION = "5.4.6"
+LUA_URL = "https://www.lua.org/ftp/lua-%s.tar.gz" % LUA_VERSION
+LUA_SHA256 = "7d5ea1b9cb6aa0b59ca3dde1c6adcb57ef83a1ba8e5432c0ecd06bf439b3ad88"
+
+# prefix of the record line in the output of a worker
+RECORD_PREFIX = "LUA-BENCH-RECORD "
+
+# version of the result file, results of different versions are not compared
+RESULT_VERSION = 1
+
+# every scenario stops in os_time, the argument of os.time is the first value above its CallInfo
+BREAK_FUNCTION = "os_time"
+FIRST_ARGUMENT = "L->ci->func.p+1"
+
+
+class Scenario(object):
+    """
+    A Lua program, the sizes substituted in it and the commands timed once it stopped in os_time
+    """
+
+    def __init__(self, name: str, sizes: Dict[str, int], program: str, commands: List[str]):
+        self.name = name
+        self.sizes = sizes
+        self.program = program
+        self.commands = commands
+
+    def Program(self, scale: float) -> str:
+        sizes = {name: max(1, int(size * scale)) for name, size in self.sizes.items()}
+        return string.Template(self.program).substitute(sizes)
+
+
+SCENARIOS = [
+    Scenario("recursion", {"frames": 10000}, """
+local function recurse(n, name, depth)
+    if n == 0 then
+        return os.time()
+    end
+    return 1 + recurse(n - 1, name, depth + 1)
+end
+recurse($frames, "frame", 0)
+""", [
+        "lua-backtrace",
+        "lua-backtrace --json",
+        "lua-backtrace --from 5000 --count 100",
+        "lua-localVal L->ci->previous",
+        "lua-upVal L->ci->previous->func.p",
+    ]),
+    Scenario("hugestack", {"slots": 500000}, """
+local values = {}
+for i = 1, $slots do
+    values[i] = i % 3 == 0 and ("s" .. i) or i
+end
+local function top(...)
+    return os.time()
+end
+top(table.unpack(values))
+""", [
+        "lua-printStack",
+        "lua-printStack --json",
+        "lua-printStack --from 250000 --count 100",
+    ]),
+    Scenario("bigtable", {"array": 500000, "hash": 500000}, """
+local t = {}
+for i = 1, $array do
+    t[i] = i
+end
+for i = 1, $hash do
+    t["k" .. i] = i * 0.5
+end
+os.time(t)
+""", [
+        "lua-printTable %s --limit 0" % FIRST_ARGUMENT,
+        "lua-printTable %s --limit 0 --keys ^k1" % FIRST_ARGUMENT,
+        "lua-heapstats",
+    ]),
+    Scenario("coroutines", {"coroutines": 100000}, """
+local threads = {}
+local function body(n)
+    coroutine.yield(n)
+end
+for i = 1, $coroutines do
+    local co = coroutine.create(body)
+    coroutine.resume(co, i)
+    threads[i] = co
+end
+os.time()
+""", [
+        "lua-coroutines",
+        "lua-coroutines --json",
+        "lua-heapstats",
+    ]),
+    Scenario("longstrings", {"count": 20000, "length": 65536, "distinct": 1000}, """
+local strings = {}
+local chunk = string.rep("0123456789abcdef", $length // 16)
+for i = 1, $count do
+    strings[i] = chunk .. (i % $distinct)
+end
+os.time()
+""", [
+        "lua-strings",
+        "lua-heapstats",
+    ]),
+]
+
+
+def TimeCommands(specPath: str) -> None:
+    """
+    Run in gdb stopped in os_time: time the commands of the spec and print the record, see RECORD_PREFIX
+    """
+    import gdb
+    import time
+    import tracemalloc
+
+    with open(specPath) as f:
+        spec = json.load(f)
+    for command in spec["commands"]:
+        record = {"scenario": spec["scenario"], "command": command, "cold": None, "warm": None,
+                  "peakBytes": None, "outputBytes": None, "error": None}
+        try:
+            seconds = []
+            for i in range(1 + spec["repeat"]):
+                start = time.perf_counter()
+                output = gdb.execute(command, to_string=True)
+                seconds.append(time.perf_counter() - start)
+            record["cold"] = seconds[0]
+            record["warm"] = min(seconds[1:]) if spec["repeat"] > 0 else seconds[0]
+            record["outputBytes"] = len(output)
+            if "Traceback (most recent call last)" in output:
+                record["error"] = output[output.index("Traceback"):][-2000:]
+            # tracemalloc slows the command down, the memory is measured in a run of its own
+            tracemalloc.start()
+            try:
+                gdb.execute(command, to_string=True)
+                record["peakBytes"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        except Exception as e:
+            record["error"] = "%s: %s" % (type(e).__name__, e)
+        print(RECORD_PREFIX + json.dumps(record))
+
+
+def _Run(command: List[str], cwd: str = None) -> None:
+    print("+ %s" % " ".join(command), file=sys.stderr)
+    subprocess.check_call(command, cwd=cwd, stdout=sys.stderr)
+
+
+def BuildLua(buildDir: str, luaSrc: Optional[str]) -> str:
+    """
+    Build Lua with -g -O0, so that L and the Lua structs are in the DWARF, return the path of the lua binary
+    """
+    if luaSrc is None:
+        luaSrc = os.path.join(buildDir, "lua-%s" % LUA_VERSION)
+        if not os.path.isdir(luaSrc):
+            os.makedirs(buildDir, exist_ok=True)
+            tarball = os.path.join(buildDir, "lua-%s.tar.gz" % LUA_VERSION)
+            if not os.path.exists(tarball):
+                print("downloading %s" % LUA_URL, file=sys.stderr)
+                urllib.request.urlretrieve(LUA_URL, tarball)
+            with open(tarball, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if digest != LUA_SHA256:
+                raise RuntimeError("%s has sha256 %s, expected %s" % (tarball, digest, LUA_SHA256))
+            with tarfile.open(tarball) as tar:
+                tar.extractall(buildDir)
+    binary = os.path.join(luaSrc, "src", "lua")
+    if not os.path.exists(binary):
+        _Run(["make", "-C", os.path.join(luaSrc, "src"), "linux", "MYCFLAGS=-g -O0"])
+    return binary
+
+
+def _WorkerCommand(gdbPath: str, binary: str, scriptPath: str, specPath: str) -> List[str]:
+    return [
+        gdbPath, "--batch", "-nx", "-q",
+        "-ex", "set pagination off",
+        "-ex", "set confirm off",
+        "-ex", "python import sys; sys.path.insert(0, %r); sys.path.insert(0, %r)" % (SRC_DIR, BENCH_DIR),
+        "-x", os.path.join(SRC_DIR, "luaGdb.py"),
+        "-ex", "break %s" % BREAK_FUNCTION,
+        "-ex", "run",
+        "-ex", "python import bench; bench.TimeCommands(%r)" % specPath,
+        "-ex", "kill",
+        "--args", binary, scriptPath,
+    ]
+
+
+def RunScenario(scenario: Scenario, gdbPath: str, binary: str, workDir: str, scale: float, repeat: int,
+                timeout: float) -> List[dict]:
+    scriptPath = os.path.join(workDir, scenario.name + ".lua")
+    with open(scriptPath, "w") as f:
+        f.write(scenario.Program(scale))
+    specPath = os.path.join(workDir, scenario.name + ".json")
+    with open(specPath, "w") as f:
+        json.dump({"scenario": scenario.name, "commands": scenario.commands, "repeat": repeat}, f)
+
+    print("scenario %s" % scenario.name, file=sys.stderr)
+    try:
+        result = subprocess.run(_WorkerCommand(gdbPath, binary, scriptPath, specPath), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=timeout, universal_newlines=True)
+        output = result.stdout
+        error = "no record in the gdb output (exit code %d)" % result.returncode
+    except subprocess.TimeoutExpired:
+        output = ""
+        error = "timeout after %ds" % timeout
+    records = [json.loads(line[len(RECORD_PREFIX):]) for line in output.splitlines() if line.startswith(RECORD_PREFIX)]
+    if not records:
+        records = [{"scenario": scenario.name, "command": None, "error": error, "output": output[-2000:]}]
+    for record in records:
+        if record.get("error"):
+            print("  %s: %s" % (record["command"], record["error"].splitlines()[-1]), file=sys.stderr)
+        else:
+            print("  %-50s %9.3fs %9.3fs %12d" % (record["command"], record["cold"], record["warm"], record["peakBytes"]),
+                  file=sys.stderr)
+    return records
+
+
+def _GdbVersion(gdbPath: str) -> str:
+    try:
+        return subprocess.check_output([gdbPath, "--version"], universal_newlines=True).splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _GitRevision() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=BENCH_DIR,
+                                       universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _Key(record: dict) -> Tuple[str, str]:
+    return record["scenario"], record["command"]
+
+
+def Compare(before: dict, after: dict, threshold: float) -> int:
+    """
+    Print the ratio after / before of the warm time and of the peak memory of every command,
+    return the number of regressions over threshold
+    """
+    for result in (before, after):
+        if result.get("version") != RESULT_VERSION:
+            raise RuntimeError("result version %s, expected %d" % (result.get("version"), RESULT_VERSION))
+    if before.get("scale") != after.get("scale"):
+        print("warning: scale %s and %s are not comparable" % (before.get("scale"), after.get("scale")))
+    beforeRecords = {_Key(record): record for record in before["results"] if not record.get("error")}
+    regressions = 0
+    print("%-12s %-50s %10s %10s %7s %7s" % ("scenario", "command", "before", "after", "time", "memory"))
+    for record in after["results"]:
+        old = beforeRecords.get(_Key(record))
+        if old is None or record.get("error"):
+            continue
+        timeRatio = record["warm"] / old["warm"] if old["warm"] else 1.0
+        memoryRatio = record["peakBytes"] / old["peakBytes"] if old["peakBytes"] else 1.0
+        regressed = timeRatio > threshold or memoryRatio > threshold
+        regressions += regressed
+        print("%-12s %-50s %9.3fs %9.3fs %6.2fx %6.2fx%s" % (record["scenario"], record["command"], old["warm"],
+                                                          record["warm"], timeRatio, memoryRatio,
+                                                          "  <-- regression" if regressed else ""))
+    return regressions
+
+
+def Main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="bench.py", description="Time the lua-* commands on generated Lua programs")
+    parser.add_argument("--gdb", default="gdb", help="gdb to run the workers with")
+    parser.add_argument("--lua-src", help="Lua %s sources to build instead of downloading them" % LUA_VERSION)
+    parser.add_argument("--build-dir", default=os.path.join(BENCH_DIR, ".build"), help="where Lua and the scenarios are built")
+    parser.add_argument("--scenario", action="append", help="only run this scenario, may be repeated")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the sizes of the scenarios")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs of every command")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds per scenario")
+    parser.add_argument("--out", default="bench_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio reported as a regression by --compare")
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        results = []
+        for path in options.compare:
+            with open(path) as f:
+                results.append(json.load(f))
+        return 1 if Compare(results[0], results[1], options.threshold) else 0
+
+    names = [scenario.name for scenario in SCENARIOS]
+    for name in options.scenario or []:
+        if name not in names:
+            parser.error("unknown scenario %s, one of %s" % (name, ", ".join(names)))
+    binary = BuildLua(options.build_dir, options.lua_src)
+    workDir = os.path.join(options.build_dir, "scenarios")
+    os.makedirs(workDir, exist_ok=True)
+
+    records = []
+    for scenario in SCENARIOS:
+        if options.scenario and scenario.name not in options.scenario:
+            continue
+        records.extend(RunScenario(scenario, options.gdb, binary, workDir, options.scale, options.repeat, options.timeout))
+
+    result = {
+        "version": RESULT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _GitRevision(),
+        "gdb": _GdbVersion(options.gdb),
+        "lua": LUA_VERSION,
+        "machine": "%s %s" % (platform.system(), platform.machine()),
+        "scale": options.scale,
+        "repeat": options.repeat,
+        "results": records,
+    }
+    with open(options.out, "w") as f:
+        json.dump(result, f, indent=1)
+    print("results written to %s" % options.out, file=sys.stderr)
+    return 1 if any(record.get("error") for record in records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
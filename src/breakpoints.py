@@ -0,0 +1,453 @@
+import gdb
+from typing import Dict, Iterator, List, Optional, Tuple
+import common
+import ldebug
+import lgc
+import memreader
+import typecache
+
+"""
+Breakpoints on Lua source lines.
+
+The VM only reports lines through its hooks: with LUA_MASKLINE in L->hookmask, luaG_traceexec
+calls luaD_hook(L, LUA_HOOKLINE, line, 0, 0) for every new line, and luaD_hook returns at once
+when no hook function is set. A Lua breakpoint is a plain gdb breakpoint on luaD_hook whose
+condition is the line and the code ranges of the Protos that have it, so gdb decides without
+Python whether to stop. The Protos are found by reversing their line tables, on the GC lists
+when the breakpoint is created and in every chunk loaded afterwards (luaF_initupvals).
+
+lua-step, lua-next and lua-finish use the same line events, with a temporary breakpoint whose
+condition compares the depth of L->ci (the stack index of its function) and the line to the
+frame they started from. lua-step also hooks the coroutines resumed on the way, from a breakpoint
+on lua_resume, and every thread is unhooked when the command ends.
+"""
+
+# lua.h
+LUA_HOOKLINE = 2
+LUA_MASKLINE = 1 << LUA_HOOKLINE
+
+HOOK_FUNCTION = "luaD_hook"
+# called with the coroutine to resume as L
+RESUME_FUNCTION = "lua_resume"
+# called by f_parser once a loaded chunk and all its Protos are complete
+LOAD_FUNCTION = "luaF_initupvals"
+
+
+def ParseLocation(location: str) -> Tuple[str, int]:
+    """
+    "file.lua:123" -> ("file.lua", 123)
+    """
+    fileName, _, line = location.rpartition(":")
+    if not fileName or not line.isdigit():
+        raise gdb.GdbError("location must be like file.lua:123, not %s" % location)
+    return fileName, int(line)
+
+
+def SourceMatches(source: str, fileName: str) -> bool:
+    """
+    source is the chunkname of a Proto, "@path/file.lua" for files.
+    fileName matches it when it is the same path or its last components.
+    """
+    if source[:1] not in ("@", "="):
+        # chunk loaded from a string, source is the code itself
+        return False
+    name = source[1:]
+    return name == fileName or name.endswith("/" + fileName)
+
+
+def ProtoSource(protoAddress: int) -> str:
+    source, = memreader.ReadStruct(protoAddress, "Proto", ("source",))
+    return memreader.ReadTString(source) if source else "=?"
+
+
+def IterProtoTree(protoAddress: int) -> Iterator[int]:
+    """
+    The Proto and all the Protos nested in it
+    """
+    pending = [protoAddress]
+    while pending:
+        proto = pending.pop()
+        yield proto
+        p, sizep = memreader.ReadStruct(proto, "Proto", ("p", "sizep"))
+        pending.extend(memreader.IterPointers(p, sizep))
+
+
+def LinePcs(protoAddress: int, line: int) -> List[int]:
+    """
+    The pcs of the Proto on the line, the reverse of luaG_getfuncline
+    """
+    lineTable = ldebug.GetLineTable(protoAddress)
+    if lineTable is None:
+        return []
+    return [pc for pc, pcLine in enumerate(lineTable.lines) if pcLine == line]
+
+
+class LineBreakpoint(object):
+    """
+    One Lua breakpoint: the gdb breakpoint on HOOK_FUNCTION and the Protos it stops in.
+    locations[Proto] is (code, sizecode, pcs on the line).
+    """
+
+    def __init__(self, fileName: str, line: int):
+        self.fileName = fileName
+        self.line = line
+        self.locations: Dict[int, Tuple[int, int, List[int]]] = {}
+        self.breakpoint = gdb.Breakpoint(HOOK_FUNCTION)
+        self.breakpoint.silent = True
+        self.Update()
+
+    @property
+    def number(self) -> int:
+        return self.breakpoint.number
+
+    def AddProtos(self, protos: Iterator[int]) -> bool:
+        """
+        Add the locations of the line in protos, return whether the locations changed
+        """
+        changed = False
+        for proto in protos:
+            code, sizecode = memreader.ReadStruct(proto, "Proto", ("code", "sizecode"))
+            known = self.locations.get(proto)
+            if known is not None and known[:2] == (code, sizecode):
+                continue
+            # a collected Proto whose memory was reused
+            if self.locations.pop(proto, None) is not None:
+                changed = True
+            if not SourceMatches(ProtoSource(proto), self.fileName):
+                continue
+            pcs = LinePcs(proto, self.line)
+            if pcs:
+                self.locations[proto] = (code, sizecode, pcs)
+                changed = True
+        return changed
+
+    def Condition(self) -> str:
+        """
+        luaG_traceexec saves pc + 1 in L->ci->u.l.savedpc before calling the hook,
+        so a Proto is hit when savedpc is in (code, code + sizecode]
+        """
+        if not self.locations:
+            return "0"
+        instructionSize = typecache.Sizeof("Instruction")
+        ranges = ["(L->ci->u.l.savedpc > (Instruction *)0x%x && L->ci->u.l.savedpc <= (Instruction *)0x%x)" %
+                  (code, code + sizecode * instructionSize) for code, sizecode, pcs in self.locations.values()]
+        return "event == %d && line == %d && (%s)" % (LUA_HOOKLINE, self.line, " || ".join(ranges))
+
+    def Update(self) -> None:
+        self.breakpoint.condition = self.Condition()
+
+    def Describe(self) -> str:
+        if not self.locations:
+            return "Lua breakpoint %d at %s:%d, pending until a chunk of %s is loaded" % (
+                self.number, self.fileName, self.line, self.fileName)
+        pcs = sum(len(pcs) for code, sizecode, pcs in self.locations.values())
+        return "Lua breakpoint %d at %s:%d, %d functions, %d instructions" % (
+            self.number, self.fileName, self.line, len(self.locations), pcs)
+
+
+# gdb breakpoint number -> LineBreakpoint
+_breakpoints: Dict[int, LineBreakpoint] = {}
+
+# global_State whose threads have the line hook turned on for the Lua breakpoints
+_hookedGlobalState: Optional[int] = None
+
+_loadWatcher = None
+
+
+def _HookThread(thread: int) -> Optional[bool]:
+    """
+    Turn on LUA_MASKLINE in the thread, and the trap of its running Lua frames like settraps in ldebug.c.
+    Return True if it was turned on, False if it was already on,
+    None if the program set its own hook function without lines.
+    """
+    hook, hookmask, ci = memreader.ReadStruct(thread, "lua_State", ("hook", "hookmask", "ci"))
+    if hookmask & LUA_MASKLINE:
+        return False
+    if hook != 0:
+        return None
+    memreader.WriteField(thread, "lua_State", "hookmask", hookmask | LUA_MASKLINE)
+    baseCi = thread + typecache.Offsetof("lua_State", "base_ci")
+    while ci != 0 and ci != baseCi:
+        callstatus, previous = memreader.ReadStruct(ci, "CallInfo", ("callstatus", "previous"))
+        if not (callstatus & common.CallInfoValue.CIST_C):
+            memreader.WriteField(ci, "CallInfo", "u.l.trap", 1)
+        ci = previous
+    return True
+
+
+def _UnhookThread(thread: int) -> None:
+    """
+    Turn off LUA_MASKLINE, luaG_traceexec clears the traps by itself
+    """
+    try:
+        hook, hookmask = memreader.ReadStruct(thread, "lua_State", ("hook", "hookmask"))
+        if hook == 0:
+            memreader.WriteField(thread, "lua_State", "hookmask", hookmask & ~LUA_MASKLINE)
+    except gdb.error:
+        # the program is gone, or the thread was collected
+        pass
+
+
+def EnableLineHook(globalStateAddress: int) -> int:
+    """
+    Turn on the line hook in every thread without a hook function, new coroutines inherit the mask.
+    Return the number of threads left alone because the program set its own hook.
+    """
+    global _hookedGlobalState
+    if _hookedGlobalState == globalStateAddress:
+        return 0
+    skipped = 0
+    with memreader.ReadAhead():
+        threads = list(lgc.IterThreads(globalStateAddress))
+    for thread in threads:
+        if _HookThread(thread) is None:
+            skipped += 1
+    _hookedGlobalState = globalStateAddress
+    return skipped
+
+
+def UnhookAllThreads(globalStateAddress: int) -> None:
+    """
+    Turn off LUA_MASKLINE in every thread without a hook function, including the coroutines
+    created while it was on, lua_newthread copies the mask
+    """
+    try:
+        with memreader.ReadAhead():
+            threads = list(lgc.IterThreads(globalStateAddress))
+    except gdb.error:
+        # the program is gone
+        return
+    for thread in threads:
+        _UnhookThread(thread)
+
+
+def DisableLineHook() -> None:
+    """
+    Turn off the line hook where EnableLineHook turned it on, and in the threads created since
+    """
+    global _hookedGlobalState
+    if _hookedGlobalState is not None:
+        UnhookAllThreads(_hookedGlobalState)
+    _hookedGlobalState = None
+
+
+class _LoadWatcher(gdb.Breakpoint):
+    """
+    Add the Protos of every loaded chunk to the Lua breakpoints.
+    Python runs once per chunk, not for every instruction.
+    """
+
+    def __init__(self):
+        super(_LoadWatcher, self).__init__(LOAD_FUNCTION, internal=True)
+        self.silent = True
+
+    def stop(self) -> bool:
+        if not _breakpoints:
+            return False
+        try:
+            closure = int(gdb.parse_and_eval("cl"))
+            proto, = memreader.ReadStruct(closure, "LClosure", ("p",))
+            protos = list(IterProtoTree(proto))
+            changed = False
+            for lineBreakpoint in _breakpoints.values():
+                if lineBreakpoint.AddProtos(protos):
+                    lineBreakpoint.Update()
+                    changed = True
+            if changed and any(lineBreakpoint.locations for lineBreakpoint in _breakpoints.values()):
+                EnableLineHook(lgc.GetGlobalState(gdb.parse_and_eval("L")))
+        except gdb.error:
+            pass
+        return False
+
+
+def _ProgramRunning() -> bool:
+    return gdb.selected_inferior().pid != 0
+
+
+def CreateBreakpoint(location: str, luaStatePointer: Optional[gdb.Value]) -> Tuple[LineBreakpoint, int]:
+    """
+    Return the breakpoint and the number of threads it will not stop in, see EnableLineHook.
+    Without a running program or a lua_State, it waits for the chunk to be loaded.
+    """
+    global _loadWatcher
+    fileName, line = ParseLocation(location)
+    if _loadWatcher is None:
+        _loadWatcher = _LoadWatcher()
+    _loadWatcher.enabled = True
+    lineBreakpoint = LineBreakpoint(fileName, line)
+    _breakpoints[lineBreakpoint.number] = lineBreakpoint
+    skipped = 0
+    if _ProgramRunning() and luaStatePointer is not None and int(luaStatePointer) != 0:
+        globalStateAddress = lgc.GetGlobalState(luaStatePointer)
+        with memreader.ReadAhead():
+            protos = [address for listName, address, tt, marked in lgc.IterGCObjects(globalStateAddress)
+                      if tt == common.LUA_VPROTO]
+            lineBreakpoint.AddProtos(protos)
+        lineBreakpoint.Update()
+        if lineBreakpoint.locations:
+            skipped = EnableLineHook(globalStateAddress)
+    return lineBreakpoint, skipped
+
+
+def IterBreakpoints() -> Iterator[LineBreakpoint]:
+    for number in sorted(_breakpoints):
+        yield _breakpoints[number]
+
+
+STEP_INTO = "step"
+STEP_OVER = "next"
+STEP_OUT = "finish"
+
+# stack index of the function of the running CallInfo, unchanged when the stack is reallocated
+_DEPTH = "(L->ci->func.p - L->stack.p)"
+
+
+def StepCondition(mode: str, luaStateAddress: int, depth: int, line: int) -> str:
+    """
+    step: any other line, in any function or thread
+    next: another line at the same depth, or any line in a caller
+    finish: any line in a caller
+    """
+    if mode == STEP_INTO:
+        return "event == %d && (L != (lua_State *)0x%x || %s != %d || line != %d)" % (
+            LUA_HOOKLINE, luaStateAddress, _DEPTH, depth, line)
+    if mode == STEP_OVER:
+        return "event == %d && L == (lua_State *)0x%x && (%s < %d || (%s == %d && line != %d))" % (
+            LUA_HOOKLINE, luaStateAddress, _DEPTH, depth, _DEPTH, depth, line)
+    return "event == %d && L == (lua_State *)0x%x && %s < %d" % (LUA_HOOKLINE, luaStateAddress, _DEPTH, depth)
+
+
+def _CurrentLuaFrame(luaStatePointer: gdb.Value) -> Tuple[int, int]:
+    """
+    Depth and current line of the innermost Lua function of the lua_State
+    """
+    luaStateAddress = int(luaStatePointer)
+    ci, stack = memreader.ReadStruct(luaStateAddress, "lua_State", ("ci", "stack.p"))
+    baseCi = luaStateAddress + typecache.Offsetof("lua_State", "base_ci")
+    while ci != 0 and ci != baseCi:
+        func, callstatus, previous = memreader.ReadStruct(ci, "CallInfo", ("func.p", "callstatus", "previous"))
+        if not (callstatus & common.CallInfoValue.CIST_C):
+            callInfoPointer = gdb.Value(ci).cast(typecache.LookupPointerType("CallInfo"))
+            line = ldebug.GetCurrentLine(common.CallInfoValue(luaStatePointer, callInfoPointer))
+            return (func - stack) // typecache.Sizeof("StackValue"), line
+        ci = previous
+    raise gdb.GdbError("no Lua function is running in %s" % hex(luaStateAddress))
+
+
+def _SetRunningTrap() -> None:
+    """
+    luaV_execute keeps the trap of the running frame in a local, set it
+    in case the program stopped in the middle of an instruction
+    """
+    selected = gdb.selected_frame()
+    frame = gdb.newest_frame()
+    while frame is not None and frame.name() != "luaV_execute":
+        frame = frame.older()
+    if frame is None:
+        return
+    try:
+        frame.select()
+        gdb.parse_and_eval("trap = 1")
+    except gdb.error:
+        # optimized out, the trap is read again after the next call
+        pass
+    finally:
+        selected.select()
+
+
+class _ResumeWatcher(gdb.Breakpoint):
+    """
+    Turn on the line hook in the coroutines resumed while lua-step runs,
+    so that the step stops at their next line
+    """
+
+    def __init__(self):
+        super(_ResumeWatcher, self).__init__(RESUME_FUNCTION, internal=True)
+        self.silent = True
+
+    def stop(self) -> bool:
+        try:
+            _HookThread(int(gdb.parse_and_eval("L")))
+        except gdb.error:
+            pass
+        return False
+
+
+def Step(mode: str, luaStatePointer: gdb.Value) -> bool:
+    """
+    Run to the next line event matching mode, see StepCondition.
+    Return False if the program stopped or exited for another reason.
+    """
+    luaStateAddress = int(luaStatePointer)
+    globalStateAddress = lgc.GetGlobalState(luaStatePointer)
+    depth, line = _CurrentLuaFrame(luaStatePointer)
+    hooked = _HookThread(luaStateAddress)
+    if hooked is None:
+        raise gdb.GdbError("the program set its own hook without lines in %s" % hex(luaStateAddress))
+    _SetRunningTrap()
+    breakpoint = gdb.Breakpoint(HOOK_FUNCTION, internal=True, temporary=True)
+    breakpoint.silent = True
+    breakpoint.condition = StepCondition(mode, luaStateAddress, depth, line)
+    resumeWatcher = _ResumeWatcher() if mode == STEP_INTO else None
+    try:
+        gdb.execute("continue")
+    finally:
+        # a temporary breakpoint is deleted when it is hit
+        hit = not breakpoint.is_valid()
+        if not hit:
+            breakpoint.delete()
+        if resumeWatcher is not None:
+            resumeWatcher.delete()
+        # the coroutines created or resumed meanwhile have the mask too,
+        # it stays on everywhere while a Lua breakpoint needs it
+        if _hookedGlobalState is None and _ProgramRunning():
+            UnhookAllThreads(globalStateAddress)
+    return hit and _ProgramRunning()
+
+
+def CurrentLocation() -> Optional[str]:
+    """
+    "test.lua:12: in function 'foo'" for the innermost Lua function of the L in the C stack
+    """
+    luaStatePointer = common.FindLuaState()
+    ar = next(ldebug.IterStackInfo(luaStatePointer, "Sln"), None) if luaStatePointer is not None else None
+    if ar is None:
+        return None
+    return "%s:%d: in %s" % (ar.shortSrc, ar.currentLine, ldebug.GetFuncDescription(ar))
+
+
+def _OnStop(event) -> None:
+    if not isinstance(event, gdb.BreakpointEvent):
+        return
+    for breakpoint in event.breakpoints:
+        lineBreakpoint = _breakpoints.get(breakpoint.number)
+        if lineBreakpoint is None:
+            continue
+        location = CurrentLocation()
+        if location is None:
+            location = "%s:%d" % (lineBreakpoint.fileName, lineBreakpoint.line)
+        print("Lua breakpoint %d, %s" % (lineBreakpoint.number, location))
+        return
+
+
+def _OnBreakpointDeleted(breakpoint) -> None:
+    if _breakpoints.pop(breakpoint.number, None) is None:
+        return
+    if not _breakpoints:
+        if _loadWatcher is not None:
+            _loadWatcher.enabled = False
+        if _ProgramRunning():
+            DisableLineHook()
+
+
+def _OnExited(event) -> None:
+    global _hookedGlobalState
+    _hookedGlobalState = None
+    for lineBreakpoint in _breakpoints.values():
+        lineBreakpoint.locations.clear()
+        lineBreakpoint.Update()
+
+
+gdb.events.stop.connect(_OnStop)
+gdb.events.exited.connect(_OnExited)
+gdb.events.breakpoint_deleted.connect(_OnBreakpointDeleted)
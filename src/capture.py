@@ -0,0 +1,157 @@
+import gdb
+import json
+from typing import List, Tuple
+import common
+import layout
+import lgc
+import memimage
+import memreader
+import typecache
+
+"""
+lua-capture: save what the lua-* commands read from a Lua state to a memory image (see memimage.py),
+to run them later away from the process with luaCore.py.
+
+The regions captured are global_State and the string table, every object of the GC lists with its
+arrays (table parts, Proto code, line info, locals...), and for every thread its stack and CallInfo
+chain. They are merged, and written with the layout of the Lua structs and the address of L.
+The regions are read one by one, in order of address, memory far from the Lua heap is not read.
+"""
+
+# the struct of the other collectable objects, read whole by memreader.ReadStruct
+# even when the object is smaller (a short string, a closure without upvalues...)
+GC_TYPE_NAMES = {
+    common.LUA_VSHRSTR: "TString",
+    common.LUA_VLNGSTR: "TString",
+    common.LUA_VLCL: "LClosure",
+    common.LUA_VCCL: "CClosure",
+    common.LUA_VUSERDATA: "Udata",
+    common.LUA_VUPVAL: "UpVal",
+}
+
+PROTO_ARRAY_FIELDS = ("code", "sizecode", "k", "sizek", "p", "sizep", "lineinfo", "sizelineinfo",
+                      "abslineinfo", "sizeabslineinfo", "locvars", "sizelocvars", "upvalues", "sizeupvalues")
+
+
+class RegionSet(object):
+    """
+    Address ranges to capture, merged when they overlap or touch
+    """
+
+    def __init__(self):
+        self.regions: List[Tuple[int, int]] = []
+
+    def Add(self, address: int, length: int) -> None:
+        if address and length > 0:
+            self.regions.append((address, length))
+
+    def Merged(self) -> List[Tuple[int, int]]:
+        merged: List[List[int]] = []
+        for address, length in sorted(self.regions):
+            if merged and address <= merged[-1][0] + merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], address + length - merged[-1][0])
+            else:
+                merged.append([address, length])
+        return [(address, length) for address, length in merged]
+
+
+def _AddTable(regions: RegionSet, address: int) -> None:
+    alimit, flags, lsizenode, lastfree, array, node = memreader.ReadStruct(
+        address, "Table", ("alimit", "flags", "lsizenode", "lastfree", "array", "node"))
+    regions.Add(address, typecache.Sizeof("Table"))
+    regions.Add(array, common.LuaH_RealAsize(alimit, flags) * typecache.Sizeof("TValue"))
+    # without lastfree the node is the dummy node of ltable.c
+    nodes = (1 << lsizenode) if lastfree else 1
+    regions.Add(node, nodes * typecache.Sizeof("Node"))
+
+
+def _AddProto(regions: RegionSet, address: int) -> None:
+    (code, sizecode, k, sizek, p, sizep, lineinfo, sizelineinfo, abslineinfo, sizeabslineinfo,
+     locvars, sizelocvars, upvalues, sizeupvalues) = memreader.ReadStruct(address, "Proto", PROTO_ARRAY_FIELDS)
+    regions.Add(address, typecache.Sizeof("Proto"))
+    regions.Add(code, sizecode * typecache.Sizeof("Instruction"))
+    regions.Add(k, sizek * typecache.Sizeof("TValue"))
+    regions.Add(p, sizep * typecache.Sizeof("void *"))
+    regions.Add(lineinfo, sizelineinfo)
+    regions.Add(abslineinfo, sizeabslineinfo * typecache.Sizeof("AbsLineInfo"))
+    regions.Add(locvars, sizelocvars * typecache.Sizeof("LocVar"))
+    regions.Add(upvalues, sizeupvalues * typecache.Sizeof("Upvaldesc"))
+
+
+def _AddThread(regions: RegionSet, address: int) -> None:
+    stack, stackLast = memreader.ReadStruct(address, "lua_State", ("stack.p", "stack_last.p"))
+    regions.Add(address, typecache.Sizeof("lua_State"))
+    stackValueSize = typecache.Sizeof("StackValue")
+    if stack:
+        regions.Add(stack, stackLast - stack + common.EXTRA_STACK * stackValueSize)
+    # base_ci is in the lua_State, the others are allocated by luaE_extendCI
+    ci, = memreader.ReadStruct(address + typecache.Offsetof("lua_State", "base_ci"), "CallInfo", ("next",))
+    callInfoSize = typecache.Sizeof("CallInfo")
+    while ci:
+        regions.Add(ci, callInfoSize)
+        ci, = memreader.ReadStruct(ci, "CallInfo", ("next",))
+
+
+def CollectRegions(globalStateAddress: int) -> RegionSet:
+    regions = RegionSet()
+    regions.Add(globalStateAddress, typecache.Sizeof("global_State"))
+    strtOffset = typecache.Offsetof("global_State", "strt")
+    hashArray, size = memreader.ReadStruct(globalStateAddress + strtOffset, "stringtable", ("hash", "size"))
+    regions.Add(hashArray, size * typecache.Sizeof("void *"))
+
+    with memreader.ReadAhead():
+        # the main thread is not on the GC lists
+        mainthread, = memreader.ReadStruct(globalStateAddress, "global_State", ("mainthread",))
+        _AddThread(regions, mainthread)
+        for listName, address, tt, marked in lgc.IterGCObjects(globalStateAddress):
+            if tt == common.LUA_VTABLE:
+                _AddTable(regions, address)
+            elif tt == common.LUA_VPROTO:
+                _AddProto(regions, address)
+            elif tt == common.LUA_VTHREAD:
+                _AddThread(regions, address)
+            elif tt in GC_TYPE_NAMES:
+                regions.Add(address, max(lgc.ObjectSize(address, tt), typecache.Sizeof(GC_TYPE_NAMES[tt])))
+    return regions
+
+
+def _LayoutOfInferior() -> dict:
+    manifest = typecache.GetManifest()
+    if manifest is not None:
+        return manifest
+    return layout.BuildLayout()
+
+
+def CaptureState(luaStateAddress: int, path: str) -> Tuple[int, int]:
+    """
+    Write the image of the Lua state of luaStateAddress to path, return (regions, bytes) written.
+    The regions are streamed to the file, the header with their index goes at the end.
+    """
+    globalStateAddress, = memreader.ReadStruct(luaStateAddress, "lua_State", ("l_G",))
+    merged = CollectRegions(globalStateAddress).Merged()
+
+    index = []
+    offset = memimage.IMAGE_HEADER.size
+    with open(path, "wb") as f, memreader.ReadAhead():
+        f.write(bytes(memimage.IMAGE_HEADER.size))
+        for address, length in merged:
+            try:
+                data = memreader.ReadMemory(address, length)
+            except gdb.MemoryError:
+                # a pointer to unmapped memory in a corrupted state, the commands will fail there as in gdb
+                continue
+            padding = -length % memimage.IMAGE_ALIGN
+            f.write(data)
+            f.write(bytes(padding))
+            index.append([address, length, offset])
+            offset += length + padding
+
+        header = json.dumps({
+            "layout": _LayoutOfInferior(),
+            "symbols": {"L": luaStateAddress},
+            "regions": index,
+        }).encode("utf-8")
+        f.write(header)
+        f.seek(0)
+        f.write(memimage.IMAGE_HEADER.pack(memimage.IMAGE_MAGIC, memimage.IMAGE_VERSION, offset, len(header)))
+    return len(index), offset - memimage.IMAGE_HEADER.size
@@ -1,15 +1,42 @@
 import gdb
+import argparse
 from enum import Enum, IntEnum
+import typecache
+import memreader
+import perfstats
 
 def RemovePrint(str: str, *args):
     print(("[debug]-" + str) % args)
 
+class ArgumentParser(argparse.ArgumentParser):
+    """
+    argparse for gdb commands, errors are raised as gdb.GdbError instead of exiting gdb
+    """
+
+    def error(self, message):
+        raise gdb.GdbError("%s: %s\n%s" % (self.prog, message, self.format_usage()))
+
+    def exit(self, status=0, message=None):
+        if message:
+            raise gdb.GdbError(message)
+        raise gdb.GdbError("")
+
+def ValueField(o: gdb.Value, *names: str) -> gdb.Value:
+    """
+    o[names[0]][names[1]]..., each field read counted for lua-perfstats
+    """
+    if perfstats.enabled:
+        perfstats.stats.valueReads += len(names)
+    for name in names:
+        o = o[name]
+    return o
+
 def Val_(o: gdb.Value) -> gdb.Value:
     return o['value_']
 
 def S2V(o: gdb.Value) -> gdb.Value:
     #/* convert a 'StackValue' to a 'TValue' */
-    return (o['val']).address
+    return ValueField(o, 'val').address
 
 def Tvalue(o: gdb.Value) -> gdb.Value:
     return (o['value_'])
@@ -19,7 +46,7 @@ def Novariant(t: int) -> int:
 
 def Rawtt(o: gdb.Value) -> int:
     #/* raw type tag of a TValue */
-    return int(o['tt_'])
+    return int(ValueField(o, 'tt_'))
 
 def Ttype(o: gdb.Value) -> int:
     return Novariant(Rawtt(o))
@@ -55,19 +82,36 @@ def TtIsClosure(o: gdb.Value) -> bool:
     return (TtIsLClosure(o) or TtIsCClosure(o))
 
 def PcRel(pc: gdb.Value, p: gdb.Value) -> int:
-    return int(pc - p['code'] - 1)
+    return int(pc - ValueField(p, 'code') - 1)
 
 
 def Cast2TargetTypePointer(pointer: gdb.Value, targetTypeName: str) -> gdb.Value:
-    targetType = gdb.lookup_type(targetTypeName)
-    return pointer.cast(targetType.pointer())
+    return pointer.cast(typecache.LookupPointerType(targetTypeName))
 
 def CastTvaluePointer2GcUnionPointer(tvaluePointer: gdb.Value) -> gdb.Value:
-    return Cast2TargetTypePointer(tvaluePointer['value_']['gc'], "union GCUnion")
+    return Cast2TargetTypePointer(ValueField(tvaluePointer, 'value_', 'gc'), "union GCUnion")
 
 def CastPointer2LuaStatePointer(poninter: gdb.Value) -> gdb.Value:
     return Cast2TargetTypePointer(poninter, "lua_State")
 
+def FindLuaState(frame: "gdb.Frame" = None) -> gdb.Value:
+    """
+    The innermost 'L' of type lua_State * in the C stack of the selected thread,
+    starting from frame (default the newest one). None if no frame has one.
+    """
+    frame = frame if frame is not None else gdb.newest_frame()
+    while frame is not None:
+        try:
+            value = frame.read_var("L")
+            valueType = value.type.strip_typedefs()
+            if valueType.code == gdb.TYPE_CODE_PTR and valueType.target().strip_typedefs().tag == "lua_State":
+                return value
+        except (ValueError, RuntimeError):
+            # no 'L' in this frame, or no debug information for it
+            pass
+        frame = frame.older()
+    return None
+
 class CallInfoValue(object):
     
     CIST_OAH = (1 << 0)
@@ -88,12 +132,12 @@ class CallInfoValue(object):
     def IsLua(self) -> bool:
         if self.callInfoPointer == None:
             return False
-        return (not (self.callInfoPointer['callstatus'] & CallInfoValue.CIST_C))
+        return (not (ValueField(self.callInfoPointer, 'callstatus') & CallInfoValue.CIST_C))
     
     def GetClosurePointer(self) -> gdb.Value:
-        tvaluePointer = self.callInfoPointer['func']['p']['val'].address
+        tvaluePointer = ValueField(self.callInfoPointer, 'func', 'p', 'val').address
         gcUnionPointer = CastTvaluePointer2GcUnionPointer(tvaluePointer)
-        return gcUnionPointer['cl'].address
+        return ValueField(gcUnionPointer, 'cl').address
     
     def GetCallInfoPointer(self) -> gdb.Value:
         return self.callInfoPointer
@@ -102,7 +146,7 @@ class CallInfoValue(object):
         if not self.IsLua():
             raise RuntimeError("not Lua CallInfo")
         closurePointer = self.GetClosurePointer()
-        return PcRel(self.callInfoPointer['u']['l']['savedpc'], closurePointer['l']['p'])
+        return PcRel(ValueField(self.callInfoPointer, 'u', 'l', 'savedpc'), ValueField(closurePointer, 'l', 'p'))
 
 
 class LuaType(IntEnum):
@@ -127,8 +171,6 @@ LuaType2TypeName = {}
 for typeEnum in LuaType:
     LuaType2TypeName[typeEnum] = typeEnum.name
 
-MAXIWTHABS = 128
-
 LUA_VLCL = MakeVariant(int(LuaType.LUA_TFUNCTION), 0)  # /* Lua closure */
 LUA_VLCF = MakeVariant(int(LuaType.LUA_TFUNCTION), 1)  # /* light C function */
 LUA_VCCL = MakeVariant(int(LuaType.LUA_TFUNCTION), 2)  # /* C closure */
@@ -139,13 +181,13 @@ LUA_VLNGSTR	= MakeVariant(LuaType.LUA_TSTRING, 1)
 
 def Getstr(tStringPointer: gdb.Value) -> str:
     length = Tsslen(tStringPointer)
-    return tStringPointer['contents'].string(length=length)
+    return ValueField(tStringPointer, 'contents').string(length=length)
 
 def Tsslen(tStringPointer: gdb.Value) -> int:
-    if int(tStringPointer['tt']) == LUA_VSHRSTR:
-        return int(tStringPointer['shrlen'])
+    if int(ValueField(tStringPointer, 'tt')) == LUA_VSHRSTR:
+        return int(ValueField(tStringPointer, 'shrlen'))
     else:
-        return int(tStringPointer['u']['lnglen'])
+        return int(ValueField(tStringPointer, 'u', 'lnglen'))
 
 LUA_VNUMINT = MakeVariant(LuaType.LUA_TNUMBER, 0)
 LUA_VNUMFLT = MakeVariant(LuaType.LUA_TNUMBER, 1)
@@ -154,10 +196,10 @@ def TtIsNumber(o: gdb.Value) -> bool:
     return CheckType(o, LuaType.LUA_TNUMBER)
 
 def TtIsFloat(o: gdb.Value) -> bool:
-    return CheckType(o, LUA_VNUMFLT)
+    return CheckTag(o, LUA_VNUMFLT)
 
 def TtIsInteger(o: gdb.Value) -> bool:
-    return CheckType(o, LUA_VNUMINT)
+    return CheckTag(o, LUA_VNUMINT)
 
 def NoLuaClosure(closurePointer: gdb.Value) -> bool:
     return closurePointer == None or closurePointer['c']['tt'] == LUA_VCCL
@@ -169,10 +211,10 @@ def TtIsBoolean(o: gdb.Value) -> bool:
     return CheckType(o, LuaType.LUA_TBOOLEAN)
 
 def TtIsFalse(o: gdb.Value) -> bool:
-    return CheckType(o, LUA_VFALSE)
+    return CheckTag(o, LUA_VFALSE)
 
 def TtIsTrue(o: gdb.Value) -> bool:
-    return CheckType(o, LUA_VTRUE)
+    return CheckTag(o, LUA_VTRUE)
 
 
 BIT_ISCOLLECTABLE = (1 << 6)
@@ -197,6 +239,27 @@ LUA_VPROTO = MakeVariant(LuaType.LUA_TPROTO, 0)
 LUA_VTHREAD = MakeVariant(LuaType.LUA_TTHREAD, 0)
 LUA_VUPVAL =  MakeVariant(LuaType.LUA_TUPVAL, 0)
 
+# lobject.h / lstate.h
+BITRAS = (1 << 7)
+EXTRA_STACK = 5
+
+def IsPow2(x: int) -> bool:
+    return (x & (x - 1)) == 0
+
+def LuaH_RealAsize(alimit: int, flags: int) -> int:
+    """
+    real size of the array part of a Table, from its 'alimit' and 'flags' (luaH_realasize in ltable.c)
+    """
+    if (not (flags & BITRAS)) or IsPow2(alimit):
+        return alimit
+    # /* compute the smallest power of 2 not smaller than 'n' */
+    size = alimit - 1
+    shift = 1
+    while shift < 64:
+        size |= size >> shift
+        shift <<= 1
+    return size + 1
+
 def CheckExp(exp: bool, r: any) -> any:
     if(not exp):
         raise RuntimeError("CheckExp exp is False")
@@ -267,55 +330,62 @@ def ClCValue(o: gdb.Value) -> gdb.Value:
     return CheckExp(TtIsCClosure(o), GCo2Ccl(Val_(o)['gc']))
 
 
-"""
-/*
-@@ LUA_IDSIZE gives the maximum size for the description of the source
-** of a function in debug information.
-** CHANGE it if you want a different size.
-*/
-"""
-LUA_IDSIZE = 60
-
-
-
 class TValueObj(object):
 
-    def __init__(self, tValuePointer) -> None:
+    def __init__(self, tValuePointer, tt: int = None, raw: int = None) -> None:
+        """
+        tt and raw are the already decoded 'tt_' and 'value_' (see memreader.IterTValues),
+        otherwise the whole TValue is read once from tValuePointer
+        """
         self.tValuePointer = tValuePointer
-    
+        self.tt = tt
+        self.raw = raw
+
+    def _Load(self) -> None:
+        if self.tt is None:
+            self.tt, self.raw = memreader.ReadTValue(int(self.tValuePointer))
+
     def GetType(self) -> LuaType:
-        return Ttype(self.tValuePointer)
+        self._Load()
+        return Novariant(self.tt)
 
     def GetTypeName(self) -> str:
-        return LuaType2TypeName[Ttype(self.tValuePointer)]
+        return LuaType2TypeName[self.GetType()]
     
     def GetValue(self) -> any:
         """
         return python obj
         """
 
+        if perfstats.enabled:
+            with perfstats.Phase("value decode"):
+                return self._DecodeValue()
+        return self._DecodeValue()
+
+    def _DecodeValue(self) -> any:
         tType = self.GetType()
-        value = self.tValuePointer['value_']
+        tag = WithVariant(self.tt)
+        value = self.raw
         if tType == LuaType.LUA_TNUMBER:
-            if TtIsInteger(self.tValuePointer):
-                return int(value['i'])
+            if tag == LUA_VNUMINT:
+                return memreader.RawToInteger(value)
             else:
-                return float(value['n'])
+                return memreader.RawToFloat(value)
         elif tType == LuaType.LUA_TBOOLEAN:
-            if TtIsTrue(self.tValuePointer):
+            if tag == LUA_VTRUE:
                 return True
             else:
                 return False
         elif tType == LuaType.LUA_TFUNCTION:
-            return str("((lua_CFunction *)" + str(value['f']) + ")")
+            return str("((lua_CFunction *)" + hex(value) + ")")
         elif tType == LuaType.LUA_TLIGHTUSERDATA:
-            return str("((void *)" + str(value['p']) + ")")
+            return str("((void *)" + hex(value) + ")")
         elif tType == LuaType.LUA_TNIL or tType == LuaType.LUA_TNONE:
             return None
         elif tType == LuaType.LUA_TSTRING:
-            return Getstr(value['p'])
+            return memreader.ReadTString(value)
         elif tType == LuaType.LUA_TTABLE:
-            return str("((struct Table *)" + str(value['p']) + ")")
+            return str("((struct Table *)" + hex(value) + ")")
 
 
 
@@ -0,0 +1,246 @@
+import gdb
+from typing import Dict, List
+import common
+import ldebug
+import lopcodes
+from lopcodes import OpCode, OpMode
+import memreader
+import typecache
+
+"""
+lua-disasm: the instructions of a Proto like luac -l, with the constants, upvalue names and
+local names they use, and the instruction a frame is executing.
+
+The code array is read with one read and split into its arguments by lopcodes.ReadCode, and cached
+with the Proto by ldebug.GetProtoCode. The constants are read with one read of k.
+"""
+
+PROTO_HEADER_FIELDS = ("tt", "numparams", "is_vararg", "maxstacksize", "sizeupvalues", "sizek", "sizecode",
+                       "sizelocvars", "sizep", "k", "p")
+
+# opcodes whose B or C is a signed argument (sB, sC in lopcodes.h)
+SIGNED_B_OPS = (OpCode.OP_EQI, OpCode.OP_LTI, OpCode.OP_LEI, OpCode.OP_GTI, OpCode.OP_GEI, OpCode.OP_MMBINI)
+SIGNED_C_OPS = (OpCode.OP_ADDI, OpCode.OP_SHRI, OpCode.OP_SHLI)
+
+# opcodes with the constant K[C]
+CONSTANT_C_OPS = (OpCode.OP_GETTABUP, OpCode.OP_GETFIELD, OpCode.OP_ADDK, OpCode.OP_SUBK, OpCode.OP_MULK,
+                  OpCode.OP_MODK, OpCode.OP_POWK, OpCode.OP_DIVK, OpCode.OP_IDIVK, OpCode.OP_BANDK,
+                  OpCode.OP_BORK, OpCode.OP_BXORK)
+# opcodes with RK(C), K[C] when the k bit is set
+RK_C_OPS = (OpCode.OP_SETTABUP, OpCode.OP_SETTABLE, OpCode.OP_SETI, OpCode.OP_SETFIELD, OpCode.OP_SELF)
+
+OP_NAMES = tuple(op.name[3:] for op in OpCode)
+OP_MODES = tuple(OpMode(modeBits & 7) for modeBits in lopcodes.OPMODES)
+
+_ESCAPES = {ord('"'): '\\"', ord("\\"): "\\\\", ord("\a"): "\\a", ord("\b"): "\\b", ord("\f"): "\\f",
+            ord("\n"): "\\n", ord("\r"): "\\r", ord("\t"): "\\t", ord("\v"): "\\v"}
+
+
+def FormatConstant(tt: int, raw: int) -> str:
+    """
+    PrintConstant in luac.c
+    """
+    tag = common.WithVariant(tt)
+    if tag == common.LUA_VFALSE:
+        return "false"
+    if tag == common.LUA_VTRUE:
+        return "true"
+    if tag == common.LUA_VNUMINT:
+        return str(memreader.RawToInteger(raw))
+    if tag == common.LUA_VNUMFLT:
+        value = "%.14g" % memreader.RawToFloat(raw)
+        # looks like an int?
+        return value if any(c not in "-0123456789" for c in value) else value + ".0"
+    if common.Novariant(tt) == common.LuaType.LUA_TSTRING:
+        return '"%s"' % memreader.ReadTString(raw).translate(_ESCAPES)
+    if common.Novariant(tt) == common.LuaType.LUA_TNIL:
+        return "nil"
+    return "?%d" % tt
+
+
+class Listing(object):
+    """
+    A Proto ready to be output instruction by instruction
+    """
+
+    def __init__(self, protoAddress: int, currentPc: int = -1):
+        self.protoAddress = protoAddress
+        self.currentPc = currentPc
+        (tt, self.numparams, self.isVararg, self.maxstacksize, self.sizeupvalues, self.sizek, self.sizecode,
+         self.sizelocvars, self.sizep, k, self.p) = memreader.ReadStruct(protoAddress, "Proto", PROTO_HEADER_FIELDS)
+        if tt != common.LUA_VPROTO:
+            raise gdb.GdbError("%s is not a Proto" % hex(protoAddress))
+        self.info = ldebug.GetProtoInfo(protoAddress)
+        self.protoCode = ldebug.GetProtoCode(protoAddress)
+        self.code = self.protoCode.code
+        lineTable = ldebug.GetLineTable(protoAddress)
+        self.lines = lineTable.lines if lineTable is not None else None
+        stride = typecache.Sizeof("TValue")
+        self.constants = [FormatConstant(tt, raw) for tt, raw in memreader.IterTValues(k, self.sizek, stride)]
+        # locals active at _activePc, the indexes of their LocVar, see LocalName
+        self._locvars = self.protoCode.LocVars()
+        self._endPcs = set(endpc for varname, startpc, endpc in self._locvars)
+        self._activePc = -1
+        self._active: List[int] = []
+        self._nextLocal = 0
+
+    def Header(self) -> List[str]:
+        """
+        PrintHeader in luac.c
+        """
+        what = "main" if self.info.linedefined == 0 else "function"
+        return [
+            "%s <%s:%d,%d> (%d instructions at %s)" % (what, self.info.shortSrc, self.info.linedefined,
+                                                       self.info.lastlinedefined, self.sizecode, hex(self.protoAddress)),
+            "%d%s params, %d slots, %d upvalues, %d locals, %d constants, %d functions" % (
+                self.numparams, "+" if self.isVararg else "", self.maxstacksize, self.sizeupvalues,
+                self.sizelocvars, self.sizek, self.sizep),
+        ]
+
+    def Line(self, pc: int) -> int:
+        if self.lines is None or pc >= len(self.lines):
+            return -1
+        return self.lines[pc]
+
+    def OpName(self, pc: int) -> str:
+        op = self.code.op[pc]
+        if op >= lopcodes.NUM_OPCODES:
+            return "OP_%d" % op
+        return OP_NAMES[op]
+
+    def LocalName(self, localNumber: int, pc: int) -> str:
+        """
+        ProtoCode.LocalName, with the active locals of the previous call updated when the listing goes forward
+        """
+        locvars = self._locvars
+        if pc < self._activePc:
+            self._active = []
+            self._nextLocal = 0
+        elif any(endpc in self._endPcs for endpc in range(self._activePc + 1, pc + 1)):
+            self._active = [index for index in self._active if pc < locvars[index][2]]
+        while self._nextLocal < len(locvars) and locvars[self._nextLocal][1] <= pc:
+            if pc < locvars[self._nextLocal][2]:
+                self._active.append(self._nextLocal)
+            self._nextLocal += 1
+        self._activePc = pc
+        if 0 < localNumber <= len(self._active):
+            return locvars[self._active[localNumber - 1]][0]
+        return None
+
+    def Arguments(self, pc: int) -> List[int]:
+        code = self.code
+        op = code.op[pc]
+        if op >= lopcodes.NUM_OPCODES:
+            return []
+        mode = OP_MODES[op]
+        if mode == OpMode.iABx:
+            return [code.a[pc], code.bx[pc]]
+        if mode == OpMode.iAsBx:
+            return [code.a[pc], code.SBx(pc)]
+        if mode == OpMode.iAx:
+            return [code.Ax(pc)]
+        if mode == OpMode.isJ:
+            return [code.SJ(pc)]
+        b = code.b[pc] - lopcodes.OFFSET_sC if op in SIGNED_B_OPS else code.b[pc]
+        c = code.SC(pc) if op in SIGNED_C_OPS else code.c[pc]
+        return [code.a[pc], b, c, code.k[pc]]
+
+    def _Constant(self, index: int) -> str:
+        if index < len(self.constants):
+            return self.constants[index]
+        return "?"
+
+    def Comment(self, pc: int) -> str:
+        """
+        what luac -l prints after ';', and the local in register A
+        """
+        code = self.code
+        op = code.op[pc]
+        parts = []
+        if op == OpCode.OP_LOADK:
+            parts.append(self._Constant(code.bx[pc]))
+        elif op == OpCode.OP_LOADKX and pc + 1 < len(code):
+            parts.append(self._Constant(code.Ax(pc + 1)))
+        elif op in (OpCode.OP_GETUPVAL, OpCode.OP_SETUPVAL):
+            parts.append(self.protoCode.UpvalueName(code.b[pc]))
+        elif op == OpCode.OP_SETTABUP:
+            parts.append(self.protoCode.UpvalueName(code.a[pc]))
+            parts.append(self._Constant(code.b[pc]))
+        elif op == OpCode.OP_SETFIELD:
+            parts.append(self._Constant(code.b[pc]))
+        elif op == OpCode.OP_EQK:
+            parts.append(self._Constant(code.b[pc]))
+        elif op in (OpCode.OP_MMBIN, OpCode.OP_MMBINI, OpCode.OP_MMBINK):
+            tm = code.c[pc]
+            parts.append(ldebug.TM_NAMES[tm] if tm < len(ldebug.TM_NAMES) else "?")
+        elif op == OpCode.OP_JMP:
+            parts.append("to %d" % (pc + code.SJ(pc) + 2))
+        elif op in (OpCode.OP_FORLOOP, OpCode.OP_TFORLOOP):
+            parts.append("to %d" % (pc - code.bx[pc] + 2))
+        elif op == OpCode.OP_FORPREP:
+            parts.append("exit to %d" % (pc + code.bx[pc] + 3))
+        elif op == OpCode.OP_TFORPREP:
+            parts.append("to %d" % (pc + code.bx[pc] + 2))
+        elif op == OpCode.OP_CLOSURE and code.bx[pc] < self.sizep:
+            parts.append(hex(memreader.ReadPointer(self.p + code.bx[pc] * typecache.Sizeof("void *"))))
+
+        if op == OpCode.OP_GETTABUP:
+            parts.append(self.protoCode.UpvalueName(code.b[pc]))
+        if op in CONSTANT_C_OPS or (op in RK_C_OPS and code.k[pc]):
+            parts.append(self._Constant(code.c[pc]))
+
+        if op < lopcodes.NUM_OPCODES and lopcodes.TestAMode(op):
+            # the local register A holds after the instruction, it starts at the next one when it declares it
+            name = self.LocalName(code.a[pc] + 1, pc + 1)
+            if name is not None:
+                parts.append("local " + name)
+        return " ".join(parts)
+
+    def Record(self, pc: int) -> Dict:
+        return {
+            "pc": pc + 1,
+            "line": self.Line(pc),
+            "op": self.OpName(pc),
+            "args": self.Arguments(pc),
+            "comment": self.Comment(pc),
+            "current": pc == self.currentPc,
+        }
+
+    def Format(self, pc: int) -> str:
+        arguments = self.Arguments(pc)
+        op = self.code.op[pc]
+        if op < lopcodes.NUM_OPCODES and OP_MODES[op] == OpMode.iABC:
+            text = "%d %d %d%s" % (arguments[0], arguments[1], arguments[2], "k" if arguments[3] else "")
+        else:
+            text = " ".join(str(argument) for argument in arguments)
+        comment = self.Comment(pc)
+        line = "%-3s%6d  %-7s %-10s %-14s%s" % ("=>" if pc == self.currentPc else "", pc + 1, "[%d]" % self.Line(pc),
+                                                self.OpName(pc), text, "; " + comment if comment else "")
+        return line.rstrip()
+
+
+def ResolveProto(address: int) -> int:
+    """
+    The Proto of a Lua closure, or address itself if it is a Proto
+    """
+    tt, = memreader.ReadStruct(address, "GCObject", ("tt",))
+    if tt == common.LUA_VPROTO:
+        return address
+    if tt == common.LUA_VLCL:
+        protoAddress, = memreader.ReadStruct(address, "LClosure", ("p",))
+        return protoAddress
+    raise gdb.GdbError("%s is not a Lua closure or a Proto" % hex(address))
+
+
+def GetFrameListing(luaStatePointer: gdb.Value, level: int) -> Listing:
+    """
+    The Proto running at level of the Lua stack, with the instruction it is executing
+    """
+    ar = ldebug.LuaDebug()
+    if not ldebug.LuaGetstack(luaStatePointer, level, ar):
+        raise gdb.GdbError("no level %d in the Lua stack" % level)
+    callInfoValue = common.CallInfoValue(luaStatePointer, ar.iCi)
+    if not callInfoValue.IsLua():
+        raise gdb.GdbError("level %d is not a Lua function" % level)
+    protoAddress = int(callInfoValue.GetClosurePointer()['l']['p'])
+    return Listing(protoAddress, callInfoValue.CurrentPc())
@@ -0,0 +1,107 @@
+import bisect
+import mmap
+import struct
+from typing import Iterator, List, Tuple
+
+"""
+Memory of an ELF core file, mapped with mmap.
+Only the PT_LOAD segments dumped in the core are readable, that is where the Lua heap and stacks live.
+"""
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ET_CORE = 4
+PT_LOAD = 1
+PF_W = 2
+
+
+class CoreMemoryError(Exception):
+    pass
+
+
+class Segment(object):
+
+    def __init__(self, vaddr: int, memsz: int, offset: int, filesz: int, flags: int):
+        self.vaddr = vaddr
+        self.memsz = memsz
+        self.offset = offset
+        self.filesz = filesz
+        self.flags = flags
+
+    def IsWritable(self) -> bool:
+        return bool(self.flags & PF_W)
+
+
+class CoreFile(object):
+
+    def __init__(self, path: str, memoryError=CoreMemoryError):
+        """
+        memoryError is the exception raised for unreadable addresses, like gdb.MemoryError
+        """
+        self.path = path
+        self.memoryError = memoryError
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.segments: List[Segment] = []
+        self._ParseHeaders()
+        self.segments.sort(key=lambda segment: segment.vaddr)
+        self._starts = [segment.vaddr for segment in self.segments]
+
+    def _ParseHeaders(self) -> None:
+        ident = bytes(self.view[:16])
+        if ident[:4] != b"\x7fELF":
+            raise ValueError("%s is not an ELF file" % self.path)
+        self.is64 = ident[4] == ELFCLASS64
+        self.byteOrder = "<" if ident[5] == ELFDATA2LSB else ">"
+        if self.is64:
+            header = struct.unpack_from(self.byteOrder + "16sHHIQQQIHHHHHH", self.view)
+            phdrFormat = struct.Struct(self.byteOrder + "IIQQQQQQ")
+        else:
+            header = struct.unpack_from(self.byteOrder + "16sHHIIIIIHHHHHH", self.view)
+            phdrFormat = struct.Struct(self.byteOrder + "IIIIIIII")
+        eType, phoff, phentsize, phnum = header[1], header[5], header[9], header[10]
+        if eType != ET_CORE:
+            raise ValueError("%s is not a core file" % self.path)
+        for i in range(phnum):
+            fields = phdrFormat.unpack_from(self.view, phoff + i * phentsize)
+            if self.is64:
+                pType, pFlags, pOffset, pVaddr, pPaddr, pFilesz, pMemsz, pAlign = fields
+            else:
+                pType, pOffset, pVaddr, pPaddr, pFilesz, pMemsz, pFlags, pAlign = fields
+            if pType == PT_LOAD and pFilesz > 0:
+                self.segments.append(Segment(pVaddr, pMemsz, pOffset, pFilesz, pFlags))
+
+    def _Find(self, address: int) -> Segment:
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i >= 0:
+            segment = self.segments[i]
+            if address < segment.vaddr + segment.filesz:
+                return segment
+        return None
+
+    def Read(self, address: int, length: int) -> memoryview:
+        segment = self._Find(address)
+        if segment is None:
+            raise self.memoryError("Cannot access memory at address %s" % hex(address))
+        start = segment.offset + address - segment.vaddr
+        available = segment.vaddr + segment.filesz - address
+        if length <= available:
+            return self.view[start: start + length]
+        # the range goes on in the next segment
+        return memoryview(bytes(self.view[start: start + available]) + bytes(self.Read(address + available, length - available)))
+
+    def IterWritableSegments(self) -> Iterator[Tuple[int, memoryview]]:
+        for segment in self.segments:
+            if segment.IsWritable():
+                yield segment.vaddr, self.view[segment.offset: segment.offset + segment.filesz]
+
+    def Close(self) -> None:
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # slices still referenced somewhere, the map is closed when they are collected
+            pass
+        self.file.close()
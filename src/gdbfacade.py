@@ -0,0 +1,534 @@
+import io
+import json
+import shlex
+import struct
+import sys
+import types
+from contextlib import redirect_stdout
+from typing import Dict, List
+
+"""
+A small stand-in for the gdb module, to run common.py, ldebug.py and the lua-* commands
+without gdb, on top of any memory that offers Read(address, length) (a core file, a capture...).
+
+Types come from the layout exported by layout.ExportLayout, values are read from the memory
+set with SetMemory. Only the part of the gdb API used by the plugin is provided.
+"""
+
+TYPE_CODE_PTR = 1
+TYPE_CODE_ARRAY = 2
+TYPE_CODE_STRUCT = 3
+TYPE_CODE_UNION = 4
+TYPE_CODE_ENUM = 5
+TYPE_CODE_FUNC = 7
+TYPE_CODE_INT = 8
+TYPE_CODE_FLT = 9
+TYPE_CODE_VOID = 10
+TYPE_CODE_CHAR = 20
+TYPE_CODE_BOOL = 21
+TYPE_CODE_TYPEDEF = 23
+
+COMMAND_NONE = -1
+COMMAND_DATA = 2
+COMMAND_STACK = 3
+COMMAND_USER = 13
+
+_KIND_CODES = {
+    "pointer": TYPE_CODE_PTR,
+    "array": TYPE_CODE_ARRAY,
+    "struct": TYPE_CODE_STRUCT,
+    "union": TYPE_CODE_UNION,
+    "enum": TYPE_CODE_ENUM,
+    "func": TYPE_CODE_FUNC,
+    "int": TYPE_CODE_INT,
+    "float": TYPE_CODE_FLT,
+    "void": TYPE_CODE_VOID,
+    "char": TYPE_CODE_CHAR,
+    "bool": TYPE_CODE_BOOL,
+    "typedef": TYPE_CODE_TYPEDEF,
+}
+
+
+class error(RuntimeError):
+    pass
+
+
+class MemoryError(error):
+    pass
+
+
+class GdbError(Exception):
+    pass
+
+
+_layout: dict = None
+_memory = None
+_symbols: Dict[str, "Value"] = {}
+_commands: Dict[str, "Command"] = {}
+_typeCache: Dict[str, "Type"] = {}
+
+
+def LoadLayout(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def SetLayout(layout: dict) -> None:
+    global _layout
+    _layout = layout
+    _typeCache.clear()
+
+
+def SetMemory(memory) -> None:
+    """
+    memory.Read(address, length) returns the bytes, or raises MemoryError
+    """
+    global _memory
+    _memory = memory
+
+
+def SetSymbol(name: str, value: "Value") -> None:
+    """
+    make parse_and_eval(name) return value, like the L of the C frame in gdb
+    """
+    _symbols[name] = value
+
+
+def _Read(address: int, length: int) -> memoryview:
+    if _memory is None:
+        raise MemoryError("no memory to read from")
+    return _memory.Read(address, length)
+
+
+class Field(object):
+
+    def __init__(self, name: str, bitpos: int, fieldType: "Type"):
+        self.name = name
+        self.bitpos = bitpos
+        self.bitsize = 0
+        self.type = fieldType
+        self.artificial = False
+        self.is_base_class = False
+
+
+class Type(object):
+
+    def __init__(self, key: str, desc: dict):
+        self.key = key
+        self.desc = desc
+        self.code = _KIND_CODES[desc["kind"]]
+        self.sizeof = desc["size"]
+        self.tag = desc.get("tag")
+        self.name = self.tag if self.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION) else key
+
+    def __str__(self) -> str:
+        return self.key
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Type) and other.key == self.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    @property
+    def is_signed(self) -> bool:
+        return self.desc.get("signed", False)
+
+    def strip_typedefs(self) -> "Type":
+        t = self
+        while t.code == TYPE_CODE_TYPEDEF:
+            t = t.target()
+        return t
+
+    def unqualified(self) -> "Type":
+        return self
+
+    def target(self) -> "Type":
+        if "target" not in self.desc:
+            raise RuntimeError("Type %s does not have a target." % self.key)
+        return lookup_type(self.desc["target"])
+
+    def pointer(self) -> "Type":
+        key = self.key + " *"
+        if key not in _layout["types"]:
+            _layout["types"][key] = {"kind": "pointer", "size": _layout["pointerSize"], "target": self.key}
+        return lookup_type(key)
+
+    def range(self):
+        return 0, self.desc["count"] - 1
+
+    def fields(self) -> List[Field]:
+        if "fields" not in self.desc:
+            raise TypeError("Type is not a structure, union, enum, or function type.")
+        return [Field(f["name"], f["offset"] * 8, lookup_type(f["type"])) for f in self.desc["fields"]]
+
+
+def lookup_type(name: str, block=None) -> Type:
+    name = " ".join(name.split())
+    t = _typeCache.get(name)
+    if t is None:
+        desc = _layout["types"].get(name) if _layout else None
+        if desc is None:
+            if name.endswith("*"):
+                return lookup_type(name[:-1]).pointer()
+            raise error("No type named %s." % name)
+        t = Type(name, desc)
+        _typeCache[name] = t
+    return t
+
+
+def _ScalarStruct(t: Type) -> struct.Struct:
+    if t.code == TYPE_CODE_FLT:
+        fmt = {4: "f", 8: "d"}[t.sizeof]
+    else:
+        fmt = {1: "b", 2: "h", 4: "i", 8: "q"}[t.sizeof]
+        if t.code == TYPE_CODE_PTR or not t.is_signed:
+            fmt = fmt.upper()
+    return struct.Struct(_layout["byteOrder"] + fmt)
+
+
+def _FindField(structType: Type, name: str):
+    for field in structType.fields():
+        if field.name == name:
+            return field.bitpos // 8, field.type
+        if field.name is None:
+            found = _FindField(field.type.strip_typedefs(), name)
+            if found is not None:
+                return field.bitpos // 8 + found[0], found[1]
+    return None
+
+
+class Value(object):
+    """
+    gdb.Value over the memory set with SetMemory.
+    A Value is either in memory (it has an address) or a plain number.
+    """
+
+    def __init__(self, val, valueType: Type = None):
+        if isinstance(val, Value):
+            valueType = valueType or val._type
+            self._type, self._address, self._scalar = valueType, val._address, val._scalar
+            return
+        if valueType is None:
+            valueType = lookup_type("double") if isinstance(val, float) else lookup_type("long")
+        self._type = valueType
+        self._address = None
+        self._scalar = val
+
+    @staticmethod
+    def _InMemory(valueType: Type, address: int) -> "Value":
+        value = Value.__new__(Value)
+        value._type = valueType
+        value._address = address
+        value._scalar = None
+        return value
+
+    @property
+    def type(self) -> Type:
+        return self._type
+
+    @property
+    def dynamic_type(self) -> Type:
+        return self._type
+
+    @property
+    def is_optimized_out(self) -> bool:
+        return False
+
+    @property
+    def address(self) -> "Value":
+        if self._address is None:
+            return None
+        return Value(self._address, self._type.pointer())
+
+    def _Number(self):
+        if self._scalar is None:
+            t = self._type.strip_typedefs()
+            if t.code == TYPE_CODE_ARRAY:
+                # arrays decay to a pointer to their first element
+                return self._address
+            if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+                raise error("Cannot convert value to int.")
+            self._scalar = _ScalarStruct(t).unpack_from(_Read(self._address, t.sizeof))[0]
+        return self._scalar
+
+    def __int__(self) -> int:
+        return int(self._Number())
+
+    def __index__(self) -> int:
+        return int(self._Number())
+
+    def __float__(self) -> float:
+        return float(self._Number())
+
+    def __bool__(self) -> bool:
+        return self._Number() != 0
+
+    def _Target(self) -> Type:
+        t = self._type.strip_typedefs()
+        if t.code in (TYPE_CODE_PTR, TYPE_CODE_ARRAY):
+            return t.target()
+        return None
+
+    def __getitem__(self, key) -> "Value":
+        t = self._type.strip_typedefs()
+        if isinstance(key, str):
+            if t.code == TYPE_CODE_PTR:
+                return self.dereference()[key]
+            if t.code not in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+                raise error("Attempt to extract a component of a value that is not a structure.")
+            found = _FindField(t, key)
+            if found is None:
+                raise error("There is no member named %s." % key)
+            return Value._InMemory(found[1], self._address + found[0])
+        target = self._Target()
+        if target is None:
+            raise error("Cannot subscript requested type.")
+        base = int(self._Number()) if t.code == TYPE_CODE_PTR else self._address
+        return Value._InMemory(target, base + int(key) * target.strip_typedefs().sizeof)
+
+    def dereference(self) -> "Value":
+        target = self._Target()
+        if target is None:
+            raise error("Attempt to take contents of a non-pointer value.")
+        return Value._InMemory(target, int(self))
+
+    def referenced_value(self) -> "Value":
+        return self.dereference()
+
+    def cast(self, targetType: Type) -> "Value":
+        stripped = targetType.strip_typedefs()
+        if stripped.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION, TYPE_CODE_ARRAY):
+            return Value._InMemory(targetType, self._address)
+        if stripped.code == TYPE_CODE_FLT:
+            return Value(float(self), targetType)
+        return Value(int(self), targetType)
+
+    reinterpret_cast = cast
+    dynamic_cast = cast
+
+    def fetch_lazy(self) -> None:
+        pass
+
+    def string(self, encoding: str = "utf-8", errors: str = "strict", length: int = -1) -> str:
+        t = self._type.strip_typedefs()
+        address = int(self._Number()) if t.code == TYPE_CODE_PTR else self._address
+        if length < 0:
+            data = bytearray()
+            while True:
+                chunk = bytes(_Read(address + len(data), 64))
+                end = chunk.find(b"\0")
+                if end >= 0:
+                    data += chunk[:end]
+                    break
+                data += chunk
+            return data.decode(encoding, errors)
+        return bytes(_Read(address, length)).decode(encoding, errors)
+
+    def _PointerStep(self) -> int:
+        return self._type.strip_typedefs().target().strip_typedefs().sizeof
+
+    def _IsPointer(self) -> bool:
+        return self._type.strip_typedefs().code == TYPE_CODE_PTR
+
+    def __add__(self, other) -> "Value":
+        if self._IsPointer():
+            return Value(int(self) + int(other) * self._PointerStep(), self._type)
+        return self._Number() + _Number(other)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        if self._IsPointer():
+            if isinstance(other, Value) and other._IsPointer():
+                return (int(self) - int(other)) // self._PointerStep()
+            return Value(int(self) - int(other) * self._PointerStep(), self._type)
+        return self._Number() - _Number(other)
+
+    def __rsub__(self, other):
+        return _Number(other) - self._Number()
+
+    def __mul__(self, other):
+        return self._Number() * _Number(other)
+
+    __rmul__ = __mul__
+
+    def __and__(self, other):
+        return int(self) & int(other)
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return int(self) | int(other)
+
+    __ror__ = __or__
+
+    def __neg__(self):
+        return -self._Number()
+
+    def __eq__(self, other) -> bool:
+        if other is None:
+            return False
+        return self._Number() == _Number(other)
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+
+    def __lt__(self, other) -> bool:
+        return self._Number() < _Number(other)
+
+    def __le__(self, other) -> bool:
+        return self._Number() <= _Number(other)
+
+    def __gt__(self, other) -> bool:
+        return self._Number() > _Number(other)
+
+    def __ge__(self, other) -> bool:
+        return self._Number() >= _Number(other)
+
+    __hash__ = None
+
+    def __str__(self) -> str:
+        t = self._type.strip_typedefs()
+        if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+            return "{...}"
+        if t.code == TYPE_CODE_PTR or t.code == TYPE_CODE_ARRAY:
+            return hex(int(self._Number()))
+        return str(self._Number())
+
+    def __repr__(self) -> str:
+        return "<gdbfacade.Value %s %s>" % (self._type, self)
+
+
+def _Number(value):
+    return value._Number() if isinstance(value, Value) else value
+
+
+class _Inferior(object):
+
+    pid = 0
+    num = 1
+
+    def read_memory(self, address, length) -> memoryview:
+        return _Read(int(address), int(length))
+
+
+_inferior = _Inferior()
+
+
+def selected_inferior() -> _Inferior:
+    return _inferior
+
+
+def parse_and_eval(expression: str) -> Value:
+    expression = expression.strip()
+    if expression in _symbols:
+        return _symbols[expression]
+    try:
+        return Value(int(expression, 0))
+    except ValueError:
+        raise error("No symbol \"%s\" in current context." % expression)
+
+
+def string_to_argv(args: str) -> List[str]:
+    return shlex.split(args)
+
+
+class Command(object):
+
+    def __init__(self, name: str, commandClass: int = COMMAND_NONE, completerClass: int = -1, prefix: bool = False):
+        _commands[name] = self
+
+    def dont_repeat(self) -> None:
+        pass
+
+
+def execute(command: str, from_tty: bool = False, to_string: bool = False):
+    command = command.strip()
+    if command == "show endian":
+        endian = "big" if _layout["byteOrder"] == ">" else "little"
+        result = "The target endianness is set automatically (currently %s endian).\n" % endian
+        return result if to_string else print(result, end="")
+    name, _, args = command.partition(" ")
+    if name not in _commands:
+        raise error("Undefined command: \"%s\"." % name)
+    if not to_string:
+        _commands[name].invoke(args, from_tty)
+        return None
+    output = io.StringIO()
+    with redirect_stdout(output):
+        _commands[name].invoke(args, from_tty)
+    return output.getvalue()
+
+
+def write(text: str, stream: int = 0) -> None:
+    sys.stdout.write(text)
+
+
+def flush(stream: int = 0) -> None:
+    sys.stdout.flush()
+
+
+def current_objfile():
+    return None
+
+
+class Breakpoint(object):
+    """
+    There is no program to stop, creating a breakpoint fails like in gdb without a symbol file
+    """
+
+    def __init__(self, spec: str, *args, **kwargs):
+        raise error("No symbol table is loaded.  Cannot set a breakpoint on \"%s\"." % spec)
+
+
+class BreakpointEvent(object):
+    pass
+
+
+class _EventRegistry(object):
+
+    def connect(self, callback) -> None:
+        pass
+
+    def disconnect(self, callback) -> None:
+        pass
+
+
+events = types.SimpleNamespace(
+    new_objfile=_EventRegistry(),
+    clear_objfiles=_EventRegistry(),
+    stop=_EventRegistry(),
+    cont=_EventRegistry(),
+    exited=_EventRegistry(),
+    before_prompt=_EventRegistry(),
+    breakpoint_deleted=_EventRegistry(),
+)
+
+
+class _RegexpCollectionPrettyPrinter(object):
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def add_printer(self, name: str, regexp: str, printer) -> None:
+        pass
+
+
+def _RegisterPrettyPrinter(objfile, printer, replace: bool = False) -> None:
+    pass
+
+
+printing = types.ModuleType("gdb.printing")
+printing.RegexpCollectionPrettyPrinter = _RegexpCollectionPrettyPrinter
+printing.register_pretty_printer = _RegisterPrettyPrinter
+
+
+def Install() -> None:
+    """
+    Make "import gdb" return this module, must be called before importing the plugin
+    """
+    module = sys.modules[__name__]
+    sys.modules["gdb"] = module
+    sys.modules["gdb.printing"] = printing
@@ -0,0 +1,271 @@
+import gdb
+import heapq
+import json
+import os
+import sys
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import common
+import lgc
+import memreader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Heap snapshots for leak hunting: every object of the GC lists as one entry of a few
+parallel arrays (address, type tag, size, Proto), saved to disk as raw arrays.
+The entries are sorted by address when the snapshot is taken, two snapshots are compared
+with numpy when it is available, otherwise by walking them together.
+"""
+
+SNAPSHOT_DIR_ENV = "LUA_GDB_SNAPSHOT_DIR"
+SNAPSHOT_SUFFIX = ".luasnap"
+# 2: entries sorted by address
+SNAPSHOT_VERSION = 2
+
+# protos[i] of an object without Proto
+NO_PROTO = 0
+
+MAX_SIZE = 0xFFFFFFFF
+
+# entries sorted at once by SortByAddress without numpy, the others are merged
+SORT_RUN = 1 << 16
+# after the last address of a snapshot
+END_ADDRESS = 1 << 64
+
+
+def SnapshotPath(name: str) -> str:
+    """
+    name is a path when it has a '/' or the suffix, otherwise it goes to $LUA_GDB_SNAPSHOT_DIR (default .)
+    """
+    if os.sep in name or name.endswith(SNAPSHOT_SUFFIX):
+        return name
+    return os.path.join(os.environ.get(SNAPSHOT_DIR_ENV) or ".", name + SNAPSHOT_SUFFIX)
+
+
+class HeapSnapshot(object):
+    """
+    Entry i is the object at addresses[i], with type tag tags[i] and estimated size sizes[i].
+    Taken and saved snapshots are sorted by address.
+    For Lua closures and Protos, protoNames[protos[i]] is the "source:linedefined" of the Proto,
+    protoNames[0] is "" for the other objects.
+    """
+
+    # (attribute, typecode), in the order of the file
+    ARRAYS = (("addresses", "Q"), ("sizes", "I"), ("protos", "I"), ("tags", "B"))
+
+    def __init__(self):
+        self.addresses = array("Q")
+        self.tags = array("B")
+        self.sizes = array("I")
+        self.protos = array("I")
+        self.protoNames: List[str] = [""]
+        self._protoIndexes: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def _ProtoIndex(self, proto: int) -> int:
+        index = self._protoIndexes.get(proto)
+        if index is None:
+            source, linedefined = memreader.ReadStruct(proto, "Proto", ("source", "linedefined"))
+            name = memreader.ReadTString(source) if source else "=?"
+            if name[:1] in ("@", "="):
+                name = name[1:]
+            index = len(self.protoNames)
+            self.protoNames.append("%s:%d" % (name, linedefined))
+            self._protoIndexes[proto] = index
+        return index
+
+    def Add(self, address: int, tt: int) -> None:
+        self.addresses.append(address)
+        self.tags.append(tt)
+        self.sizes.append(min(lgc.ObjectSize(address, tt), MAX_SIZE))
+        if tt == common.LUA_VLCL:
+            proto, = memreader.ReadStruct(address, "LClosure", ("p",))
+            self.protos.append(self._ProtoIndex(proto))
+        elif tt == common.LUA_VPROTO:
+            self.protos.append(self._ProtoIndex(address))
+        else:
+            self.protos.append(NO_PROTO)
+
+    def SortByAddress(self) -> None:
+        """
+        Reorder the arrays by address. Without numpy, runs of SORT_RUN entries are sorted and
+        merged with heapq, only the run being sorted has a Python int per entry.
+        """
+        count = len(self)
+        if count < 2:
+            return
+        addresses = self.addresses
+        if numpy is not None:
+            order = numpy.argsort(numpy.frombuffer(addresses, dtype=numpy.uint64), kind="stable")
+            for attribute, typecode in self.ARRAYS:
+                values = array(typecode)
+                values.frombytes(numpy.frombuffer(getattr(self, attribute), dtype=typecode)[order].tobytes())
+                setattr(self, attribute, values)
+            return
+        runs = [array("L", sorted(range(start, min(start + SORT_RUN, count)), key=addresses.__getitem__))
+                for start in range(0, count, SORT_RUN)]
+        merged = heapq.merge(*(zip(map(addresses.__getitem__, run), run) for run in runs))
+        order = array("L", (index for address, index in merged))
+        del runs
+        for attribute, typecode in self.ARRAYS:
+            setattr(self, attribute, array(typecode, map(getattr(self, attribute).__getitem__, order)))
+
+    def Save(self, path: str) -> None:
+        """
+        One JSON line of header, then the raw arrays
+        """
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "count": len(self),
+            "byteOrder": sys.byteorder,
+            "arrays": [[attribute, typecode, getattr(self, attribute).itemsize] for attribute, typecode in self.ARRAYS],
+            "protoNames": self.protoNames,
+        }
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for attribute, typecode in self.ARRAYS:
+                getattr(self, attribute).tofile(f)
+
+    @classmethod
+    def Load(cls, path: str) -> "HeapSnapshot":
+        snapshot = cls()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            if header.get("version") != SNAPSHOT_VERSION:
+                raise gdb.GdbError("%s: unknown snapshot version %s" % (path, header.get("version")))
+            for attribute, typecode, itemsize in header["arrays"]:
+                values = array(typecode)
+                if values.itemsize != itemsize:
+                    raise gdb.GdbError("%s: saved with a different array layout" % path)
+                values.fromfile(f, header["count"])
+                if header["byteOrder"] != sys.byteorder:
+                    values.byteswap()
+                setattr(snapshot, attribute, values)
+        snapshot.protoNames = header["protoNames"]
+        return snapshot
+
+
+def TakeSnapshot(globalStateAddress: int) -> HeapSnapshot:
+    snapshot = HeapSnapshot()
+    with memreader.ReadAhead():
+        for listName, address, tt, marked in lgc.IterGCObjects(globalStateAddress):
+            snapshot.Add(address, tt)
+    snapshot.SortByAddress()
+    return snapshot
+
+
+class HeapDiff(object):
+    """
+    Objects of the second snapshot that were already in the first (same address, tag and Proto)
+    are surviving, the others are new. Objects only in the first snapshot are freed.
+    byTag[tt] and byProto["source:linedefined"] are [new count, new bytes, surviving count, surviving bytes],
+    freedByTag[tt] is [count, bytes].
+    """
+
+    def __init__(self):
+        self.byTag: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        self.byProto: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        self.freedByTag: Dict[int, List[int]] = defaultdict(lambda: [0, 0])
+
+
+def _Entry(snapshot: HeapSnapshot, i: int) -> Tuple[int, str]:
+    return snapshot.tags[i], snapshot.protoNames[snapshot.protos[i]]
+
+
+def _AddFreed(diff: HeapDiff, before: HeapSnapshot, i: int) -> None:
+    diff.freedByTag[before.tags[i]][0] += 1
+    diff.freedByTag[before.tags[i]][1] += before.sizes[i]
+
+
+def _DiffWithMerge(before: HeapSnapshot, after: HeapSnapshot) -> HeapDiff:
+    """
+    Walk the two snapshots, sorted by address, together
+    """
+    diff = HeapDiff()
+    addressesA = before.addresses
+    countA = len(addressesA)
+    a = 0
+    addressA = addressesA[0] if countA else END_ADDRESS
+    for j, address in enumerate(after.addresses):
+        while addressA < address:
+            _AddFreed(diff, before, a)
+            a += 1
+            addressA = addressesA[a] if a < countA else END_ADDRESS
+        tt, protoName = _Entry(after, j)
+        surviving = False
+        if addressA == address:
+            surviving = _Entry(before, a) == (tt, protoName)
+            if not surviving:
+                # another object at the address of a freed one
+                _AddFreed(diff, before, a)
+            a += 1
+            addressA = addressesA[a] if a < countA else END_ADDRESS
+        slot = 2 if surviving else 0
+        diff.byTag[tt][slot] += 1
+        diff.byTag[tt][slot + 1] += after.sizes[j]
+        if protoName:
+            diff.byProto[protoName][slot] += 1
+            diff.byProto[protoName][slot + 1] += after.sizes[j]
+    for i in range(a, countA):
+        _AddFreed(diff, before, i)
+    return diff
+
+
+def _NumpyArrays(snapshot: HeapSnapshot):
+    return (numpy.frombuffer(snapshot.addresses, dtype=numpy.uint64),
+            numpy.frombuffer(snapshot.tags, dtype=numpy.uint8),
+            numpy.frombuffer(snapshot.sizes, dtype=numpy.uint32).astype(numpy.int64),
+            numpy.frombuffer(snapshot.protos, dtype=numpy.uint32))
+
+
+def _DiffWithNumpy(before: HeapSnapshot, after: HeapSnapshot) -> HeapDiff:
+    diff = HeapDiff()
+    addrA, tagsA, sizesA, protosA = _NumpyArrays(before)
+    addrB, tagsB, sizesB, protosB = _NumpyArrays(after)
+
+    # Proto indexes of the two snapshots are different, compare the names through a common numbering
+    names = sorted(set(before.protoNames) | set(after.protoNames))
+    numbering = {name: n for n, name in enumerate(names)}
+    protosA = numpy.array([numbering[name] for name in before.protoNames], dtype=numpy.int64)[protosA]
+    protosB = numpy.array([numbering[name] for name in after.protoNames], dtype=numpy.int64)[protosB]
+
+    # the snapshots are sorted by address
+    surviving = numpy.zeros(len(addrB), dtype=bool)
+    matchedA = numpy.zeros(len(addrA), dtype=bool)
+    if len(addrA):
+        positions = numpy.minimum(numpy.searchsorted(addrA, addrB), len(addrA) - 1)
+        surviving = (addrA[positions] == addrB) & (tagsA[positions] == tagsB) & (protosA[positions] == protosB)
+        matchedA[positions[surviving]] = True
+
+    for slot, mask in ((0, ~surviving), (2, surviving)):
+        counts = numpy.bincount(tagsB[mask], minlength=256)
+        bytesByTag = numpy.bincount(tagsB[mask], weights=sizesB[mask], minlength=256)
+        for tt in numpy.nonzero(counts)[0]:
+            diff.byTag[int(tt)][slot] += int(counts[tt])
+            diff.byTag[int(tt)][slot + 1] += int(bytesByTag[tt])
+        counts = numpy.bincount(protosB[mask], minlength=len(names))
+        bytesByProto = numpy.bincount(protosB[mask], weights=sizesB[mask], minlength=len(names))
+        for n in numpy.nonzero(counts)[0]:
+            if names[n]:
+                diff.byProto[names[n]][slot] += int(counts[n])
+                diff.byProto[names[n]][slot + 1] += int(bytesByProto[n])
+
+    freed = ~matchedA
+    counts = numpy.bincount(tagsA[freed], minlength=256)
+    bytesByTag = numpy.bincount(tagsA[freed], weights=sizesA[freed], minlength=256)
+    for tt in numpy.nonzero(counts)[0]:
+        diff.freedByTag[int(tt)] = [int(counts[tt]), int(bytesByTag[tt])]
+    return diff
+
+
+def DiffSnapshots(before: HeapSnapshot, after: HeapSnapshot) -> HeapDiff:
+    if numpy is not None:
+        return _DiffWithNumpy(before, after)
+    return _DiffWithMerge(before, after)
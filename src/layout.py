@@ -0,0 +1,179 @@
+import gdb
+import json
+import os
+from typing import Dict, Optional
+import luaconf
+import memreader
+import typecache
+
+"""
+Export the layout (sizes, offsets and field types) of the Lua structs to JSON.
+
+The exported description is what gdbfacade uses to run the plugin without gdb,
+on top of a core file or any other memory image. Written to typecache.ManifestPath(build-id)
+it is also the manifest that gdb sessions on the same binary load instead of the DWARF.
+"""
+
+LAYOUT_VERSION = typecache.MANIFEST_VERSION
+
+# functions only defined in the objfile that holds Lua
+LUA_SYMBOLS = ("lua_newstate", "luaV_execute")
+
+LAYOUT_TYPE_NAMES = typecache.LUA_TYPE_NAMES + (
+    "global_State",
+    "stringtable",
+    "GCObject",
+    "TString",
+    "Node",
+    "Closure",
+    "LClosure",
+    "CClosure",
+    "Udata",
+    "UValue",
+    "UpVal",
+    "LocVar",
+    "Upvaldesc",
+    "AbsLineInfo",
+    "Instruction",
+    "Value",
+    "lua_Integer",
+    "lua_Number",
+    "lua_Debug",
+    "void",
+    "long",
+)
+
+# not always present in the debug information
+OPTIONAL_TYPE_NAMES = ("LX", "LG", "Udata0")
+
+_TAG_PREFIX = {
+    gdb.TYPE_CODE_STRUCT: "struct ",
+    gdb.TYPE_CODE_UNION: "union ",
+    gdb.TYPE_CODE_ENUM: "enum ",
+}
+
+_SCALAR_KINDS = {
+    gdb.TYPE_CODE_INT: "int",
+    gdb.TYPE_CODE_CHAR: "char",
+    gdb.TYPE_CODE_BOOL: "bool",
+    gdb.TYPE_CODE_ENUM: "enum",
+}
+
+
+class _LayoutExporter(object):
+
+    def __init__(self):
+        self.types: Dict[str, dict] = {}
+
+    def Add(self, t: gdb.Type, anonymousName: str) -> str:
+        """
+        Describe t and every type it refers to, return the key of t.
+        Anonymous structs and unions are named after the field holding them, like "CallInfo.u".
+        """
+        code = t.code
+        if code == gdb.TYPE_CODE_TYPEDEF:
+            key = t.name
+            if key not in self.types:
+                self.types[key] = {"kind": "typedef", "size": int(t.sizeof)}
+                self.types[key]["target"] = self.Add(t.target(), key)
+            return key
+        if code == gdb.TYPE_CODE_PTR:
+            key = self.Add(t.target(), anonymousName + "*") + " *"
+            if key not in self.types:
+                self.types[key] = {"kind": "pointer", "size": int(t.sizeof), "target": key[:-2]}
+            return key
+        if code == gdb.TYPE_CODE_ARRAY:
+            low, high = t.range()
+            targetKey = self.Add(t.target(), anonymousName)
+            key = "%s [%d]" % (targetKey, high - low + 1)
+            if key not in self.types:
+                self.types[key] = {"kind": "array", "size": int(t.sizeof), "target": targetKey, "count": high - low + 1}
+            return key
+        if code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+            key = _TAG_PREFIX[code] + t.tag if t.tag else anonymousName
+            if key not in self.types:
+                desc = {"kind": "struct" if code == gdb.TYPE_CODE_STRUCT else "union", "size": int(t.sizeof), "tag": t.tag}
+                self.types[key] = desc
+                desc["fields"] = [{
+                    "name": field.name,
+                    "offset": field.bitpos // 8,
+                    "type": self.Add(field.type, "%s.%s" % (key, field.name)),
+                } for field in t.fields()]
+            return key
+        if code == gdb.TYPE_CODE_FUNC:
+            key = "function"
+            self.types.setdefault(key, {"kind": "func", "size": 1})
+            return key
+        if code == gdb.TYPE_CODE_VOID:
+            key = "void"
+            self.types.setdefault(key, {"kind": "void", "size": 1})
+            return key
+        if code == gdb.TYPE_CODE_FLT:
+            key = t.name
+            self.types.setdefault(key, {"kind": "float", "size": int(t.sizeof)})
+            return key
+        # integers, chars, bools and enums
+        key = _TAG_PREFIX[code] + t.tag if code == gdb.TYPE_CODE_ENUM and t.tag else (t.name or anonymousName)
+        if key not in self.types:
+            self.types[key] = {
+                "kind": _SCALAR_KINDS.get(code, "int"),
+                "size": int(t.sizeof),
+                "signed": memreader.ScalarFormat(t).islower(),
+            }
+        return key
+
+
+def LuaBuildId() -> Optional[str]:
+    """
+    build-id of the objfile holding Lua, the executable or a shared liblua
+    """
+    for symbolName in LUA_SYMBOLS:
+        symbol = gdb.lookup_global_symbol(symbolName)
+        if symbol is not None and symbol.symtab is not None:
+            return symbol.symtab.objfile.build_id
+    progspaceFile = gdb.current_progspace().filename
+    for objfile in gdb.objfiles():
+        if objfile.filename == progspaceFile:
+            return objfile.build_id
+    return None
+
+
+def BuildLayout() -> dict:
+    exporter = _LayoutExporter()
+    roots = []
+    for typeName in LAYOUT_TYPE_NAMES + OPTIONAL_TYPE_NAMES:
+        try:
+            t = typecache.LookupType(typeName)
+        except gdb.error:
+            if typeName in OPTIONAL_TYPE_NAMES:
+                continue
+            raise
+        key = exporter.Add(t, typeName)
+        if key != typeName:
+            exporter.types[typeName] = exporter.types[key]
+        roots.append(typeName)
+    return {
+        "version": LAYOUT_VERSION,
+        "byteOrder": memreader.ByteOrder(),
+        "pointerSize": typecache.Sizeof("void *"),
+        "roots": roots,
+        "types": exporter.types,
+        "options": luaconf.Detect(),
+    }
+
+
+def ExportLayout(path: str = None) -> str:
+    """
+    Write the layout of the current inferior to path and return the path.
+    Without path it goes to the manifest of the build-id, loaded by the next sessions.
+    """
+    layout = BuildLayout()
+    layout["buildId"] = LuaBuildId()
+    if path is None:
+        if layout["buildId"] is None:
+            raise gdb.GdbError("the binary has no build-id, give the output path")
+        path = typecache.ManifestPath(layout["buildId"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(layout, f, indent=1, sort_keys=True)
+    return path
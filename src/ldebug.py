@@ -1,6 +1,15 @@
 import gdb
-from typing import Tuple
+from array import array
+from itertools import accumulate, chain, islice
+from typing import Dict, Iterator, List, Optional, Tuple
 import common
+import luaconf
+import lopcodes
+from lopcodes import OpCode
+import memreader
+import objcache
+import perfstats
+import typecache
 
 
 # struct lua_Debug in lua.h
@@ -29,7 +38,7 @@ class LuaDebug(object):
 
 def LuaGetinfo(luaStatePointer: gdb.Value, whatStr: str, ar:LuaDebug) -> int:
     ci = ar.iCi
-    func = common.S2V(ci['func']['p'])
+    func = common.S2V(common.ValueField(ci, 'func', 'p'))
 
     cl = None
     if common.TtIsClosure(func):
@@ -59,12 +68,10 @@ def AuxGetInfo(luaStatePointer: gdb.Value, whatStr: str, ar:LuaDebug, closurePoi
         elif what == 't':
             ar.istailcall = (int(callInfoPointer['callstatus']) & common.CallInfoValue.CIST_TAIL) if callInfoPointer != None else 0
         elif what == 'n':
-            # It's too complicated
-            # ar.namewhat = GetFuncName(luaStatePointer, callInfoPointer)
-            # if ar.namewhat == "":
-            #     ar.namewhat = ""
-            #     ar.name = ""
-            pass
+            ar.namewhat, ar.name = GetFuncName(callInfoPointer)
+            if ar.namewhat is None:
+                ar.namewhat = ""
+                ar.name = None
         elif what == 'r':
             if callInfoPointer == None or  not (int(callInfoPointer['callstatus']) & common.CallInfoValue.CIST_TRAN):
                 ar.ftransfer = 0
@@ -87,51 +94,422 @@ def FuncInfo(ar: LuaDebug, closurePointer: gdb.Value)->None:
         ar.linedefined = -1
         ar.lastlinedefined = -1
         ar.what = "C"
+        LuaOChunkId(ar)
     else:
-        protoPoninter = closurePointer['l']['p']
-        
-        if protoPoninter['source']:
-            ar.source = common.Getstr(protoPoninter['source'])
-            ar.srclen = common.Tsslen(protoPoninter['source'])
-        else:
-            ar.source = "=?"
-            ar.srclen = 2
-        ar.linedefined = int(protoPoninter['linedefined'])
-        ar.lastlinedefined = int(protoPoninter['lastlinedefined'])
-        ar.what =  "main" if int(ar.linedefined) == 0 else "Lua"
-    LuaOChunkId(ar)
+        protoAddress, = memreader.ReadStruct(int(closurePointer), "LClosure", ("p",))
+        protoInfo = GetProtoInfo(protoAddress)
+        ar.source = protoInfo.source
+        ar.srclen = len(protoInfo.source)
+        ar.shortSrc = protoInfo.shortSrc
+        ar.linedefined = protoInfo.linedefined
+        ar.lastlinedefined = protoInfo.lastlinedefined
+        ar.what =  "main" if protoInfo.linedefined == 0 else "Lua"
+
+PROTO_INFO_FIELDS = ("tt", "source", "linedefined", "lastlinedefined")
+
+class ProtoInfo(object):
+    """
+    The part of a Proto used by FuncInfo, with its short source already built by LuaOChunkId.
+    Cached in objcache by Proto address.
+    """
+
+    def __init__(self, source: str, linedefined: int, lastlinedefined: int):
+        self.source = source
+        self.linedefined = linedefined
+        self.lastlinedefined = lastlinedefined
+        ar = LuaDebug()
+        ar.source = source
+        ar.srclen = len(source)
+        LuaOChunkId(ar)
+        self.shortSrc = ar.shortSrc
+
+def GetProtoInfo(protoAddress: int) -> ProtoInfo:
+    signature = memreader.ReadStruct(protoAddress, "Proto", PROTO_INFO_FIELDS)
+    protoInfo = objcache.Get("info", protoAddress, signature)
+    if protoInfo is not None:
+        return protoInfo
+    tt, source, linedefined, lastlinedefined = signature
+    protoInfo = ProtoInfo(memreader.ReadTString(source) if source else "=?", linedefined, lastlinedefined)
+    objcache.Put("info", protoAddress, signature, protoInfo, 2 * (len(protoInfo.source) + len(protoInfo.shortSrc)))
+    return protoInfo
 
 def GetCurrentLine(callInfoValue: common.CallInfoValue) -> int:
     if callInfoValue.IsLua():
-        clusurePointer = callInfoValue.GetClosurePointer()
-        callInfoPointer = callInfoValue.GetCallInfoPointer()
-        protoPointer = clusurePointer['l']['p']
-        savedpc = callInfoPointer['u']['l']['savedpc']
-        currentPc= savedpc - protoPointer['code'] - 1
-        return LuaG_Getfuncline(protoPointer, currentPc)
+        with perfstats.Phase("line lookup"):
+            clusurePointer = callInfoValue.GetClosurePointer()
+            callInfoPointer = callInfoValue.GetCallInfoPointer()
+            protoPointer = common.ValueField(clusurePointer, 'l', 'p')
+            savedpc = common.ValueField(callInfoPointer, 'u', 'l', 'savedpc')
+            currentPc= savedpc - common.ValueField(protoPointer, 'code') - 1
+            return LuaG_Getfuncline(protoPointer, currentPc)
     return -1
     
 
 def LuaG_Getfuncline(protoPointer: gdb.Value, currentPc: int) -> int:
-    if(protoPointer['lineinfo'] == None):
+    lineTable = GetLineTable(protoPointer)
+    if lineTable is None:
         return -1
-    else:
-        basePc, baseLine = LuaG_GetBaseLineInfo(protoPointer, currentPc)
-        while(basePc < currentPc):
-            basePc += 1
-            baseLine += int(protoPointer['lineinfo'][basePc])
-        return baseLine
+    currentPc = int(currentPc)
+    if 0 <= currentPc < len(lineTable.lines):
+        return lineTable.lines[currentPc]
+    # out of range pc (-1 before the function starts), same as the C code
+    basePc, baseLine = LuaG_GetBaseLineInfo(protoPointer, currentPc)
+    while(basePc < currentPc):
+        basePc += 1
+        baseLine += int(protoPointer['lineinfo'][basePc])
+    return baseLine
 
 def LuaG_GetBaseLineInfo(protoPointer: int, pc: int) -> Tuple[int, int]:
-    if protoPointer['sizeabslineinfo'] == 0 or pc < protoPointer['abslineinfo'][0].pc:
+    if protoPointer['sizeabslineinfo'] == 0 or pc < protoPointer['abslineinfo'][0]['pc']:
         return -1, int(protoPointer['linedefined'])
-    i = pc / common.MAXIWTHABS - 1
+    i = pc // luaconf.Get("MAXIWTHABS") - 1
     while(i + 1 < protoPointer['sizeabslineinfo'] and pc >= protoPointer['abslineinfo'][i + 1]['pc']):
         i += 1
     basePc = int(protoPointer['abslineinfo'][i]['pc'])
     baseLine = int(protoPointer['abslineinfo'][i]['line'])
     return basePc, baseLine
 
+
+# lineinfo of the instructions whose line is in abslineinfo, ldebug.h
+ABSLINEINFO = -0x80
+
+PROTO_LINE_FIELDS = ("tt", "lineinfo", "sizelineinfo", "abslineinfo", "sizeabslineinfo", "linedefined")
+
+class LineTable(object):
+    """
+    pc -> line of one Proto, lines[pc] is the line of instruction pc.
+    Cached in objcache by Proto address, with the Proto fields it was built from as signature.
+    """
+
+    def __init__(self, lines: array):
+        self.lines = lines
+
+def _BuildLines(lineinfo: int, sizelineinfo: int, abslineinfo: int, sizeabslineinfo: int, linedefined: int) -> array:
+    deltas = array('b', bytes(memreader.ReadMemory(lineinfo, sizelineinfo)))
+    absEntries = []
+    if sizeabslineinfo > 0:
+        decoder = memreader.GetDecoder("AbsLineInfo", ("pc", "line"))
+        buffer = memreader.ReadMemory(abslineinfo, sizeabslineinfo * decoder.size)
+        absEntries = [decoder.Decode(buffer, i * decoder.size) for i in range(sizeabslineinfo)]
+
+    # running sum of the deltas, restarted at every absolute line
+    lines = array('i')
+    line = linedefined
+    start = 0
+    for absPc, absLine in absEntries:
+        if absPc >= sizelineinfo:
+            break
+        if deltas[absPc] != ABSLINEINFO:
+            # not an instruction lcode.c gave an absolute line, the Proto is being built
+            continue
+        lines.extend(islice(accumulate(chain((line,), deltas[start:absPc])), 1, None))
+        lines.append(absLine)
+        line = absLine
+        start = absPc + 1
+    lines.extend(islice(accumulate(chain((line,), deltas[start:])), 1, None))
+    return lines
+
+def GetLineTable(protoPointer: gdb.Value) -> LineTable:
+    """
+    Line table of the Proto, built with two bulk reads the first time and cached by Proto address.
+    Return None if the Proto has no line information.
+    """
+    address = int(protoPointer)
+    signature = memreader.ReadStruct(address, "Proto", PROTO_LINE_FIELDS)
+    lineTable = objcache.Get("lines", address, signature)
+    if lineTable is not None:
+        return lineTable
+    tt, lineinfo, sizelineinfo, abslineinfo, sizeabslineinfo, linedefined = signature
+    if lineinfo == 0:
+        return None
+    with perfstats.Phase("proto decode"):
+        lineTable = LineTable(_BuildLines(lineinfo, sizelineinfo, abslineinfo, sizeabslineinfo, linedefined))
+    objcache.Put("lines", address, signature, lineTable, lineTable.lines.itemsize * len(lineTable.lines))
+    return lineTable
+
+
+LUA_ENV = "_ENV"
+
+# names of the TMS enum in ltm.h, without the "__"
+TM_NAMES = (
+    "index", "newindex", "gc", "mode", "len", "eq", "add", "sub", "mul", "mod", "pow", "div", "idiv",
+    "band", "bor", "bxor", "shl", "shr", "unm", "bnot", "lt", "le", "concat", "call", "close",
+)
+TM_INDEX, TM_NEWINDEX, TM_GC, TM_MODE, TM_LEN, TM_EQ = 0, 1, 2, 3, 4, 5
+TM_UNM, TM_BNOT, TM_LT, TM_LE, TM_CONCAT, TM_CALL, TM_CLOSE = 18, 19, 20, 21, 22, 23, 24
+
+# metamethod called by each opcode, see funcnamefromcode
+_OPCODE_TM = {
+    OpCode.OP_SELF: TM_INDEX, OpCode.OP_GETTABUP: TM_INDEX, OpCode.OP_GETTABLE: TM_INDEX,
+    OpCode.OP_GETI: TM_INDEX, OpCode.OP_GETFIELD: TM_INDEX,
+    OpCode.OP_SETTABUP: TM_NEWINDEX, OpCode.OP_SETTABLE: TM_NEWINDEX,
+    OpCode.OP_SETI: TM_NEWINDEX, OpCode.OP_SETFIELD: TM_NEWINDEX,
+    OpCode.OP_UNM: TM_UNM, OpCode.OP_BNOT: TM_BNOT, OpCode.OP_LEN: TM_LEN,
+    OpCode.OP_CONCAT: TM_CONCAT, OpCode.OP_EQ: TM_EQ,
+    OpCode.OP_LT: TM_LT, OpCode.OP_LTI: TM_LT, OpCode.OP_GTI: TM_LT,
+    OpCode.OP_LE: TM_LE, OpCode.OP_LEI: TM_LE, OpCode.OP_GEI: TM_LE,
+    OpCode.OP_CLOSE: TM_CLOSE, OpCode.OP_RETURN: TM_CLOSE,
+}
+
+PROTO_CODE_FIELDS = ("tt", "code", "sizecode", "k", "sizek", "locvars", "sizelocvars", "upvalues", "sizeupvalues")
+
+class ProtoCode(object):
+    """
+    Decoded instructions of one Proto, with its local variables, upvalue names
+    and string constants read on first use. Cached in objcache by Proto address like LineTable.
+    """
+
+    def __init__(self, signature: Tuple, code: lopcodes.DecodedCode):
+        self.signature = signature
+        self.code = code
+        self._locvars: List[Tuple[str, int, int]] = None
+        self._upvalueNames: List[Optional[str]] = None
+        self._constants: Dict[int, Optional[str]] = {}
+
+    def LocVars(self) -> List[Tuple[str, int, int]]:
+        """
+        (varname, startpc, endpc) of every LocVar
+        """
+        if self._locvars is None:
+            locvars, sizelocvars = self.signature[5], self.signature[6]
+            decoder = memreader.GetDecoder("LocVar", ("varname", "startpc", "endpc"))
+            buffer = memreader.ReadMemory(locvars, sizelocvars * decoder.size) if sizelocvars > 0 else b""
+            self._locvars = []
+            for i in range(sizelocvars):
+                varname, startpc, endpc = decoder.Decode(buffer, i * decoder.size)
+                self._locvars.append((memreader.ReadTString(varname) if varname else None, startpc, endpc))
+        return self._locvars
+
+    def UpvalueNames(self) -> List[Optional[str]]:
+        """
+        name of every Upvaldesc, None when it has no name
+        """
+        if self._upvalueNames is None:
+            upvalues, sizeupvalues = self.signature[7], self.signature[8]
+            decoder = memreader.GetDecoder("Upvaldesc", ("name",))
+            buffer = memreader.ReadMemory(upvalues, sizeupvalues * decoder.size) if sizeupvalues > 0 else b""
+            self._upvalueNames = []
+            for i in range(sizeupvalues):
+                name, = decoder.Decode(buffer, i * decoder.size)
+                self._upvalueNames.append(memreader.ReadTString(name) if name else None)
+        return self._upvalueNames
+
+    def UpvalueName(self, index: int) -> str:
+        upvalueNames = self.UpvalueNames()
+        if index >= len(upvalueNames) or upvalueNames[index] is None:
+            return "?"
+        return upvalueNames[index]
+
+    def StringConstant(self, index: int) -> Optional[str]:
+        """
+        k[index] if it is a string, otherwise None
+        """
+        if index not in self._constants:
+            k, sizek = self.signature[3], self.signature[4]
+            value = None
+            if index < sizek:
+                tt, raw = memreader.ReadTValue(k + index * typecache.Sizeof("TValue"))
+                if common.Novariant(tt) == common.LuaType.LUA_TSTRING:
+                    value = memreader.ReadTString(raw)
+            self._constants[index] = value
+        return self._constants[index]
+
+    def EstimatedSize(self) -> int:
+        """
+        bytes of the decoded code, the names are small next to it
+        """
+        code = self.code
+        return sum(values.itemsize * len(values) for values in (code.code, code.op, code.a, code.b, code.c, code.k, code.bx))
+
+    def LocalName(self, localNumber: int, pc: int) -> Optional[str]:
+        """
+        luaF_getlocalname
+        """
+        for varname, startpc, endpc in self.LocVars():
+            if startpc > pc:
+                break
+            if pc < endpc:
+                localNumber -= 1
+                if localNumber == 0:
+                    return varname
+        return None
+
+def GetProtoCode(protoAddress: int) -> ProtoCode:
+    """
+    Decoded code of the Proto, read with one read the first time and cached by Proto address
+    """
+    signature = memreader.ReadStruct(protoAddress, "Proto", PROTO_CODE_FIELDS)
+    protoCode = objcache.Get("code", protoAddress, signature)
+    if protoCode is not None:
+        return protoCode
+    with perfstats.Phase("proto decode"):
+        protoCode = ProtoCode(signature, lopcodes.ReadCode(signature[1], signature[2]))
+    objcache.Put("code", protoAddress, signature, protoCode, protoCode.EstimatedSize())
+    return protoCode
+
+def FilterPc(pc: int, jmptarget: int) -> int:
+    # is code conditional (inside a jump)?
+    return -1 if pc < jmptarget else pc
+
+def FindSetReg(p: ProtoCode, lastpc: int, reg: int) -> int:
+    """
+    findsetreg, the last instruction before lastpc that changed reg
+    """
+    code = p.code
+    op, a, b = code.op, code.a, code.b
+    setreg = -1
+    jmptarget = 0
+    if lopcodes.TestMMMode(op[lastpc]):
+        # previous instruction was not actually executed
+        lastpc -= 1
+    for pc in range(lastpc):
+        o = op[pc]
+        if o == OpCode.OP_LOADNIL:
+            change = a[pc] <= reg <= a[pc] + b[pc]
+        elif o == OpCode.OP_TFORCALL:
+            change = reg >= a[pc] + 2
+        elif o == OpCode.OP_CALL or o == OpCode.OP_TAILCALL:
+            change = reg >= a[pc]
+        elif o == OpCode.OP_JMP:
+            dest = pc + 1 + code.SJ(pc)
+            # jump does not skip 'lastpc' and is larger than current one?
+            if dest <= lastpc and dest > jmptarget:
+                jmptarget = dest
+            change = False
+        else:
+            change = lopcodes.TestAMode(o) and reg == a[pc]
+        if change:
+            setreg = FilterPc(pc, jmptarget)
+    return setreg
+
+def KName(p: ProtoCode, c: int) -> str:
+    name = p.StringConstant(c)
+    return "?" if name is None else name
+
+def RName(p: ProtoCode, pc: int, c: int) -> str:
+    what, name = GetObjName(p, pc, c)
+    # did not find a constant?
+    if what != "constant":
+        return "?"
+    return name
+
+def RKName(p: ProtoCode, pc: int) -> str:
+    c = p.code.c[pc]
+    if p.code.k[pc]:
+        return KName(p, c)
+    return RName(p, pc, c)
+
+def Gxf(p: ProtoCode, pc: int, isup: bool) -> str:
+    t = p.code.b[pc]
+    if isup:
+        name = p.UpvalueName(t)
+    else:
+        what, name = GetObjName(p, pc, t)
+    return "global" if name == LUA_ENV else "field"
+
+def GetObjName(p: ProtoCode, lastpc: int, reg: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    getobjname, return (namewhat, name) of the value in register reg at lastpc,
+    namewhat is None when no reasonable name is found
+    """
+    name = p.LocalName(reg + 1, lastpc)
+    if name is not None:
+        return "local", name
+    # else try symbolic execution
+    code = p.code
+    pc = FindSetReg(p, lastpc, reg)
+    if pc != -1:
+        op = code.op[pc]
+        if op == OpCode.OP_MOVE:
+            b = code.b[pc]
+            # move from 'b' to 'a'
+            if b < code.a[pc]:
+                return GetObjName(p, pc, b)
+        elif op == OpCode.OP_GETTABUP:
+            return Gxf(p, pc, True), KName(p, code.c[pc])
+        elif op == OpCode.OP_GETTABLE:
+            return Gxf(p, pc, False), RName(p, pc, code.c[pc])
+        elif op == OpCode.OP_GETI:
+            return "field", "integer index"
+        elif op == OpCode.OP_GETFIELD:
+            return Gxf(p, pc, False), KName(p, code.c[pc])
+        elif op == OpCode.OP_GETUPVAL:
+            return "upvalue", p.UpvalueName(code.b[pc])
+        elif op == OpCode.OP_LOADK or op == OpCode.OP_LOADKX:
+            b = code.bx[pc] if op == OpCode.OP_LOADK else code.Ax(pc + 1)
+            name = p.StringConstant(b)
+            if name is not None:
+                return "constant", name
+        elif op == OpCode.OP_SELF:
+            return "method", RKName(p, pc)
+    return None, None
+
+def FuncNameFromCode(p: ProtoCode, pc: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    funcnamefromcode, name of the function called by instruction pc
+    """
+    code = p.code
+    op = code.op[pc]
+    if op == OpCode.OP_CALL or op == OpCode.OP_TAILCALL:
+        return GetObjName(p, pc, code.a[pc])
+    if op == OpCode.OP_TFORCALL:
+        return "for iterator", "for iterator"
+    if op in (OpCode.OP_MMBIN, OpCode.OP_MMBINI, OpCode.OP_MMBINK):
+        tm = code.c[pc]
+    else:
+        tm = _OPCODE_TM.get(op)
+        if tm is None:
+            return None, None
+    return "metamethod", TM_NAMES[tm] if tm < len(TM_NAMES) else "?"
+
+CALLINFO_NAME_FIELDS = ("callstatus", "previous", "func.p", "u.l.savedpc")
+
+def FuncNameFromCall(callInfoAddress: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    funcnamefromcall, name of the function called by the CallInfo at callInfoAddress
+    """
+    callstatus, previous, func, savedpc = memreader.ReadStruct(callInfoAddress, "CallInfo", CALLINFO_NAME_FIELDS)
+    if callstatus & common.CallInfoValue.CIST_HOOKED:
+        return "hook", "?"
+    if callstatus & common.CallInfoValue.CIST_FIN:
+        return "metamethod", "__gc"
+    if callstatus & common.CallInfoValue.CIST_C:
+        return None, None
+    tt, closure = memreader.ReadTValue(func)
+    if tt != common.Ctb(common.LUA_VLCL):
+        return None, None
+    protoAddress, = memreader.ReadStruct(closure, "LClosure", ("p",))
+    p = GetProtoCode(protoAddress)
+    pc = (savedpc - p.signature[1]) // typecache.Sizeof("Instruction") - 1
+    if not 0 <= pc < len(p.code):
+        return None, None
+    return FuncNameFromCode(p, pc)
+
+def GetFuncName(callInfoPointer: gdb.Value) -> Tuple[Optional[str], Optional[str]]:
+    """
+    getfuncname, (namewhat, name) of the function running in callInfoPointer,
+    found from the instruction of the caller that called it
+    """
+    if callInfoPointer == None:
+        return None, None
+    callstatus, previous = memreader.ReadStruct(int(callInfoPointer), "CallInfo", ("callstatus", "previous"))
+    # calling function is a known function?
+    if callstatus & common.CallInfoValue.CIST_TAIL or previous == 0:
+        return None, None
+    return FuncNameFromCall(previous)
+
+def GetFuncDescription(ar: LuaDebug) -> str:
+    """
+    pushfuncname in lauxlib.c without the search in package.loaded, needs 'S' and 'n'
+    """
+    if ar.namewhat:
+        return "%s '%s'" % (ar.namewhat, ar.name)
+    if ar.what == "main":
+        return "main chunk"
+    if ar.what != "C":
+        return "function <%s:%d>" % (ar.shortSrc, ar.linedefined)
+    return "?"
+
 def LuaGetstack(luaStatePointer: gdb.Value, level: int, ar: LuaDebug):
 
     status = 0
@@ -151,13 +529,34 @@ def LuaGetstack(luaStatePointer: gdb.Value, level: int, ar: LuaDebug):
     
     return status
 
+def IterStackInfo(luaStatePointer: gdb.Value, whatStr: str = "Slnt", start: int = 0):
+    """
+    Yield a LuaDebug filled with whatStr for every level of the Lua stack from level start, innermost first.
+    The CallInfo list is walked once, the levels before start are skipped without being decoded.
+    """
+    baseCi = luaStatePointer['base_ci'].address
+    ci = luaStatePointer['ci']
+    level = 0
+    while ci != baseCi:
+        ar = None
+        # the time spent by the caller between two levels is not in the phase
+        with perfstats.Phase("frame walk"):
+            if level >= start:
+                ar = LuaDebug()
+                ar.iCi = ci
+                LuaGetinfo(luaStatePointer, whatStr, ar)
+            level += 1
+            ci = common.ValueField(ci, 'previous')
+        if ar is not None:
+            yield ar
+
 def LuaOChunkId(ar: LuaDebug):
 
     RETS = "..."
     PRE	= "[string \""
     POS = "\"]"
 
-    buffLen = common.LUA_IDSIZE
+    buffLen = luaconf.Get("LUA_IDSIZE")
     srclen = ar.srclen
     ar.shortSrc = ""
     if ar.source[0] == "=":
@@ -195,21 +594,35 @@ def LuaGetLocal(L: gdb.Value, ci: gdb.Value, n: int) -> Tuple[str, gdb.Value]:
     return LuaG_FindLocal(L, callInfo, n)
 
 
+def IterLocals(L: gdb.Value, ci: gdb.Value, start: int = 1) -> Iterator[Tuple[int, str, gdb.Value]]:
+    """
+    yield (n, name, StackValue *) of the locals of ci like lua_getlocal, from the n-th one
+    """
+    callInfo = common.CallInfoValue(L, ci)
+    n = start
+    while True:
+        name, pos = LuaG_FindLocal(L, callInfo, n)
+        if int(pos) == 0:
+            return
+        yield n, name, pos
+        n += 1
+
+
 def LuaG_FindLocal(L: gdb.Value, callInfo: common.CallInfoValue, n: int) -> Tuple[str, gdb.Value]:
     callInfoPointer = callInfo.GetCallInfoPointer()
-    base = callInfoPointer['func']['p'] + 1
+    base = common.ValueField(callInfoPointer, 'func', 'p') + 1
     name = ""
     if callInfo.IsLua():
         if n < 0:
             return FingVararg(callInfo, n)
         else:
             closurePointer = callInfo.GetClosurePointer()
-            name = LuaF_GetLocalName(closurePointer['l']['p'], n, callInfo.CurrentPc())
+            name = LuaF_GetLocalName(common.ValueField(closurePointer, 'l', 'p'), n, callInfo.CurrentPc())
     if name == "":
-        if L['ci'] == callInfoPointer:
-            limit = L['top']['p']
+        if common.ValueField(L, 'ci') == callInfoPointer:
+            limit = common.ValueField(L, 'top', 'p')
         else:
-            limit = callInfoPointer['next']['func']['p']
+            limit = common.ValueField(callInfoPointer, 'next', 'func', 'p')
         if limit - base >= n and n > 0:
             name = "(temporary)" if callInfo.IsLua() else "(C temporary)"
         else:
@@ -219,23 +632,31 @@ def LuaG_FindLocal(L: gdb.Value, callInfo: common.CallInfoValue, n: int) -> Tupl
 
 def FingVararg(callInfo: common.CallInfoValue, n: int) -> Tuple[str, gdb.Value]:
     ci = callInfo.GetCallInfoPointer()
-    if common.ClLvalue(common.S2V(ci['func']['p'])['p']['is_vararg']) :
-        nextra = ci['u']['l']['nextraargs']
+    func = common.ValueField(ci, 'func', 'p')
+    if common.ValueField(common.ClLvalue(common.S2V(func)), 'p', 'is_vararg') :
+        nextra = common.ValueField(ci, 'u', 'l', 'nextraargs')
         if n >= -nextra:
-            pos = ci['func']['p'] - nextra - (n + 1)
+            pos = func - nextra - (n + 1)
             return "vararg", pos
     return "", common.Cast2TargetTypePointer(gdb.Value(0), "StackValue")
 
 
 def LuaF_GetLocalName(proto: gdb.Value, localNumber: int, pc: int) -> str:
-    i = 0
-    while i < int(proto['sizelocvars']) and int(proto['locvars'][i]['startpc']) <= pc:
-        if(pc < int(proto['locvars'][i]['endpc'])):
-            localNumber = localNumber - 1
-            if(localNumber == 0):
-                return common.Getstr(proto['locvars'][i]['varname'])
-        i = i + 1
-    return ""
+    name = GetProtoCode(int(proto)).LocalName(localNumber, int(pc))
+    return "" if name is None else name
+
+
+def IterUpValues(tValuePointer: gdb.Value, start: int = 1) -> Iterator[Tuple[int, str, common.TValueObj]]:
+    """
+    yield (n, name, TValueObj) of the upvalues of the closure in tValuePointer, from the n-th one
+    """
+    n = start
+    while True:
+        name, tValueObj = AuxUpValue(tValuePointer, n)
+        if not tValueObj:
+            return
+        yield n, name, tValueObj
+        n += 1
 
 
 def AuxUpValue(tValuePointer: gdb.Value, n: int) -> Tuple[str, common.Tvalue] :
@@ -250,14 +671,14 @@ def AuxUpValue(tValuePointer: gdb.Value, n: int) -> Tuple[str, common.Tvalue] :
     elif typeTag == common.LUA_VLCL:
         lClosurePointer = common.ClLvalue(tValuePointer)
         # common.RemovePrint("lClosurePointer = %s", lClosurePointer)
-        protoPointer = lClosurePointer['p']
-        if(n - 1 >= protoPointer['sizeupvalues']):
+        upvalueNames = GetProtoCode(int(lClosurePointer['p'])).UpvalueNames()
+        if(n - 1 >= len(upvalueNames)):
             return "", None
         tValueObj = common.TValueObj(lClosurePointer['upvals'][n - 1]['v']['p'])
-        name = protoPointer['upvalues'][n - 1]['name']
-        if name == "":
+        name = upvalueNames[n - 1]
+        if name is None:
             return "(no name)", tValueObj
         else:
-            return common.Getstr(name), tValueObj
+            return name, tValueObj
     else:
         return "", None
\ No newline at end of file
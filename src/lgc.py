@@ -0,0 +1,310 @@
+import gdb
+from typing import Dict, Iterator, List, Sequence, Tuple
+import common
+import memreader
+import typecache
+
+"""
+Walk the collectable objects of a Lua state, the same lists lgc.c sweeps.
+Every object costs one header read, use it inside memreader.ReadAhead()
+so that objects allocated close to each other share one read_memory call.
+"""
+
+# global_State lists holding collectable objects
+GC_LISTS = ("allgc", "finobj", "tobefnz", "fixedgc")
+
+# kinds of Garbage Collection
+KGC_INC = 0
+KGC_GEN = 1
+
+# In generational mode 'allgc' and 'finobj' are split into age groups by these pointers,
+# every group starts at the object the pointer points to and ends at the next group.
+GEN_SEGMENTS = {
+    "allgc": ("survival", "old1", "reallyold"),
+    "finobj": ("finobjsur", "finobjold1", "finobjrold"),
+}
+
+# gcstate, the GCS* values of lgc.h
+GC_STATE_NAMES = ("propagate", "enteratomic", "atomic", "swpallgc", "swpfinobj", "swptobefnz", "swpend", "callfin", "pause")
+GCS_PAUSE = 8
+
+# gcstp bits
+GCSTPUSR = 1
+GCSTPGC = 2
+GCSTPCLS = 4
+
+# the lists of gray objects, linked through the gclist field of the objects
+GRAY_LISTS = ("gray", "grayagain", "weak", "ephemeron", "allweak")
+
+# the struct holding gclist, for the types that can be gray (getgclist in lgc.c)
+GCLIST_TYPE_NAMES = {
+    common.LUA_VTABLE: "Table",
+    common.LUA_VLCL: "LClosure",
+    common.LUA_VCCL: "CClosure",
+    common.LUA_VTHREAD: "lua_State",
+    common.LUA_VPROTO: "Proto",
+    common.LUA_VUSERDATA: "Udata",
+}
+
+# ages of the objects in generational mode, the 3 low bits of marked
+AGE_BITS = 7
+AGE_NAMES = ("new", "survival", "old0", "old1", "old", "touched1", "touched2")
+
+GC_TAG_NAMES = {
+    common.LUA_VSHRSTR: "short string",
+    common.LUA_VLNGSTR: "long string",
+    common.LUA_VTABLE: "table",
+    common.LUA_VLCL: "Lua closure",
+    common.LUA_VCCL: "C closure",
+    common.LUA_VUSERDATA: "userdata",
+    common.LUA_VTHREAD: "thread",
+    common.LUA_VPROTO: "proto",
+    common.LUA_VUPVAL: "upvalue",
+}
+
+
+def GetTagName(tt: int) -> str:
+    return GC_TAG_NAMES.get(tt, "tag %d" % tt)
+
+
+def GetGlobalState(luaStatePointer: gdb.Value) -> int:
+    return int(luaStatePointer['l_G'])
+
+
+def IterGCList(head: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    yield (address, tt, marked) for every object of the list starting at head
+    """
+    decoder = memreader.GetDecoder("GCObject", ("next", "tt", "marked"))
+    address = head
+    while address:
+        nextAddress, tt, marked = decoder.Read(address)
+        yield address, tt, marked
+        address = nextAddress
+
+
+def IterGCObjects(globalStateAddress: int, lists: Sequence[str] = GC_LISTS) -> Iterator[Tuple[str, int, int, int]]:
+    """
+    yield (list name, address, tt, marked) for every object in the given global_State lists.
+    In generational mode the list name is the age group, like "survival" or "old1".
+    """
+    fields = ["gckind"] + list(lists)
+    for listName in lists:
+        fields.extend(GEN_SEGMENTS.get(listName, ()))
+    values = dict(zip(fields, memreader.ReadStruct(globalStateAddress, "global_State", fields)))
+
+    for listName in lists:
+        segments = {}
+        if values["gckind"] == KGC_GEN:
+            # an empty group starts where the next one does, the older group wins
+            for segmentName in GEN_SEGMENTS.get(listName, ()):
+                if values[segmentName]:
+                    segments[values[segmentName]] = segmentName
+        label = listName
+        for address, tt, marked in IterGCList(values[listName]):
+            label = segments.get(address, label)
+            yield label, address, tt, marked
+
+
+def IterGrayList(head: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    yield (address, tt, marked) for every object of a gray list starting at head
+    """
+    visited = set()
+    address = head
+    while address and address not in visited:
+        visited.add(address)
+        tt, marked = memreader.ReadStruct(address, "GCObject", ("tt", "marked"))
+        yield address, tt, marked
+        typeName = GCLIST_TYPE_NAMES.get(tt)
+        if typeName is None:
+            # not an object that can be gray, the list is corrupted
+            break
+        address, = memreader.ReadStruct(address, typeName, ("gclist",))
+
+
+def IterThreads(globalStateAddress: int) -> Iterator[int]:
+    """
+    yield the address of every lua_State, the main thread first
+    """
+    # the main thread is not on the GC lists
+    mainthread, = memreader.ReadStruct(globalStateAddress, "global_State", ("mainthread",))
+    yield mainthread
+    for listName, address, tt, marked in IterGCObjects(globalStateAddress):
+        if tt == common.LUA_VTHREAD and address != mainthread:
+            yield address
+
+def _SizeofString(address: int, tt: int) -> int:
+    shrlen, lnglen = memreader.ReadStruct(address, "TString", ("shrlen", "u.lnglen"))
+    length = shrlen if tt == common.LUA_VSHRSTR else lnglen
+    # sizelstring in lstring.h
+    return typecache.Offsetof("TString", "contents") + length + 1
+
+
+def _SizeofTable(address: int, tt: int) -> int:
+    alimit, flags, lsizenode, lastfree = memreader.ReadStruct(address, "Table", ("alimit", "flags", "lsizenode", "lastfree"))
+    size = typecache.Sizeof("Table")
+    if lastfree:
+        # not the dummy node
+        size += (1 << lsizenode) * typecache.Sizeof("Node")
+    size += common.LuaH_RealAsize(alimit, flags) * typecache.Sizeof("TValue")
+    return size
+
+
+def _SizeofLClosure(address: int, tt: int) -> int:
+    nupvalues, = memreader.ReadStruct(address, "LClosure", ("nupvalues",))
+    return typecache.Offsetof("LClosure", "upvals") + typecache.Sizeof("void *") * nupvalues
+
+
+def _SizeofCClosure(address: int, tt: int) -> int:
+    nupvalues, = memreader.ReadStruct(address, "CClosure", ("nupvalues",))
+    return typecache.Offsetof("CClosure", "upvalue") + typecache.Sizeof("TValue") * nupvalues
+
+
+def _SizeofUserdata(address: int, tt: int) -> int:
+    nuvalue, length = memreader.ReadStruct(address, "Udata", ("nuvalue", "len"))
+    if nuvalue == 0:
+        try:
+            return typecache.Offsetof("Udata0", "bindata") + length
+        except gdb.error:
+            # Udata0 is not always in the debug information
+            pass
+    return typecache.Offsetof("Udata", "uv") + typecache.Sizeof("UValue") * nuvalue + length
+
+
+def _SizeofThread(address: int, tt: int) -> int:
+    stack, stackLast, nci = memreader.ReadStruct(address, "lua_State", ("stack.p", "stack_last.p", "nci"))
+    try:
+        size = typecache.Sizeof("LX")
+    except gdb.error:
+        size = typecache.Sizeof("lua_State") + typecache.Sizeof("void *")
+    stackValueSize = typecache.Sizeof("StackValue")
+    if stack:
+        size += ((stackLast - stack) // stackValueSize + common.EXTRA_STACK) * stackValueSize
+    size += nci * typecache.Sizeof("CallInfo")
+    return size
+
+
+PROTO_SIZE_FIELDS = ("sizecode", "sizep", "sizek", "sizelineinfo", "sizeabslineinfo", "sizelocvars", "sizeupvalues")
+
+def _SizeofProto(address: int, tt: int) -> int:
+    sizecode, sizep, sizek, sizelineinfo, sizeabslineinfo, sizelocvars, sizeupvalues = \
+        memreader.ReadStruct(address, "Proto", PROTO_SIZE_FIELDS)
+    # luaF_freeproto in lfunc.c
+    return (typecache.Sizeof("Proto")
+            + sizecode * typecache.Sizeof("Instruction")
+            + sizep * typecache.Sizeof("void *")
+            + sizek * typecache.Sizeof("TValue")
+            + sizelineinfo
+            + sizeabslineinfo * typecache.Sizeof("AbsLineInfo")
+            + sizelocvars * typecache.Sizeof("LocVar")
+            + sizeupvalues * typecache.Sizeof("Upvaldesc"))
+
+
+def _SizeofUpVal(address: int, tt: int) -> int:
+    return typecache.Sizeof("UpVal")
+
+
+_sizeofFunctions = {
+    common.LUA_VSHRSTR: _SizeofString,
+    common.LUA_VLNGSTR: _SizeofString,
+    common.LUA_VTABLE: _SizeofTable,
+    common.LUA_VLCL: _SizeofLClosure,
+    common.LUA_VCCL: _SizeofCClosure,
+    common.LUA_VUSERDATA: _SizeofUserdata,
+    common.LUA_VTHREAD: _SizeofThread,
+    common.LUA_VPROTO: _SizeofProto,
+    common.LUA_VUPVAL: _SizeofUpVal,
+}
+
+
+def ObjectSize(address: int, tt: int) -> int:
+    """
+    Bytes allocated for the object, including its arrays (what lgc.c frees for it)
+    """
+    sizeofFunction = _sizeofFunctions.get(tt)
+    if sizeofFunction is None:
+        return 0
+    return sizeofFunction(address, tt)
+
+
+class HeapStats(object):
+    """
+    count and bytes per type tag and per list
+    """
+
+    def __init__(self):
+        self.countByTag: Dict[int, int] = {}
+        self.bytesByTag: Dict[int, int] = {}
+        self.countByList: Dict[str, int] = {}
+        self.bytesByList: Dict[str, int] = {}
+
+    def Add(self, listName: str, tt: int, size: int) -> None:
+        self.countByTag[tt] = self.countByTag.get(tt, 0) + 1
+        self.bytesByTag[tt] = self.bytesByTag.get(tt, 0) + size
+        self.countByList[listName] = self.countByList.get(listName, 0) + 1
+        self.bytesByList[listName] = self.bytesByList.get(listName, 0) + size
+
+
+def CollectHeapStats(globalStateAddress: int) -> HeapStats:
+    stats = HeapStats()
+    with memreader.ReadAhead():
+        for listName, address, tt, marked in IterGCObjects(globalStateAddress):
+            stats.Add(listName, tt, ObjectSize(address, tt))
+    return stats
+
+
+GC_STATE_FIELDS = ("gcstate", "gckind", "gcstp", "gcemergency", "totalbytes", "GCdebt", "GCestimate", "lastatomic",
+                   "gcpause", "gcstepmul", "gcstepsize", "genminormul", "genmajormul", "currentwhite")
+
+
+class GCState(object):
+    """
+    the collector fields of global_State, the gray lists and, in generational mode, the objects per age
+    """
+
+    def __init__(self, fields: Dict[str, int]):
+        self.fields = fields
+        # gray list name -> [count, bytes]
+        self.grayLists: Dict[str, List[int]] = {}
+        # age -> [count, bytes], only in generational mode
+        self.ages: Dict[int, List[int]] = {}
+
+    def IsGenerational(self) -> bool:
+        return self.fields["gckind"] == KGC_GEN
+
+    def StateName(self) -> str:
+        gcstate = self.fields["gcstate"]
+        if 0 <= gcstate < len(GC_STATE_NAMES):
+            return GC_STATE_NAMES[gcstate]
+        return "state %d" % gcstate
+
+    def TotalBytes(self) -> int:
+        # gettotalbytes in lstate.h
+        return self.fields["totalbytes"] + self.fields["GCdebt"]
+
+
+def GetGCParam(value: int) -> int:
+    # getgcparam in lgc.h, pause and multipliers are stored divided by 4
+    return value * 4
+
+
+def CollectGCState(globalStateAddress: int) -> GCState:
+    fields = GC_STATE_FIELDS + GRAY_LISTS
+    state = GCState(dict(zip(fields, memreader.ReadStruct(globalStateAddress, "global_State", fields))))
+
+    with memreader.ReadAhead():
+        for listName in GRAY_LISTS:
+            counts = state.grayLists[listName] = [0, 0]
+            for address, tt, marked in IterGrayList(state.fields[listName]):
+                counts[0] += 1
+                counts[1] += ObjectSize(address, tt)
+
+        if state.IsGenerational():
+            for listName, address, tt, marked in IterGCObjects(globalStateAddress):
+                counts = state.ages.get(marked & AGE_BITS)
+                if counts is None:
+                    counts = state.ages[marked & AGE_BITS] = [0, 0]
+                counts[0] += 1
+                counts[1] += ObjectSize(address, tt)
+    return state
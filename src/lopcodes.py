@@ -0,0 +1,308 @@
+import sys
+from array import array
+from enum import IntEnum
+import memreader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Lua 5.4 instruction format and opcodes, lopcodes.h and lopcodes.c.
+A code array is split into its arguments with numpy when it is available, one mask over the
+whole array per argument, otherwise with one pass per argument over the instructions.
+"""
+
+SIZE_OP = 7
+SIZE_A = 8
+SIZE_B = 8
+SIZE_C = 8
+SIZE_Bx = SIZE_C + SIZE_B + 1
+SIZE_Ax = SIZE_Bx + SIZE_A
+SIZE_sJ = SIZE_Bx + SIZE_A
+
+POS_OP = 0
+POS_A = POS_OP + SIZE_OP
+POS_k = POS_A + SIZE_A
+POS_B = POS_k + 1
+POS_C = POS_B + SIZE_B
+POS_Bx = POS_k
+POS_Ax = POS_A
+POS_sJ = POS_A
+
+MAXARG_Bx = (1 << SIZE_Bx) - 1
+OFFSET_sBx = MAXARG_Bx >> 1
+MAXARG_sJ = (1 << SIZE_sJ) - 1
+OFFSET_sJ = MAXARG_sJ >> 1
+MAXARG_C = (1 << SIZE_C) - 1
+OFFSET_sC = MAXARG_C >> 1
+
+
+class OpMode(IntEnum):
+    iABC = 0
+    iABx = 1
+    iAsBx = 2
+    iAx = 3
+    isJ = 4
+
+
+class OpCode(IntEnum):
+    OP_MOVE = 0
+    OP_LOADI = 1
+    OP_LOADF = 2
+    OP_LOADK = 3
+    OP_LOADKX = 4
+    OP_LOADFALSE = 5
+    OP_LFALSESKIP = 6
+    OP_LOADTRUE = 7
+    OP_LOADNIL = 8
+    OP_GETUPVAL = 9
+    OP_SETUPVAL = 10
+    OP_GETTABUP = 11
+    OP_GETTABLE = 12
+    OP_GETI = 13
+    OP_GETFIELD = 14
+    OP_SETTABUP = 15
+    OP_SETTABLE = 16
+    OP_SETI = 17
+    OP_SETFIELD = 18
+    OP_NEWTABLE = 19
+    OP_SELF = 20
+    OP_ADDI = 21
+    OP_ADDK = 22
+    OP_SUBK = 23
+    OP_MULK = 24
+    OP_MODK = 25
+    OP_POWK = 26
+    OP_DIVK = 27
+    OP_IDIVK = 28
+    OP_BANDK = 29
+    OP_BORK = 30
+    OP_BXORK = 31
+    OP_SHRI = 32
+    OP_SHLI = 33
+    OP_ADD = 34
+    OP_SUB = 35
+    OP_MUL = 36
+    OP_MOD = 37
+    OP_POW = 38
+    OP_DIV = 39
+    OP_IDIV = 40
+    OP_BAND = 41
+    OP_BOR = 42
+    OP_BXOR = 43
+    OP_SHL = 44
+    OP_SHR = 45
+    OP_MMBIN = 46
+    OP_MMBINI = 47
+    OP_MMBINK = 48
+    OP_UNM = 49
+    OP_BNOT = 50
+    OP_NOT = 51
+    OP_LEN = 52
+    OP_CONCAT = 53
+    OP_CLOSE = 54
+    OP_TBC = 55
+    OP_JMP = 56
+    OP_EQ = 57
+    OP_LT = 58
+    OP_LE = 59
+    OP_EQK = 60
+    OP_EQI = 61
+    OP_LTI = 62
+    OP_LEI = 63
+    OP_GTI = 64
+    OP_GEI = 65
+    OP_TEST = 66
+    OP_TESTSET = 67
+    OP_CALL = 68
+    OP_TAILCALL = 69
+    OP_RETURN = 70
+    OP_RETURN0 = 71
+    OP_RETURN1 = 72
+    OP_FORLOOP = 73
+    OP_FORPREP = 74
+    OP_TFORPREP = 75
+    OP_TFORCALL = 76
+    OP_TFORLOOP = 77
+    OP_SETLIST = 78
+    OP_CLOSURE = 79
+    OP_VARARG = 80
+    OP_VARARGPREP = 81
+    OP_EXTRAARG = 82
+
+NUM_OPCODES = len(OpCode)
+
+
+def _OpModeBits(mm: int, ot: int, it: int, t: int, a: int, mode: OpMode) -> int:
+    return (mm << 7) | (ot << 6) | (it << 5) | (t << 4) | (a << 3) | int(mode)
+
+# luaP_opmodes in lopcodes.c, indexed by opcode
+#              MM OT IT T  A  mode
+OPMODES = (
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_MOVE
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iAsBx),  # OP_LOADI
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iAsBx),  # OP_LOADF
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_LOADK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_LOADKX
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_LOADFALSE
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_LFALSESKIP
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_LOADTRUE
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_LOADNIL
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_GETUPVAL
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_SETUPVAL
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_GETTABUP
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_GETTABLE
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_GETI
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_GETFIELD
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_SETTABUP
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_SETTABLE
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_SETI
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_SETFIELD
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_NEWTABLE
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SELF
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_ADDI
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_ADDK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SUBK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_MULK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_MODK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_POWK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_DIVK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_IDIVK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BANDK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BORK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BXORK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SHRI
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SHLI
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_ADD
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SUB
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_MUL
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_MOD
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_POW
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_DIV
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_IDIV
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BAND
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BOR
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BXOR
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SHL
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_SHR
+    _OpModeBits(1, 0, 0, 0, 0, OpMode.iABC),   # OP_MMBIN
+    _OpModeBits(1, 0, 0, 0, 0, OpMode.iABC),   # OP_MMBINI
+    _OpModeBits(1, 0, 0, 0, 0, OpMode.iABC),   # OP_MMBINK
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_UNM
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_BNOT
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_NOT
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_LEN
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABC),   # OP_CONCAT
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_CLOSE
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_TBC
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.isJ),    # OP_JMP
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_EQ
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_LT
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_LE
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_EQK
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_EQI
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_LTI
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_LEI
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_GTI
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_GEI
+    _OpModeBits(0, 0, 0, 1, 0, OpMode.iABC),   # OP_TEST
+    _OpModeBits(0, 0, 0, 1, 1, OpMode.iABC),   # OP_TESTSET
+    _OpModeBits(0, 1, 1, 0, 1, OpMode.iABC),   # OP_CALL
+    _OpModeBits(0, 1, 1, 0, 1, OpMode.iABC),   # OP_TAILCALL
+    _OpModeBits(0, 0, 1, 0, 0, OpMode.iABC),   # OP_RETURN
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_RETURN0
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_RETURN1
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_FORLOOP
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_FORPREP
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABx),   # OP_TFORPREP
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iABC),   # OP_TFORCALL
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_TFORLOOP
+    _OpModeBits(0, 0, 1, 0, 0, OpMode.iABC),   # OP_SETLIST
+    _OpModeBits(0, 0, 0, 0, 1, OpMode.iABx),   # OP_CLOSURE
+    _OpModeBits(0, 1, 0, 0, 1, OpMode.iABC),   # OP_VARARG
+    _OpModeBits(0, 0, 1, 0, 1, OpMode.iABC),   # OP_VARARGPREP
+    _OpModeBits(0, 0, 0, 0, 0, OpMode.iAx),    # OP_EXTRAARG
+)
+
+
+def GetOpMode(op: int) -> OpMode:
+    return OpMode(OPMODES[op] & 7)
+
+def TestAMode(op: int) -> bool:
+    return bool(OPMODES[op] & (1 << 3))
+
+def TestTMode(op: int) -> bool:
+    return bool(OPMODES[op] & (1 << 4))
+
+def TestITMode(op: int) -> bool:
+    return bool(OPMODES[op] & (1 << 5))
+
+def TestOTMode(op: int) -> bool:
+    return bool(OPMODES[op] & (1 << 6))
+
+def TestMMMode(op: int) -> bool:
+    return bool(OPMODES[op] & (1 << 7))
+
+
+def _Mask(size: int) -> int:
+    return (1 << size) - 1
+
+
+def _Field(code: array, pos: int, size: int, typecode: str) -> array:
+    """
+    (i >> pos) & MASK1(size, 0) of every instruction i of code, as an array of typecode
+    """
+    values = array(typecode)
+    if numpy is not None:
+        instructions = numpy.frombuffer(code, dtype=numpy.dtype("u%d" % code.itemsize))
+        fields = (instructions >> pos) & _Mask(size)
+        values.frombytes(fields.astype(numpy.dtype("u%d" % values.itemsize)).tobytes())
+    else:
+        values.extend((i >> pos) & _Mask(size) for i in code)
+    return values
+
+
+class DecodedCode(object):
+    """
+    The instructions of one Proto split into one array per argument,
+    op[pc], a[pc], b[pc], c[pc], k[pc], bx[pc] are GET_OPCODE, GETARG_A... of code[pc].
+    Ax and sJ, only used by a few opcodes, are computed from code[pc].
+    """
+
+    def __init__(self, code: array):
+        self.code = code
+        self.op = _Field(code, POS_OP, SIZE_OP, 'B')
+        self.a = _Field(code, POS_A, SIZE_A, 'B')
+        self.b = _Field(code, POS_B, SIZE_B, 'B')
+        self.c = _Field(code, POS_C, SIZE_C, 'B')
+        self.k = _Field(code, POS_k, 1, 'B')
+        self.bx = _Field(code, POS_Bx, SIZE_Bx, 'I')
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def Ax(self, pc: int) -> int:
+        return (self.code[pc] >> POS_Ax) & _Mask(SIZE_Ax)
+
+    def SBx(self, pc: int) -> int:
+        return self.bx[pc] - OFFSET_sBx
+
+    def SJ(self, pc: int) -> int:
+        return ((self.code[pc] >> POS_sJ) & _Mask(SIZE_sJ)) - OFFSET_sJ
+
+    def SC(self, pc: int) -> int:
+        return self.c[pc] - OFFSET_sC
+
+
+def ReadCode(address: int, sizecode: int) -> DecodedCode:
+    """
+    Read sizecode instructions at address with one read and decode them
+    """
+    buffer = memreader.ReadMemory(address, sizecode * 4)
+    code = array('I' if array('I').itemsize == 4 else 'L')
+    code.frombytes(buffer)
+    if memreader.ByteOrder() != ("<" if sys.byteorder == "little" else ">"):
+        code.byteswap()
+    return DecodedCode(code)
@@ -0,0 +1,123 @@
+import gdb
+from typing import Iterator, List, Optional
+import common
+import ldebug
+import lgc
+import memreader
+import typecache
+
+"""
+One row per lua_State for lua-coroutines: the status coroutine.status would return, the depth
+of the CallInfo chain, the size of the stack and the source:line of the innermost Lua frame.
+
+Every thread costs its lua_State header and the CallInfos up to the innermost Lua frame,
+the depth is counted on the rest of the chain with one field read per CallInfo.
+Use it inside memreader.ReadAhead() like the GC list walks of lgc.py.
+"""
+
+# thread status, lua.h
+LUA_OK = 0
+LUA_YIELD = 1
+
+THREAD_FIELDS = ("status", "nci", "top.p", "stack.p", "stack_last.p", "ci")
+CALLINFO_FIELDS = ("func.p", "previous", "callstatus", "u.l.savedpc")
+
+STATUS_NAMES = ("running", "suspended", "normal", "dead")
+
+
+class ThreadInfo(object):
+
+    def __init__(self, address: int, main: bool):
+        self.address = address
+        self.main = main
+        self.status = ""
+        # CallInfos above base_ci, the levels lua-backtrace outputs
+        self.depth = 0
+        # slots, stacksize and top - stack
+        self.stackSize = 0
+        self.stackUsed = 0
+        # the stack array with EXTRA_STACK and the CallInfos allocated by luaE_extendCI
+        self.bytes = 0
+        self.source: Optional[str] = None
+        self.line = -1
+
+    def Where(self) -> str:
+        if self.source is None:
+            return ""
+        return "%s:%d" % (self.source, self.line)
+
+
+def _TopLuaFrame(info: ThreadInfo, funcAddress: int, savedpc: int) -> None:
+    tt, closure = memreader.ReadTValue(funcAddress)
+    if tt != common.Ctb(common.LUA_VLCL):
+        return
+    protoAddress, = memreader.ReadStruct(closure, "LClosure", ("p",))
+    code, = memreader.ReadStruct(protoAddress, "Proto", ("code",))
+    info.source = ldebug.GetProtoInfo(protoAddress).shortSrc
+    # currentpc in ldebug.c
+    pc = (savedpc - code) // typecache.Sizeof("Instruction") - 1
+    lineTable = ldebug.GetLineTable(protoAddress)
+    if lineTable is not None and 0 <= pc < len(lineTable.lines):
+        info.line = lineTable.lines[pc]
+    else:
+        info.line = ldebug.LuaG_Getfuncline(common.Cast2TargetTypePointer(gdb.Value(protoAddress), "Proto"), pc)
+
+
+def GetThreadInfo(address: int, main: bool, runningAddress: int) -> ThreadInfo:
+    info = ThreadInfo(address, main)
+    status, nci, top, stack, stackLast, ci = memreader.ReadStruct(address, "lua_State", THREAD_FIELDS)
+    stackValueSize = typecache.Sizeof("StackValue")
+    if stack:
+        info.stackSize = (stackLast - stack) // stackValueSize
+        info.stackUsed = (top - stack) // stackValueSize
+        info.bytes = (info.stackSize + common.EXTRA_STACK) * stackValueSize
+    info.bytes += nci * typecache.Sizeof("CallInfo")
+
+    baseCi = address + typecache.Offsetof("lua_State", "base_ci")
+    callInfoDecoder = memreader.GetDecoder("CallInfo", CALLINFO_FIELDS)
+    while ci and ci != baseCi:
+        info.depth += 1
+        funcAddress, previous, callstatus, savedpc = callInfoDecoder.Read(ci)
+        if info.source is None and not (callstatus & common.CallInfoValue.CIST_C):
+            _TopLuaFrame(info, funcAddress, savedpc)
+        ci = previous
+
+    # auxstatus in lcorolib.c
+    if address == runningAddress:
+        info.status = "running"
+    elif status == LUA_YIELD:
+        info.status = "suspended"
+    elif status == LUA_OK:
+        if info.depth > 0:
+            # it resumed another coroutine
+            info.status = "normal"
+        elif info.stackUsed <= 1:
+            # only the function slot of base_ci, lua_gettop is 0
+            info.status = "dead"
+        else:
+            # not started yet
+            info.status = "suspended"
+    else:
+        # stopped by an error
+        info.status = "dead"
+    return info
+
+
+def IterThreadInfos(globalStateAddress: int, runningAddress: int) -> Iterator[ThreadInfo]:
+    """
+    yield a ThreadInfo for every lua_State, the main thread first
+    """
+    for index, address in enumerate(lgc.IterThreads(globalStateAddress)):
+        yield GetThreadInfo(address, index == 0, runningAddress)
+
+
+SORT_KEYS = {
+    "size": lambda info: info.bytes,
+    "depth": lambda info: info.depth,
+    "used": lambda info: info.stackUsed,
+}
+
+
+def SortThreadInfos(infos: Iterator[ThreadInfo], sortKey: str) -> List[ThreadInfo]:
+    # the biggest first, in the order of the GC lists when equal
+    return sorted(infos, key=SORT_KEYS[sortKey], reverse=True)
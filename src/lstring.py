@@ -0,0 +1,133 @@
+import hashlib
+from array import array
+from typing import Dict, List, Tuple
+import common
+import lgc
+import memreader
+import typecache
+
+"""
+Short string table (g->strt) and long strings, like lstring.c keeps them.
+
+Short strings are interned in strt, chained by u.hnext. Long strings are not interned,
+they are only found on the GC lists and the same content may be stored many times.
+"""
+
+# bytes of a long string read to compare contents, from its start and from its end
+COMPARE_BYTES = 256
+
+# chains of this length or more are counted together
+CHAIN_HISTOGRAM_MAX = 8
+
+
+def LuaS_Hash(data: bytes, seed: int) -> int:
+    """
+    luaS_hash, also the hash of long strings used as table keys (luaS_hashlongstr)
+    """
+    h = (seed ^ len(data)) & 0xFFFFFFFF
+    for byte in reversed(data):
+        h ^= ((h << 5) + (h >> 2) + byte) & 0xFFFFFFFF
+    return h
+
+
+class StringTableStats(object):
+
+    def __init__(self):
+        self.size = 0
+        self.nuse = 0
+        self.strings = 0
+        self.bytes = 0
+        self.emptyBuckets = 0
+        self.longestChain = 0
+        # chainLengths[n] buckets have n strings, the last one counts CHAIN_HISTOGRAM_MAX or more
+        self.chainLengths = array("I", bytes(4 * (CHAIN_HISTOGRAM_MAX + 1)))
+
+
+def ScanStringTable(globalStateAddress: int) -> StringTableStats:
+    stats = StringTableStats()
+    strtOffset = typecache.Offsetof("global_State", "strt")
+    hashArray, stats.size, stats.nuse = memreader.ReadStruct(globalStateAddress + strtOffset, "stringtable",
+                                                              ("hash", "size", "nuse"))
+    decoder = memreader.GetDecoder("TString", ("shrlen", "u.hnext"))
+    contentsOffset = typecache.Offsetof("TString", "contents")
+    with memreader.ReadAhead():
+        for bucket in memreader.IterPointers(hashArray, stats.size):
+            length = 0
+            while bucket:
+                shrlen, bucket = decoder.Read(bucket)
+                stats.bytes += contentsOffset + shrlen + 1
+                length += 1
+            stats.strings += length
+            stats.chainLengths[min(length, CHAIN_HISTOGRAM_MAX)] += 1
+            stats.longestChain = max(stats.longestChain, length)
+    stats.emptyBuckets = stats.chainLengths[0]
+    return stats
+
+
+class LongStrings(object):
+    """
+    Every long string as parallel arrays, and the strings with the same content grouped by key
+    """
+
+    def __init__(self):
+        self.addresses = array("Q")
+        self.lengths = array("Q")
+        # content key -> indexes of the strings with that content
+        self.groups: Dict[Tuple[int, bytes], List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def Size(self, i: int) -> int:
+        # sizelstring in lstring.h
+        return typecache.Offsetof("TString", "contents") + self.lengths[i] + 1
+
+    def TotalBytes(self) -> int:
+        return sum(self.Size(i) for i in range(len(self)))
+
+    def TopBySize(self, count: int) -> List[int]:
+        return sorted(range(len(self)), key=lambda i: self.lengths[i], reverse=True)[:count]
+
+    def TopDuplicates(self, count: int) -> List[List[int]]:
+        """
+        Groups of more than one string, by wasted bytes
+        """
+        duplicates = [indexes for indexes in self.groups.values() if len(indexes) > 1]
+        duplicates.sort(key=lambda indexes: (len(indexes) - 1) * self.lengths[indexes[0]], reverse=True)
+        return duplicates[:count]
+
+
+def _ContentKey(address: int, length: int, contentsOffset: int) -> Tuple[int, bytes]:
+    """
+    length and digest of the first and last COMPARE_BYTES, the middle of big strings is not read
+    """
+    contents = address + contentsOffset
+    if length <= 2 * COMPARE_BYTES:
+        sample = bytes(memreader.ReadMemory(contents, length))
+    else:
+        sample = bytes(memreader.ReadMemory(contents, COMPARE_BYTES)) + \
+            bytes(memreader.ReadMemory(contents + length - COMPARE_BYTES, COMPARE_BYTES))
+    return length, hashlib.sha1(sample).digest()
+
+
+def ScanLongStrings(globalStateAddress: int) -> LongStrings:
+    strings = LongStrings()
+    contentsOffset = typecache.Offsetof("TString", "contents")
+    with memreader.ReadAhead():
+        for listName, address, tt, marked in lgc.IterGCObjects(globalStateAddress):
+            if tt != common.LUA_VLNGSTR:
+                continue
+            lnglen, = memreader.ReadStruct(address, "TString", ("u.lnglen",))
+            strings.groups.setdefault(_ContentKey(address, lnglen, contentsOffset), []).append(len(strings))
+            strings.addresses.append(address)
+            strings.lengths.append(lnglen)
+    return strings
+
+
+def Preview(address: int, length: int, previewBytes: int) -> str:
+    """
+    The first previewBytes of the string, decoded like common.Getstr
+    """
+    text = memreader.ReadTString(address, previewBytes)
+    text = text.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\"", "\\\"")
+    return "\"%s\"%s" % (text, "..." if length > previewBytes else "")
@@ -0,0 +1,234 @@
+import gdb
+import re
+from typing import Iterator, Optional, Tuple, Union
+import common
+import lstring
+import luaconf
+import memreader
+import typecache
+
+"""
+Read the array part and the hash part of a Table in bulk, like ltable.c stores them.
+"""
+
+TABLE_FIELDS = ("alimit", "flags", "lsizenode", "lastfree", "array", "node", "metatable")
+NODE_FIELDS = ("u.value_", "u.tt_", "u.key_tt", "u.key_val")
+
+LUA_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# bytes of a string value printed before "..."
+STRING_PREVIEW_BYTES = 80
+
+
+class TableHeader(object):
+
+    def __init__(self, address: int):
+        self.address = address
+        alimit, flags, lsizenode, lastfree, self.array, self.node, self.metatable = \
+            memreader.ReadStruct(address, "Table", TABLE_FIELDS)
+        self.arraySize = common.LuaH_RealAsize(alimit, flags)
+        # a table without hash part points to the shared dummy node
+        self.nodeSize = 0 if lastfree == 0 else (1 << lsizenode)
+        self.lsizenode = lsizenode
+
+
+def IsEmpty(tt: int) -> bool:
+    return common.Novariant(tt) == common.LuaType.LUA_TNIL
+
+
+def IterArray(header: TableHeader) -> Iterator[Tuple[int, int, int]]:
+    """
+    yield (index, tt, raw) for the non empty slots of the array part, index starts at 1
+    """
+    index = 0
+    for tt, raw in memreader.IterTValues(header.array, header.arraySize):
+        index += 1
+        if not IsEmpty(tt):
+            yield index, tt, raw
+
+
+def IterNodes(header: TableHeader) -> Iterator[Tuple[int, int, int, int, int]]:
+    """
+    yield (node index, key tt, key raw, value tt, value raw) for the non empty nodes of the hash part,
+    nodes are read in chunks of memreader.CHUNK_BYTES
+    """
+    if header.nodeSize == 0:
+        return
+    decoder = memreader.GetDecoder("Node", NODE_FIELDS)
+    perChunk = max(1, memreader.CHUNK_BYTES // decoder.size)
+    start = 0
+    while start < header.nodeSize:
+        n = min(perChunk, header.nodeSize - start)
+        buffer = memreader.ReadMemory(header.node + start * decoder.size, n * decoder.size)
+        for i in range(n):
+            raw, tt, keyTt, keyRaw = decoder.Decode(buffer, i * decoder.size)
+            if not IsEmpty(tt) and keyTt != common.LuaType.LUA_TDEADKEY:
+                yield start + i, keyTt, keyRaw, tt, raw
+        start += n
+
+
+def IterEntries(header: TableHeader) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    yield (key tt, key raw, value tt, value raw), array part first, like lua_next
+    """
+    for index, tt, raw in IterArray(header):
+        yield common.LUA_VNUMINT, index, tt, raw
+    for nodeIndex, keyTt, keyRaw, tt, raw in IterNodes(header):
+        yield keyTt, keyRaw, tt, raw
+
+
+def _NodeAddress(header: TableHeader, index: int) -> int:
+    return header.node + index * typecache.Sizeof("Node")
+
+
+def _StringEquals(tStringAddress: int, key: bytes) -> bool:
+    contentsOffset = typecache.Offsetof("TString", "contents")
+    return bytes(memreader.ReadMemory(tStringAddress + contentsOffset, len(key))) == key
+
+
+def _GetStr(header: TableHeader, key: bytes, seed: int) -> Optional[int]:
+    """
+    luaH_getshortstr, and luaH_getstr for long strings, comparing the contents instead of the TString
+    """
+    isShort = len(key) <= luaconf.Get("LUAI_MAXSHORTLEN")
+    keyTag = common.Ctb(common.LUA_VSHRSTR if isShort else common.LUA_VLNGSTR)
+    h = lstring.LuaS_Hash(key, seed)
+    decoder = memreader.GetDecoder("Node", ("u.key_tt", "u.next", "u.key_val"))
+    node = _NodeAddress(header, h & ((1 << header.lsizenode) - 1))
+    while True:
+        keyTt, nx, keyRaw = decoder.Read(node)
+        if keyTt == keyTag:
+            length, = memreader.ReadStruct(keyRaw, "TString", ("shrlen" if isShort else "u.lnglen",))
+            if length == len(key) and _StringEquals(keyRaw, key):
+                return node
+        if nx == 0:
+            return None
+        node += nx * decoder.size
+
+
+def _GetInt(header: TableHeader, key: int) -> Optional[int]:
+    """
+    luaH_getint
+    """
+    if 1 <= key <= header.arraySize:
+        return header.array + (key - 1) * typecache.Sizeof("TValue")
+    decoder = memreader.GetDecoder("Node", ("u.key_tt", "u.next", "u.key_val"))
+    size = 1 << header.lsizenode
+    # hashint, the key as lua_Unsigned modulo an odd number
+    node = _NodeAddress(header, (key & 0xFFFFFFFFFFFFFFFF) % ((size - 1) | 1))
+    while True:
+        keyTt, nx, keyRaw = decoder.Read(node)
+        if keyTt == common.LUA_VNUMINT and memreader.RawToInteger(keyRaw) == key:
+            return node
+        if nx == 0:
+            return None
+        node += nx * decoder.size
+
+
+def GetSlot(tableAddress: int, key: Union[bytes, int], seed: int) -> Optional[int]:
+    """
+    Address of the TValue of key in the table, a node (its value is at the start of Node) or
+    an array slot, with the same hash lookup as ltable.c. None if the key is not in the table.
+    seed is g->seed, the seed of the string hashes.
+    """
+    header = TableHeader(tableAddress)
+    if isinstance(key, int):
+        return _GetInt(header, key)
+    return _GetStr(header, key, seed)
+
+
+def FormatKey(keyTt: int, keyRaw: int) -> str:
+    """
+    key as it would be written in Lua, like name, [1] or ["a b"]
+    """
+    if common.Novariant(keyTt) == common.LuaType.LUA_TSTRING:
+        key = memreader.ReadTString(keyRaw)
+        if LUA_IDENTIFIER.match(key):
+            return key
+        return "[\"%s\"]" % key
+    if common.WithVariant(keyTt) == common.LUA_VNUMINT:
+        return "[%d]" % memreader.RawToInteger(keyRaw)
+    if common.WithVariant(keyTt) == common.LUA_VNUMFLT:
+        return "[%s]" % memreader.RawToFloat(keyRaw)
+    return "[%s]" % FormatValue(keyTt, keyRaw)
+
+
+def FormatValue(tt: int, raw: int) -> str:
+    """
+    value as Lua would print it, strings are cut after STRING_PREVIEW_BYTES
+    """
+    tType = common.Novariant(tt)
+    if tType == common.LuaType.LUA_TNIL:
+        return "nil"
+    if tType == common.LuaType.LUA_TBOOLEAN:
+        return "true" if common.WithVariant(tt) == common.LUA_VTRUE else "false"
+    if tType == common.LuaType.LUA_TSTRING:
+        shrlen, lnglen = memreader.ReadStruct(raw, "TString", ("shrlen", "u.lnglen"))
+        length = shrlen if common.WithVariant(tt) == common.LUA_VSHRSTR else lnglen
+        return lstring.Preview(raw, length, STRING_PREVIEW_BYTES)
+    if tType == common.LuaType.LUA_TUSERDATA:
+        return "((Udata *)%s)" % hex(raw)
+    if tType == common.LuaType.LUA_TTHREAD:
+        return "((lua_State *)%s)" % hex(raw)
+    return str(common.TValueObj(None, tt, raw).GetValue())
+
+
+def ResolveTableAddress(value: gdb.Value) -> int:
+    """
+    value may be a Table *, a TValue *, a StackValue * or a plain address of a Table
+    """
+    valueType = value.type.strip_typedefs()
+    if valueType.code == gdb.TYPE_CODE_PTR:
+        target = valueType.target().strip_typedefs()
+        targetName = target.tag or target.name
+        if targetName in ("TValue", "StackValue"):
+            tt, raw = memreader.ReadTValue(int(value))
+            if common.WithVariant(tt) != common.LUA_VTABLE:
+                raise RuntimeError("%s is a %s, not a table" % (value, common.LuaType2TypeName.get(common.Novariant(tt), tt)))
+            return raw
+    return int(value)
+
+
+class TablePrinter(object):
+    """
+    Print a table and, up to maxDepth, the tables it contains.
+    Lines are printed as soon as they are decoded, a table already printed is not printed again.
+    """
+
+    def __init__(self, maxDepth: int = 1, limit: int = 0, keyPattern: str = None, output=print):
+        self.maxDepth = maxDepth
+        self.limit = limit
+        self.keyPattern = re.compile(keyPattern) if keyPattern else None
+        self.output = output
+        self.visited = set()
+
+    def Print(self, tableAddress: int) -> None:
+        self.visited.add(tableAddress)
+        self.output("((struct Table *)%s) {" % hex(tableAddress))
+        self._PrintEntries(tableAddress, 1)
+        self.output("}")
+
+    def _PrintEntries(self, tableAddress: int, depth: int) -> None:
+        indent = "    " * depth
+        header = TableHeader(tableAddress)
+        shown = 0
+        for keyTt, keyRaw, tt, raw in IterEntries(header):
+            key = FormatKey(keyTt, keyRaw)
+            if depth == 1 and self.keyPattern is not None and not self.keyPattern.search(key):
+                continue
+            if self.limit > 0 and shown >= self.limit:
+                self.output("%s... (more entries, limit %d)" % (indent, self.limit))
+                break
+            shown += 1
+            if common.WithVariant(tt) != common.LUA_VTABLE:
+                self.output("%s%s = %s," % (indent, key, FormatValue(tt, raw)))
+            elif raw in self.visited:
+                self.output("%s%s = ((struct Table *)%s) <already shown>," % (indent, key, hex(raw)))
+            elif depth >= self.maxDepth:
+                self.output("%s%s = ((struct Table *)%s)," % (indent, key, hex(raw)))
+            else:
+                self.visited.add(raw)
+                self.output("%s%s = ((struct Table *)%s) {" % (indent, key, hex(raw)))
+                self._PrintEntries(raw, depth + 1)
+                self.output("%s}," % indent)
+        if header.metatable and depth == 1:
+            self.output("%s<metatable> = ((struct Table *)%s)," % (indent, hex(header.metatable)))
@@ -0,0 +1,226 @@
+"""
+Analyze Lua states in ELF core files without gdb.
+
+The layout of the Lua structs is exported once from a gdb session on the same binary:
+    (gdb) lua-export-layout lua-layout.json
+then any number of cores are analyzed with the same lua-backtrace, lua-coroutines and
+lua-localVal code as in gdb, on top of the mmap'ed core:
+    python3 luaCore.py --layout lua-layout.json core.1234
+    python3 luaCore.py --layout lua-layout.json -j 8 /var/crash/cores/
+
+When --state is not given, the main threads are found by scanning the writable segments
+for a lua_State whose global_State points back to it.
+
+Images written by lua-capture are analyzed the same way, they hold their layout and their L:
+    (gdb) lua-capture /tmp/server.img
+    python3 luaCore.py /tmp/server.img
+--command runs other commands than the default ones, to reproduce a slow inspection:
+    python3 luaCore.py --command "lua-printStack --count 100" /tmp/server.img
+"""
+
+import argparse
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gdbfacade
+import elfcore
+import memimage
+
+# the commands run on every Lua state when --command is not given
+DEFAULT_COMMANDS = ("lua-backtrace", "lua-localVal", "lua-coroutines")
+
+_loadedLayoutKey = None
+
+
+def _Setup(layout: dict, layoutKey: str) -> None:
+    """
+    Install the gdb facade and load the plugin, once per process and layout
+    """
+    global _loadedLayoutKey
+    if _loadedLayoutKey == layoutKey:
+        return
+    gdbfacade.Install()
+    gdbfacade.SetLayout(layout)
+    import luaGdb
+    import typecache
+    typecache.SetManifest(layout)
+    typecache.Invalidate()
+    _loadedLayoutKey = layoutKey
+
+
+def _SetupLayoutFile(layoutPath: str) -> None:
+    if _loadedLayoutKey != layoutPath:
+        _Setup(gdbfacade.LoadLayout(layoutPath), layoutPath)
+
+
+def _StatePointer(address: int):
+    import typecache
+    return gdbfacade.Value(address).cast(typecache.LookupPointerType("lua_State"))
+
+
+def FindMainThreads(core: elfcore.CoreFile) -> List[int]:
+    """
+    Addresses of the main lua_State found in the writable segments of the core
+    """
+    import common
+    import memreader
+    import typecache
+
+    pointerSize = typecache.Sizeof("void *")
+    ttOffset = typecache.Offsetof("lua_State", "tt")
+    lGOffset = typecache.Offsetof("lua_State", "l_G")
+    mainthreadOffset = typecache.Offsetof("global_State", "mainthread")
+
+    # tt is LUA_VTHREAD, status is a lua status code and allowhook is 1 outside of hooks
+    expected = {
+        ttOffset: re.escape(bytes([common.LUA_VTHREAD])),
+        typecache.Offsetof("lua_State", "status"): b"[\\x00-\\x06]",
+        typecache.Offsetof("lua_State", "allowhook"): b"\\x01",
+    }
+    first = min(expected)
+    pattern = b"".join(expected.get(offset, b".") for offset in range(first, max(expected) + 1))
+    regex = re.compile(pattern, re.DOTALL)
+
+    found = []
+    for base, view in core.IterWritableSegments():
+        for match in regex.finditer(view):
+            candidate = base + match.start() - first
+            if candidate % pointerSize:
+                continue
+            try:
+                globalState = memreader.ReadPointer(candidate + lGOffset)
+                if globalState and memreader.ReadPointer(globalState + mainthreadOffset) == candidate:
+                    found.append(candidate)
+            except gdbfacade.MemoryError:
+                pass
+    return found
+
+
+def _ActiveThreads(luaStateAddress: int) -> List[int]:
+    """
+    coroutines that have Lua or C frames, the running one is among them
+    """
+    import common
+    import lgc
+    import memreader
+    import typecache
+
+    baseCiOffset = typecache.Offsetof("lua_State", "base_ci")
+    threads = []
+    with memreader.ReadAhead():
+        globalState = lgc.GetGlobalState(_StatePointer(luaStateAddress))
+        for listName, address, tt, marked in lgc.IterGCObjects(globalState):
+            if tt == common.LUA_VTHREAD:
+                ci, = memreader.ReadStruct(address, "lua_State", ("ci",))
+                if ci != address + baseCiOffset:
+                    threads.append(address)
+    return threads
+
+
+def _OpenMemory(corePath: str, layoutPath: str):
+    """
+    The memory of a core file or of a capture, with the plugin set up for its layout.
+    Return (memory, address of L in a capture or None)
+    """
+    if memimage.IsImage(corePath):
+        image = memimage.ImageFile(corePath, gdbfacade.MemoryError)
+        _Setup(image.layout, image.layoutKey)
+        return image, image.symbols.get("L")
+    if layoutPath is None:
+        raise ValueError("--layout is needed for core files")
+    _SetupLayoutFile(layoutPath)
+    return elfcore.CoreFile(corePath, gdbfacade.MemoryError), None
+
+
+def AnalyzeCore(corePath: str, layoutPath: str, stateAddresses: List[int], commands: List[str] = None) -> str:
+    """
+    Output of the commands (default DEFAULT_COMMANDS, then lua-backtrace of the active coroutines)
+    for every Lua state of the core or of the capture
+    """
+    output = StringIO()
+    with redirect_stdout(output), redirect_stderr(output):
+        print("== %s" % corePath)
+        try:
+            memory, capturedState = _OpenMemory(corePath, layoutPath)
+        except (OSError, ValueError) as e:
+            print("cannot open: %s" % e)
+            return output.getvalue()
+        import typecache
+        try:
+            gdbfacade.SetMemory(memory)
+            typecache.Invalidate()
+            if stateAddresses:
+                states = stateAddresses
+            elif capturedState is not None:
+                states = [capturedState]
+            else:
+                states = FindMainThreads(memory)
+            if not states:
+                print("no lua_State found")
+            for luaStateAddress in states:
+                print("-- lua_State %s" % hex(luaStateAddress))
+                gdbfacade.SetSymbol("L", _StatePointer(luaStateAddress))
+                for command in commands or DEFAULT_COMMANDS:
+                    gdbfacade.execute(command)
+                if commands:
+                    continue
+                for threadAddress in _ActiveThreads(luaStateAddress):
+                    print("-- coroutine %s" % hex(threadAddress))
+                    gdbfacade.execute("lua-backtrace %s" % hex(threadAddress))
+        except Exception:
+            traceback.print_exc()
+        finally:
+            gdbfacade.SetMemory(None)
+            memory.Close()
+    return output.getvalue()
+
+
+def _CorePaths(paths: List[str]) -> List[str]:
+    corePaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    corePaths.append(os.path.join(path, name))
+        else:
+            corePaths.append(path)
+    return corePaths
+
+
+def Main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="luaCore.py", description="Analyze Lua states in core files and captures without gdb")
+    parser.add_argument("--layout", help="JSON exported by layout.ExportLayout from the same binary, needed for core files")
+    parser.add_argument("--state", action="append", default=[], help="address of a lua_State, may be repeated")
+    parser.add_argument("--command", action="append", default=[], help="lua-* command to run instead of the default ones, may be repeated")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument("cores", nargs="+", help="core files, captures or directories of them")
+    options = parser.parse_args(argv)
+
+    corePaths = _CorePaths(options.cores)
+    stateAddresses = [int(state, 0) for state in options.state]
+    layoutPath = os.path.abspath(options.layout) if options.layout else None
+
+    if options.jobs <= 1 or len(corePaths) == 1:
+        for corePath in corePaths:
+            sys.stdout.write(AnalyzeCore(corePath, layoutPath, stateAddresses, options.command))
+        return 0
+
+    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        results = executor.map(AnalyzeCore, corePaths, [layoutPath] * len(corePaths),
+                               [stateAddresses] * len(corePaths), [options.command] * len(corePaths))
+        for result in results:
+            sys.stdout.write(result)
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
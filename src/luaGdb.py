@@ -1,9 +1,28 @@
+import argparse
+import shlex
 import sys
 sys.path.append("/home/ubuntu/lua-5.4.6/LuaGdb")
 
 import gdb
 import ldebug
+import breakpoints
+import capture
 import common
+import disasm
+import heapsnap
+import layout
+import lgc
+import lstate
+import lstring
+import ltable
+import memreader
+import perfstats
+import printers
+import profiler
+import records
+import retention
+import typecache
+import watchpoints
 
 import traceback
 
@@ -12,15 +31,20 @@ import traceback
 class LuaBacktrace(gdb.Command):
     """
         Lua LuaBacktrace.
-        Output the current Lua call stack, the implementation method is the same as debug.trace in Lua.
-        But there is no FuncName because it is too complicated.
+        Output the current Lua call stack, the implementation method is the same as debug.traceback in Lua.
+        Function names are found from the bytecode of the callers, but global functions are not searched in package.loaded.
 
         If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
-        For example, lua-backtrace or lua-backtrace 0x5555557ac268
+        --from N skips the N innermost levels, --count M outputs at most M levels,
+        --json outputs one JSON object per level instead of the text.
+        For example, lua-backtrace or lua-backtrace 0x5555557ac268 --from 10 --count 20 --json
     """
 
     def __init__ (self):
         super(LuaBacktrace, self).__init__ ("lua-backtrace", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-backtrace", add_help=False)
+        self.parser.add_argument("state", nargs="?")
+        records.AddArguments(self.parser)
 
     def invoke (self, args, from_tty):
         
@@ -32,47 +56,48 @@ class LuaBacktrace(gdb.Command):
 
 
     def _ImpInvoke (self, args, from_tty):
-        argv = gdb.string_to_argv(args)
+        options = self.parser.parse_args(gdb.string_to_argv(args))
 
-        if len(argv) == 0 :
+        if options.state is None:
             luaStatePointer = gdb.parse_and_eval("L")    
         else:
             # like lua-backtrace 0x5555557ac268
-            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
 
-        callInfoPointer = luaStatePointer['ci']
-
-        ci = common.CallInfoValue(luaStatePointer, callInfoPointer)
-        clusurePointer = ci.GetClosurePointer()
-        # common.RemovePrint("clusurePointer = %s, addr = %s type = %s", clusurePointer, clusurePointer.address, clusurePointer.type)
-        
-        level = 0
-        luaDebug = ldebug.LuaDebug()
-        print("stack traceback:")
-        while(ldebug.LuaGetstack(luaStatePointer, level, luaDebug) != 0):
-            status = ldebug.LuaGetinfo(luaStatePointer, "Slnt",  luaDebug)
-
-            level = level + 1
-            if luaDebug.currentLine <= 0:
-                print("\t%s: in" %(luaDebug.shortSrc))
+        # the levels before --from are not decoded
+        levels = records.Window(ldebug.IterStackInfo(luaStatePointer, "Slnt", max(options.start, 0)), options, skipped=True)
+        if not options.json:
+            print("stack traceback:")
+        for level, luaDebug in enumerate(levels, options.start):
+            if options.json:
+                record = {"level": level}
+                record.update(records.FrameRecord(luaDebug))
+                records.Emit(record)
+            elif luaDebug.currentLine <= 0:
+                print("\t%s: in %s" %(luaDebug.shortSrc, ldebug.GetFuncDescription(luaDebug)))
             else:
-                print("\t%s:%s" %(luaDebug.shortSrc, luaDebug.currentLine))
+                print("\t%s:%s: in %s" %(luaDebug.shortSrc, luaDebug.currentLine, ldebug.GetFuncDescription(luaDebug)))
 
-            if luaDebug.istailcall:
+            if luaDebug.istailcall and not options.json:
                 print("\t(...tail calls...)")
 
 class LuaPrintStack(gdb.Command):
     """
         Lua LuaPrintStack.
 
-        Output all stackValues in the Lua stack, including their addresses and values
+        Output all stackValues in the Lua stack, including their addresses and values, from the top down
 
         If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
-        For example, lua-printStack or lua-printStack 0x5555557ac268
+        --from N starts at the N-th slot below the top, --count M outputs at most M slots,
+        only the slots in the window are read. --json outputs one JSON object per slot.
+        For example, lua-printStack or lua-printStack 0x5555557ac268 --from 1000 --count 100
     """
 
     def __init__(self):
         super(LuaPrintStack, self).__init__ ("lua-printStack", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-printStack", add_help=False)
+        self.parser.add_argument("state", nargs="?")
+        records.AddArguments(self.parser)
 
     def invoke (self, args, from_tty):
         try:
@@ -82,22 +107,33 @@ class LuaPrintStack(gdb.Command):
             traceback.print_exc()
     
     def _ImpInvoke(self, args, from_tty):
-        argv = gdb.string_to_argv(args)
+        options = self.parser.parse_args(gdb.string_to_argv(args))
 
-        if len(argv) == 0 :
+        if options.state is None:
             luaStatePointer = gdb.parse_and_eval("L")    
         else:
             # like lua-backtrace 0x5555557ac268
-            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
 
-        stackValuePointer = luaStatePointer['top']['p'] - 1
+        stackTop = int(luaStatePointer['top']['p'])
+        stackBottom = int(luaStatePointer['stack']['p'])
+        stride = typecache.Sizeof("StackValue")
+        valOffset = typecache.Offsetof("StackValue", "val")
 
-        index = 0
-        while stackValuePointer >= luaStatePointer['stack']['p']:
-            tValue = common.TValueObj(stackValuePointer['val'].address)
-            print("[%s] --> [(StackValue*)%s] --> [%s][%s]\n" % (index, str(stackValuePointer), tValue.GetTypeName(), tValue.GetValue()))
+        # the slots of the window are read in a few read_memory calls, from the top down
+        end = records.WindowEnd((stackTop - stackBottom) // stride, options)
+        index = options.start
+        if index >= end:
+            return
+        windowBottom = stackTop - end * stride
+        for tt, raw in memreader.IterTValues(windowBottom + valOffset, end - index, stride, reverse=True):
+            stackValueAddress = stackTop - (index + 1) * stride
+            tValue = common.TValueObj(stackValueAddress + valOffset, tt, raw)
+            if options.json:
+                records.Emit(records.TValueRecord(tValue, index=index, address=hex(stackValueAddress)))
+            else:
+                print("[%s] --> [(StackValue*)%s] --> [%s][%s]\n" % (index, hex(stackValueAddress), tValue.GetTypeName(), tValue.GetValue()))
             index = index + 1
-            stackValuePointer = stackValuePointer - 1
 
 class LuaPrintTValue(gdb.Command):
     """
@@ -125,17 +161,65 @@ class LuaPrintTValue(gdb.Command):
         tValue = common.TValueObj(tValuePointer)
         print("[%s][%s]\n" % (tValue.GetTypeName(), tValue.GetValue()))
 
+class LuaPrintTable(gdb.Command):
+    """
+        Lua LuaPrintTable.
+
+        Output the content of a table, array part first and then hash part.
+        The argument is a Table *, a TValue * holding a table, or the address of a Table.
+        --depth N expands the nested tables up to N levels (default 1, only the table itself),
+        --limit K outputs at most K entries per table (default 1000, 0 for no limit),
+        --keys pattern only outputs the top level entries whose key matches the regular expression.
+        Entries are output while the table is read, a table is never expanded twice.
+        For example, lua-printTable 0x5555557acc10 --depth 2 --keys ^conf
+    """
+
+    def __init__(self):
+        super(LuaPrintTable, self).__init__ ("lua-printTable", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-printTable", add_help=False)
+        self.parser.add_argument("table")
+        self.parser.add_argument("--depth", type=int, default=1)
+        self.parser.add_argument("--limit", type=int, default=1000)
+        self.parser.add_argument("--keys", default=None)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        # like lua-printTable 0x5555557acc10
+        tableAddress = ltable.ResolveTableAddress(gdb.parse_and_eval(options.table))
+        printer = ltable.TablePrinter(options.depth, options.limit, options.keys)
+        printer.Print(tableAddress)
+
 class LuaPrintCoroutines(gdb.Command):
     """
         Lua LuaPrintCoroutines.
 
-        Find global_State through lua_status, and then output all LUA_VTHREAD type objects.
+        Find global_State through lua_status, and then output all LUA_VTHREAD type objects, one row per thread with
+        its status (running, suspended, normal, dead), the depth of its CallInfo chain, the size and the used slots
+        of its stack, the bytes of the stack and CallInfos, and the source:line of its innermost Lua frame.
         If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
-        For example, lua-coroutines or lua-coroutines 0x5555557ac268
+        --sort size|depth|used outputs the biggest first, --status keeps the threads with this status,
+        --source keeps the threads whose innermost Lua frame contains the text.
+        --from N skips the first N threads, --count M outputs at most M threads and stops walking the GC lists,
+        --json outputs one JSON object per thread.
+        For example, lua-coroutines or lua-coroutines 0x5555557ac268 --status suspended --sort size --count 100 --json
     """
 
     def __init__(self):
         super(LuaPrintCoroutines, self).__init__ ("lua-coroutines", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-coroutines", add_help=False)
+        self.parser.add_argument("state", nargs="?")
+        self.parser.add_argument("--sort", choices=sorted(lstate.SORT_KEYS), default=None)
+        self.parser.add_argument("--status", choices=lstate.STATUS_NAMES, default=None)
+        self.parser.add_argument("--source", default=None)
+        records.AddArguments(self.parser)
 
     def invoke (self, args, from_tty):
         try:
@@ -145,21 +229,726 @@ class LuaPrintCoroutines(gdb.Command):
             traceback.print_exc()
 
     def _ImpInvoke(self, args, from_tty):
-        argv = gdb.string_to_argv(args)
+        options = self.parser.parse_args(gdb.string_to_argv(args))
 
-        if len(argv) == 0 :
+        if options.state is None:
             luaStatePointer = gdb.parse_and_eval("L")    
         else:
             # like lua-backtrace 0x5555557ac268
-            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
         globalStatePointer = luaStatePointer['l_G']
-        gcObjectPointer = globalStatePointer['allgc']
 
-        print("[m]Thread: ", str(globalStatePointer['mainthread']))
-        while gcObjectPointer['next']:
-            if int(gcObjectPointer['tt']) == common.LUA_VTHREAD:
-                print("Thread:", str(gcObjectPointer))
-            gcObjectPointer = gcObjectPointer['next']
+        if not options.json:
+            print("%-3s %-18s %-9s %6s %9s %9s %10s  %s" % ("", "thread", "status", "depth", "stacksize", "used", "bytes", "where"))
+
+        with memreader.ReadAhead():
+            # the main thread is the first one
+            infos = lstate.IterThreadInfos(int(globalStatePointer), int(luaStatePointer))
+            if options.status is not None:
+                infos = (info for info in infos if info.status == options.status)
+            if options.source is not None:
+                infos = (info for info in infos if options.source in info.Where())
+            if options.sort is not None:
+                infos = lstate.SortThreadInfos(infos, options.sort)
+
+            for index, info in enumerate(records.Window(infos, options), options.start):
+                if options.json:
+                    records.Emit({"index": index, "address": hex(info.address), "main": info.main, "status": info.status,
+                                  "depth": info.depth, "stacksize": info.stackSize, "used": info.stackUsed,
+                                  "bytes": info.bytes, "source": info.source, "line": info.line})
+                else:
+                    print("%-3s %-18s %-9s %6d %9d %9d %10d  %s" % ("[m]" if info.main else "", hex(info.address), info.status,
+                          info.depth, info.stackSize, info.stackUsed, info.bytes, info.Where()))
+
+class LuaDisasm(gdb.Command):
+    """
+        Lua LuaDisasm.
+
+        Output the instructions of a Proto like luac -l, with the constants, upvalue names and local names they use.
+        The argument is a Lua closure or a Proto, or frame N for the function at level N of the Lua stack,
+        whose current instruction is marked with =>. Without argument the function at level 0 is used.
+        For frame N, if the state is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        --from N skips the first N instructions, --count M outputs at most M instructions,
+        --json outputs one JSON object per instruction.
+        For example, lua-disasm, lua-disasm frame 2 0x5555557ac268 or lua-disasm 0x5555557b0e20 --from 100 --count 20
+    """
+
+    def __init__(self):
+        super(LuaDisasm, self).__init__ ("lua-disasm", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-disasm", add_help=False)
+        self.parser.add_argument("target", nargs="*")
+        records.AddArguments(self.parser)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+        target = options.target
+
+        if not target or target[0] == "frame":
+            level = int(target[1]) if len(target) > 1 else 0
+            if len(target) > 2:
+                # like lua-disasm frame 2 0x5555557ac268
+                luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(target[2]))
+            else:
+                luaStatePointer = gdb.parse_and_eval("L")
+            listing = disasm.GetFrameListing(luaStatePointer, level)
+        else:
+            # like lua-disasm 0x5555557b0e20 or lua-disasm L->ci->func.p->val.value_.gc
+            listing = disasm.Listing(disasm.ResolveProto(int(gdb.parse_and_eval(target[0]))))
+
+        if not options.json:
+            for line in listing.Header():
+                print(line)
+        for pc in records.Window(range(listing.sizecode), options):
+            if options.json:
+                records.Emit(listing.Record(pc))
+            else:
+                print(listing.Format(pc))
+
+class LuaHeapStats(gdb.Command):
+    """
+        Lua LuaHeapStats.
+
+        Walk all the GC lists (allgc, finobj, tobefnz, fixedgc) and output the count and
+        the estimated bytes of the objects per type. In generational mode the allgc and finobj
+        lists are also split by age (survival, old1, reallyold...).
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-heapstats or lua-heapstats 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaHeapStats, self).__init__ ("lua-heapstats", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        if len(argv) == 0 :
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            # like lua-heapstats 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+
+        stats = lgc.CollectHeapStats(lgc.GetGlobalState(luaStatePointer))
+
+        print("%-16s %12s %16s" % ("type", "count", "bytes"))
+        for tt in sorted(stats.bytesByTag, key=lambda tt: stats.bytesByTag[tt], reverse=True):
+            print("%-16s %12d %16d" % (lgc.GetTagName(tt), stats.countByTag[tt], stats.bytesByTag[tt]))
+        print("%-16s %12d %16d" % ("total", sum(stats.countByTag.values()), sum(stats.bytesByTag.values())))
+        print("")
+        print("%-16s %12s %16s" % ("list", "count", "bytes"))
+        for listName in stats.countByList:
+            print("%-16s %12d %16d" % (listName, stats.countByList[listName], stats.bytesByList[listName]))
+
+class LuaGCState(gdb.Command):
+    """
+        Lua LuaGCState.
+
+        Output the state of the collector: gcstate, gckind, the bytes in use, GCdebt, GCestimate, the parameters
+        (pause, stepmul, stepsize, the generational multipliers) and the count and bytes of the gray lists.
+        In generational mode the objects of the GC lists are also counted by age (new, survival, old0, old1, old, touched1, touched2).
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-gcstate or lua-gcstate 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaGCState, self).__init__ ("lua-gcstate", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        if len(argv) == 0 :
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            # like lua-gcstate 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+
+        state = lgc.CollectGCState(lgc.GetGlobalState(luaStatePointer))
+        fields = state.fields
+
+        stopped = []
+        if fields["gcstp"] & lgc.GCSTPUSR:
+            stopped.append("by the user")
+        if fields["gcstp"] & lgc.GCSTPGC:
+            stopped.append("inside a collection")
+        if fields["gcstp"] & lgc.GCSTPCLS:
+            stopped.append("closing the state")
+
+        print("%-16s %s (%d)" % ("gcstate", state.StateName(), fields["gcstate"]))
+        print("%-16s %s" % ("gckind", "generational" if state.IsGenerational() else "incremental"))
+        print("%-16s %s" % ("stopped", ", ".join(stopped) if stopped else "no"))
+        print("%-16s %s" % ("emergency", "yes" if fields["gcemergency"] else "no"))
+        print("%-16s %d" % ("bytes in use", state.TotalBytes()))
+        print("%-16s %d" % ("GCdebt", fields["GCdebt"]))
+        print("%-16s %d" % ("GCestimate", fields["GCestimate"]))
+        if state.IsGenerational():
+            print("%-16s %d" % ("lastatomic", fields["lastatomic"]))
+            print("%-16s %d%%" % ("genminormul", fields["genminormul"]))
+            print("%-16s %d%%" % ("genmajormul", lgc.GetGCParam(fields["genmajormul"])))
+        else:
+            print("%-16s %d%%" % ("gcpause", lgc.GetGCParam(fields["gcpause"])))
+            print("%-16s %d" % ("gcstepmul", lgc.GetGCParam(fields["gcstepmul"])))
+            print("%-16s %d bytes" % ("gcstepsize", 1 << fields["gcstepsize"]))
+
+        print("")
+        print("%-16s %12s %16s" % ("gray list", "count", "bytes"))
+        for listName in lgc.GRAY_LISTS:
+            count, size = state.grayLists[listName]
+            print("%-16s %12d %16d" % (listName, count, size))
+
+        if state.IsGenerational():
+            print("")
+            print("%-16s %12s %16s" % ("age", "count", "bytes"))
+            for age, ageName in enumerate(lgc.AGE_NAMES):
+                count, size = state.ages.get(age, (0, 0))
+                print("%-16s %12d %16d" % (ageName, count, size))
+
+class LuaHeapSnapshot(gdb.Command):
+    """
+        Lua LuaHeapSnapshot.
+
+        Walk all the GC lists and save the address, type, estimated size and, for Lua closures and protos,
+        the source:linedefined of the Proto of every object. The snapshot is saved to <name>.luasnap in
+        $LUA_GDB_SNAPSHOT_DIR (default the current directory), or to name if it is a path.
+        If the second argument is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-heapsnapshot before or lua-heapsnapshot before 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaHeapSnapshot, self).__init__ ("lua-heapsnapshot", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) == 0:
+            raise gdb.GdbError("usage: lua-heapsnapshot name [lua_State]")
+
+        if len(argv) == 1 :
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            # like lua-heapsnapshot before 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[1]))
+
+        snapshot = heapsnap.TakeSnapshot(lgc.GetGlobalState(luaStatePointer))
+        path = heapsnap.SnapshotPath(argv[0])
+        snapshot.Save(path)
+        print("%d objects, %d bytes saved to %s" % (len(snapshot), sum(snapshot.sizes), path))
+
+class LuaHeapDiff(gdb.Command):
+    """
+        Lua LuaHeapDiff.
+
+        Compare two snapshots of lua-heapsnapshot. The objects of the second one are new or surviving
+        (same address, type and Proto in the first one), the objects only in the first one are freed.
+        Output the counts and estimated bytes per type, then per Proto for Lua closures and protos,
+        --top N limits the Proto lines (default 20, 0 for all).
+        For example, lua-heapdiff before after
+    """
+
+    def __init__(self):
+        super(LuaHeapDiff, self).__init__ ("lua-heapdiff", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-heapdiff", add_help=False)
+        self.parser.add_argument("before")
+        self.parser.add_argument("after")
+        self.parser.add_argument("--top", type=int, default=20)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        before = heapsnap.HeapSnapshot.Load(heapsnap.SnapshotPath(options.before))
+        after = heapsnap.HeapSnapshot.Load(heapsnap.SnapshotPath(options.after))
+        diff = heapsnap.DiffSnapshots(before, after)
+
+        print("%-16s %10s %12s %10s %12s %10s %12s" % ("type", "new", "bytes", "surviving", "bytes", "freed", "bytes"))
+        for tt in sorted(set(diff.byTag) | set(diff.freedByTag), key=lambda tt: diff.byTag[tt][1], reverse=True):
+            print("%-16s %10d %12d %10d %12d %10d %12d" % ((lgc.GetTagName(tt),) + tuple(diff.byTag[tt]) + tuple(diff.freedByTag[tt])))
+        print("")
+        print("%-40s %10s %12s %10s %12s" % ("proto", "new", "bytes", "surviving", "bytes"))
+        protoNames = sorted(diff.byProto, key=lambda name: diff.byProto[name][1], reverse=True)
+        for name in protoNames[:options.top] if options.top > 0 else protoNames:
+            print("%-40s %10d %12d %10d %12d" % ((name,) + tuple(diff.byProto[name])))
+
+class LuaWhoHolds(gdb.Command):
+    """
+        Lua LuaWhoHolds.
+
+        Output the shortest chain of references from a root of the collector (the registry, the main thread,
+        the metatables of the basic types) to an object, like registry._LOADED.mymod.cache[42].conn,
+        then every object of the chain. References that are not table fields are written like <upvalue name>,
+        <metatable>, <stack 3>. The first argument is the object, a TValue * or the address of any GC object.
+        The references of the whole heap are indexed by the first query and reused until the program runs again.
+        If the second argument is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-whoholds 0x5555557b3a40 or lua-whoholds 0x5555557b3a40 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaWhoHolds, self).__init__ ("lua-whoholds", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) == 0:
+            raise gdb.GdbError("usage: lua-whoholds object [lua_State]")
+
+        if len(argv) == 1 :
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            # like lua-whoholds 0x5555557b3a40 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[1]))
+
+        address = retention.ResolveObjectAddress(gdb.parse_and_eval(argv[0]))
+        graph = retention.GetGraph(lgc.GetGlobalState(luaStatePointer))
+        path = graph.FindPath(address)
+        if path is None:
+            print("%s is not reachable from the roots, it will be collected" % hex(address))
+            return
+        print(graph.FormatPath(path))
+        for line in retention.IterPathLines(graph, path):
+            print(line)
+
+class LuaStrings(gdb.Command):
+    """
+        Lua LuaStrings.
+
+        Output the occupancy of the short string table (buckets, load factor, empty buckets and the histogram of
+        the chain lengths), then the biggest long strings and the long strings stored more than once, by wasted bytes.
+        Long strings are compared by length and by their first and last bytes, so duplicates are likely, not certain.
+        --top is the number of strings of each list, --preview the number of bytes shown of each string.
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-strings or lua-strings --top 5 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaStrings, self).__init__ ("lua-strings", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-strings", add_help=False)
+        self.parser.add_argument("state", nargs="?")
+        self.parser.add_argument("--top", type=int, default=10)
+        self.parser.add_argument("--preview", type=int, default=40)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        if options.state is None :
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            # like lua-strings 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
+
+        globalStateAddress = lgc.GetGlobalState(luaStatePointer)
+        table = lstring.ScanStringTable(globalStateAddress)
+        print("short strings: %d (nuse %d), %d bytes" % (table.strings, table.nuse, table.bytes))
+        print("buckets: %d, load factor %.2f, empty %d (%.1f%%), longest chain %d" % (
+            table.size, table.nuse / table.size if table.size else 0, table.emptyBuckets,
+            100.0 * table.emptyBuckets / table.size if table.size else 0, table.longestChain))
+        print("%-8s %12s" % ("chain", "buckets"))
+        for length, buckets in enumerate(table.chainLengths):
+            label = "%d" % length if length < lstring.CHAIN_HISTOGRAM_MAX else ">=%d" % length
+            print("%-8s %12d" % (label, buckets))
+
+        strings = lstring.ScanLongStrings(globalStateAddress)
+        print("")
+        print("long strings: %d, %d bytes" % (len(strings), strings.TotalBytes()))
+        if len(strings) == 0:
+            return
+        print("")
+        print("%-18s %12s  %s" % ("address", "length", "contents"))
+        for i in strings.TopBySize(options.top):
+            print("%-18s %12d  %s" % (hex(strings.addresses[i]), strings.lengths[i],
+                                       lstring.Preview(strings.addresses[i], strings.lengths[i], options.preview)))
+        duplicates = strings.TopDuplicates(options.top)
+        if duplicates:
+            print("")
+            print("%8s %12s %12s  %s" % ("copies", "length", "wasted", "contents"))
+            for indexes in duplicates:
+                length = strings.lengths[indexes[0]]
+                print("%8d %12d %12d  %s" % (len(indexes), length, (len(indexes) - 1) * strings.Size(indexes[0]),
+                                             lstring.Preview(strings.addresses[indexes[0]], length, options.preview)))
+                print("%8s %s" % ("", " ".join(hex(strings.addresses[i]) for i in indexes[:8])))
+
+class LuaBreak(gdb.Command):
+    """
+        Lua LuaBreak.
+
+        Stop when the Lua VM reaches a line, like lua-break test.lua:12. The file is matched against the end of the
+        chunkname, so test.lua also stops in scripts/test.lua. The breakpoint is a gdb breakpoint on luaD_hook with
+        a condition on the line and the code of the functions that have it, see info breakpoints, and it is removed
+        with delete. Functions of chunks loaded later are added when the chunk is loaded.
+        The line hook of the Lua threads is turned on while Lua breakpoints exist, unless the program set its own hook.
+        Without a location, list the Lua breakpoints.
+        If the second argument is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-break test.lua:12 or lua-break test.lua:12 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaBreak, self).__init__ ("lua-break", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) == 0:
+            for lineBreakpoint in breakpoints.IterBreakpoints():
+                print(lineBreakpoint.Describe())
+            return
+
+        luaStatePointer = None
+        if len(argv) > 1:
+            # like lua-break test.lua:12 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[1]))
+        elif gdb.selected_inferior().pid != 0:
+            try:
+                luaStatePointer = gdb.parse_and_eval("L")
+            except gdb.error:
+                luaStatePointer = common.FindLuaState()
+
+        lineBreakpoint, skipped = breakpoints.CreateBreakpoint(argv[0], luaStatePointer)
+        print(lineBreakpoint.Describe())
+        if skipped:
+            print("%d Lua threads have their own hook without lines, the breakpoint does not stop in them" % skipped)
+
+class LuaStep(gdb.Command):
+    """
+        Lua LuaStep.
+
+        Run until the current Lua line changes, stepping into the called Lua functions and coroutines.
+        The program runs until a gdb breakpoint on luaD_hook with a condition on the line and the depth of L->ci,
+        the line hook of the lua_State, and of the coroutines resumed meanwhile (a breakpoint on lua_resume),
+        is turned on for the time of the command.
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-step or lua-step 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaStep, self).__init__ ("lua-step", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        if len(argv) == 0 :
+            luaStatePointer = common.FindLuaState()
+            if luaStatePointer is None:
+                raise gdb.GdbError("no L in the C stack")
+        else:
+            # like lua-step 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+
+        if breakpoints.Step(breakpoints.STEP_INTO, luaStatePointer):
+            print(breakpoints.CurrentLocation() or "stopped outside of Lua code")
+
+class LuaNext(gdb.Command):
+    """
+        Lua LuaNext.
+
+        Run until another line of the current Lua function, or a line of its callers when it returns.
+        The Lua functions it calls run without stopping.
+        The program runs until a gdb breakpoint on luaD_hook with a condition on the line and the depth of L->ci,
+        the line hook of the lua_State is turned on for the time of the command.
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-next or lua-next 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaNext, self).__init__ ("lua-next", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        if len(argv) == 0 :
+            luaStatePointer = common.FindLuaState()
+            if luaStatePointer is None:
+                raise gdb.GdbError("no L in the C stack")
+        else:
+            # like lua-next 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+
+        if breakpoints.Step(breakpoints.STEP_OVER, luaStatePointer):
+            print(breakpoints.CurrentLocation() or "stopped outside of Lua code")
+
+class LuaFinish(gdb.Command):
+    """
+        Lua LuaFinish.
+
+        Run until the current Lua function returns and its caller reaches a new line.
+        The program runs until a gdb breakpoint on luaD_hook with a condition on the line and the depth of L->ci,
+        the line hook of the lua_State is turned on for the time of the command.
+        If the argument are given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-finish or lua-finish 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaFinish, self).__init__ ("lua-finish", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        if len(argv) == 0 :
+            luaStatePointer = common.FindLuaState()
+            if luaStatePointer is None:
+                raise gdb.GdbError("no L in the C stack")
+        else:
+            # like lua-finish 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(argv[0]))
+
+        if breakpoints.Step(breakpoints.STEP_OUT, luaStatePointer):
+            print(breakpoints.CurrentLocation() or "stopped outside of Lua code")
+
+class LuaWatch(gdb.Command):
+    """
+        Lua LuaWatch.
+
+        Stop when a Lua value changes and output the old value, the new value and the Lua backtrace.
+        The path starts with an upvalue of the current Lua function (like _ENV), _G or a global variable, followed by
+        fields and integer keys, like _ENV.config.timeout, counter or servers[2]["host name"]. The TValue of the value is
+        watched with hardware watchpoints, and watched again at its new place when the table is rehashed.
+        Without a path, list the Lua watchpoints, --delete N removes one.
+        If the second argument is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-watch _ENV.config.timeout or lua-watch config.timeout 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaWatch, self).__init__ ("lua-watch", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-watch", add_help=False)
+        self.parser.add_argument("path", nargs="?")
+        self.parser.add_argument("state", nargs="?")
+        self.parser.add_argument("--delete", type=int, default=None)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        if options.delete is not None:
+            watchpoints.Unwatch(options.delete)
+            return
+        if options.path is None:
+            for luaWatch in watchpoints.IterWatches():
+                print(luaWatch.Describe())
+            return
+
+        if options.state is None :
+            luaStatePointer = common.FindLuaState()
+            if luaStatePointer is None:
+                raise gdb.GdbError("no L in the C stack")
+        else:
+            # like lua-watch config.timeout 0x5555557ac268
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
+
+        print(watchpoints.Watch(options.path, luaStatePointer).Describe())
+
+class LuaProfile(gdb.Command):
+    """
+        Lua LuaProfile.
+
+        Sample the Lua stack of the running program and write the stacks in the folded format of flamegraph.pl.
+        The program is stopped with SIGSTOP --hz times per second (default 99) during --duration seconds (default 10),
+        the running lua_State is the innermost L of the C stack. Identical stacks are counted together,
+        frames are like "format (m.lua:12)" for Lua functions and "[C] print" for C functions.
+        The program must be started and stopped, it is stopped again at the end.
+        For example, lua-profile --duration 30 --hz 199 --out lua.folded
+        then flamegraph.pl lua.folded > lua.svg
+    """
+
+    def __init__(self):
+        super(LuaProfile, self).__init__ ("lua-profile", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-profile", add_help=False)
+        self.parser.add_argument("--duration", type=float, default=10)
+        self.parser.add_argument("--hz", type=int, default=99)
+        self.parser.add_argument("--out", default="lua.folded")
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+        if options.hz <= 0 or options.duration <= 0:
+            raise gdb.GdbError("--hz and --duration must be positive")
+
+        profile = profiler.Profile(options.duration, options.hz)
+        profile.Write(options.out)
+        print("%d samples, %d distinct stacks written to %s" % (profile.samples, len(profile.stacks), options.out))
+        if profile.missed:
+            print("%d stops without a lua_State in the C stack" % profile.missed)
+        if profile.samples:
+            print("%.3f ms per sample" % (1000 * profile.sampleSeconds / profile.samples))
+
+class LuaPerfStats(gdb.Command):
+    """
+        Lua LuaPerfStats.
+
+        Run a lua-* command with the instrumentation of the plugin on, and output what it cost: gdb.Value field reads
+        in the hot helpers, gdb.lookup_type calls, read_memory calls and bytes, read-ahead and object cache hits,
+        and the time per phase (frame walk, line lookup, proto decode, value decode).
+        --profile file also runs it under cProfile and writes the pstats file, --quiet drops the output of the command.
+        For example, lua-perfstats lua-backtrace or lua-perfstats --profile /tmp/bt.pstats --quiet lua-printStack
+    """
+
+    def __init__(self):
+        super(LuaPerfStats, self).__init__ ("lua-perfstats", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-perfstats", add_help=False)
+        self.parser.add_argument("--profile", default=None)
+        self.parser.add_argument("--quiet", action="store_true")
+        self.parser.add_argument("command", nargs=argparse.REMAINDER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+        if not options.command:
+            raise gdb.GdbError("lua-perfstats needs a command to run, like lua-perfstats lua-backtrace")
+
+        # the tokens argparse left, quoted again for gdb.string_to_argv
+        command = " ".join(shlex.quote(argument) for argument in options.command)
+        stats = perfstats.Run(command, options.profile, options.quiet)
+        for line in perfstats.FormatStats(command, stats):
+            print(line)
+        if options.profile:
+            print("profile written to %s, read it with python3 -m pstats %s" % (options.profile, options.profile))
+
+class LuaExportLayout(gdb.Command):
+    """
+        Lua LuaExportLayout.
+
+        Write the sizes and offsets of the Lua structs and the build options (LUA_32BITS, LUAI_MAXSHORTLEN,
+        LUA_IDSIZE, MAXIWTHABS) to a JSON manifest. Without argument it is written to
+        $LUA_GDB_LAYOUT_DIR/<build-id>.json (default ~/.cache/lua-gdb), the next sessions on the same binary
+        load it instead of reading the DWARF. The same file is used by luaCore.py.
+        For example, lua-export-layout or lua-export-layout /tmp/lua-layout.json
+    """
+
+    def __init__(self):
+        super(LuaExportLayout, self).__init__ ("lua-export-layout", gdb.COMMAND_USER)
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+
+        path = layout.ExportLayout(argv[0] if argv else None)
+        print("layout written to", path)
+
+class LuaCapture(gdb.Command):
+    """
+        Lua LuaCapture.
+
+        Save the memory the lua-* commands read from a Lua state to an image file: global_State, the string table,
+        the objects of the GC lists with their arrays, the stacks and CallInfo chains of the threads.
+        The image holds the layout of the Lua structs and the L, luaCore.py runs the commands on it without gdb.
+        If the second argument is given, it is converted to a poninter to lua_state, otherwise the L in current C stack is used.
+        For example, lua-capture /tmp/server.img or lua-capture /tmp/server.img 0x5555557ac268
+    """
+
+    def __init__(self):
+        super(LuaCapture, self).__init__ ("lua-capture", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-capture", add_help=False)
+        self.parser.add_argument("file")
+        self.parser.add_argument("state", nargs="?")
+
+    def invoke (self, args, from_tty):
+        try:
+           self._ImpInvoke(args, from_tty)
+           pass
+        except Exception as e:
+            traceback.print_exc()
+
+    def _ImpInvoke(self, args, from_tty):
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        if options.state is None:
+            luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
+        regions, size = capture.CaptureState(int(luaStatePointer), options.file)
+        print("%d regions, %d bytes written to %s" % (regions, size, options.file))
 
 class LuaPrintLocalVal(gdb.Command):
     """
@@ -167,10 +956,16 @@ class LuaPrintLocalVal(gdb.Command):
 
         Output the local variable information of the function call.
         If the argument are given, it is converted to a poninter to callInfo, otherwise the callInfo of L in current C stack is used.
-        For example, lua-localVal or lua-localVal 0x5555557ac268
+        The second argument is the lua_state running that callInfo, default the L in current C stack.
+        --from N skips the first N locals, --count M outputs at most M locals, --json outputs one JSON object per local.
+        For example, lua-localVal or lua-localVal 0x5555557ac268 --json
     """
     def __init__(self):
         super(LuaPrintLocalVal, self).__init__ ("lua-localVal", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-localVal", add_help=False)
+        self.parser.add_argument("callInfo", nargs="?")
+        self.parser.add_argument("state", nargs="?")
+        records.AddArguments(self.parser)
 
     def invoke (self, args, from_tty):
         try:
@@ -180,35 +975,41 @@ class LuaPrintLocalVal(gdb.Command):
             traceback.print_exc()
 
     def _ImpInvoke(self, args, from_tty):
-        argv = gdb.string_to_argv(args)
-    
-        if len(argv) == 0 :
+        options = self.parser.parse_args(gdb.string_to_argv(args))
+
+        if options.state is None:
             luaStatePointer = gdb.parse_and_eval("L")
+        else:
+            luaStatePointer = common.CastPointer2LuaStatePointer(gdb.parse_and_eval(options.state))
+        if options.callInfo is None:
             callInfoPointer = luaStatePointer['ci']
         else:
-            # like lua-backtrace 0x5555557ac268
-            callInfoPointer = common.Cast2TargetTypePointer(gdb.parse_and_eval(argv[0]), "CallInfo")
-
-        index = 1
-        while True:
-            name, pos = ldebug.LuaGetLocal(luaStatePointer, callInfoPointer, index)
-            if int(pos) == 0:
-                break
-            tValuePointer = common.Index2Value(luaStatePointer, index)
-            tValueObj = common.TValueObj(tValuePointer)
-            print("name = %s, value = %s pos = %s" % (name, tValueObj.GetValue(), pos))
-            index += 1
+            # like lua-localVal 0x5555557ac268
+            callInfoPointer = common.Cast2TargetTypePointer(gdb.parse_and_eval(options.callInfo), "CallInfo")
+
+        # the locals before --from are not looked up
+        localVars = ldebug.IterLocals(luaStatePointer, callInfoPointer, max(options.start, 0) + 1)
+        for index, name, pos in records.Window(localVars, options, skipped=True):
+            tValueObj = common.TValueObj(common.S2V(pos))
+            if options.json:
+                records.Emit(records.TValueRecord(tValueObj, index=index, name=name, address=hex(int(pos))))
+            else:
+                print("name = %s, value = %s pos = %s" % (name, tValueObj.GetValue(), pos))
 
 class LuaPrintUpVal(gdb.Command):
     """
         Lua LuaPrintUpVal.
 
         Output the upvalus information of the function call.
-        If the argument are given, it is converted to a poninter to callInfo, otherwise the callInfo of L in current C stack is used.
-        For example, lua-upVal or lua-upVal 0x5555557ac268
+        If the argument are given, it is converted to a poninter to the TValue of a closure, otherwise the function of the callInfo of L in current C stack is used.
+        --from N skips the first N upvalues, --count M outputs at most M upvalues, --json outputs one JSON object per upvalue.
+        For example, lua-upVal or lua-upVal 0x5555557ac268 --json
     """
     def __init__(self):
         super(LuaPrintUpVal, self).__init__ ("lua-upVal", gdb.COMMAND_USER)
+        self.parser = common.ArgumentParser(prog="lua-upVal", add_help=False)
+        self.parser.add_argument("closure", nargs="?")
+        records.AddArguments(self.parser)
 
     def invoke (self, args, from_tty):
         try:
@@ -218,30 +1019,46 @@ class LuaPrintUpVal(gdb.Command):
             traceback.print_exc()
 
     def _ImpInvoke(self, args, from_tty):
-        argv = gdb.string_to_argv(args)
+        options = self.parser.parse_args(gdb.string_to_argv(args))
     
-        if len(argv) == 0 :
+        if options.closure is None:
             luaStatePointer = gdb.parse_and_eval("L")
             callInfoPointer = luaStatePointer['ci']
             tValuePointer = callInfoPointer['func']['p']['val'].address
         else:
-            # like lua-backtrace 0x5555557ac268
-            tValuePointer = common.Cast2TargetTypePointer(gdb.parse_and_eval(argv[0]), "TValue")
-
-        index = 1
-        while True:
-            name, tValueObj = ldebug.AuxUpValue(tValuePointer, index)
-            # common.RemovePrint("name = %s, tValueObj = %s", name, tValueObj)
-            if not tValueObj:
-                break
-            index = index + 1
-            print("name = %s, value = %s" % (name, tValueObj.GetValue()))
+            # like lua-upVal 0x5555557ac268
+            tValuePointer = common.Cast2TargetTypePointer(gdb.parse_and_eval(options.closure), "TValue")
 
+        upValues = ldebug.IterUpValues(tValuePointer, max(options.start, 0) + 1)
+        for index, name, tValueObj in records.Window(upValues, options, skipped=True):
+            if options.json:
+                records.Emit(records.TValueRecord(tValueObj, index=index, name=name,
+                                                  address=hex(int(tValueObj.tValuePointer))))
+            else:
+                print("name = %s, value = %s" % (name, tValueObj.GetValue()))
 
 LuaBacktrace()
 LuaPrintStack()
 LuaPrintTValue()
+LuaPrintTable()
 LuaPrintCoroutines()
+LuaDisasm()
+LuaHeapStats()
+LuaGCState()
+LuaHeapSnapshot()
+LuaHeapDiff()
+LuaWhoHolds()
+LuaStrings()
+LuaBreak()
+LuaStep()
+LuaNext()
+LuaFinish()
+LuaWatch()
+LuaProfile()
+LuaPerfStats()
+LuaExportLayout()
+LuaCapture()
 LuaPrintLocalVal()
 LuaPrintUpVal()
 
+printers.Register()
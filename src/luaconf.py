@@ -0,0 +1,68 @@
+import gdb
+from typing import Dict, Optional
+import typecache
+
+"""
+Build options of Lua that change the layouts or the debug information.
+
+They are read from the layout manifest when there is one, otherwise from the debug
+information of the inferior: sizes of types for the options that change them, and the
+macro itself for the others (only present when Lua is built with -g3). When neither is
+available the default of the Lua 5.4 sources is used.
+"""
+
+# defaults of luaconf.h, llimits.h and ldebug.c
+DEFAULTS = {
+    "LUA_32BITS": 0,
+    "LUAI_MAXSHORTLEN": 40,
+    "LUA_IDSIZE": 60,
+    "MAXIWTHABS": 128,
+}
+
+_options: Dict[str, int] = {}
+
+
+def _Macro(name: str) -> Optional[int]:
+    try:
+        return int(gdb.parse_and_eval(name))
+    except (gdb.error, RuntimeError):
+        return None
+
+
+def _DetectOption(name: str) -> Optional[int]:
+    try:
+        if name == "LUA_32BITS":
+            # lua_Integer is an int and lua_Number a float
+            return int(typecache.Sizeof("lua_Integer") == 4 and typecache.Sizeof("lua_Number") == 4)
+        if name == "LUA_IDSIZE":
+            # char short_src[LUA_IDSIZE]
+            return int(typecache.FieldType("lua_Debug", "short_src").sizeof)
+    except (gdb.error, KeyError):
+        pass
+    return _Macro(name)
+
+
+def Detect() -> Dict[str, int]:
+    """
+    All the options read from the debug information, for lua-export-layout
+    """
+    options = {}
+    for name, default in DEFAULTS.items():
+        value = _DetectOption(name)
+        options[name] = default if value is None else value
+    return options
+
+
+def Get(name: str) -> int:
+    value = _options.get(name)
+    if value is None:
+        value = typecache.ManifestOption(name)
+        if value is None:
+            value = _DetectOption(name)
+        if value is None:
+            value = DEFAULTS[name]
+        _options[name] = value
+    return value
+
+
+typecache.RegisterInvalidateCallback(_options.clear)
@@ -0,0 +1,90 @@
+import bisect
+import hashlib
+import json
+import mmap
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+"""
+Memory image of a Lua state written by lua-capture (see capture.py), mapped with mmap.
+
+    magic, version, header offset, header length (IMAGE_HEADER)
+    the bytes of the regions, each one starting at its offset in the file
+    header: JSON, {"layout", "symbols", "regions": [[address, length, offset]...]} sorted by address
+
+Only the captured regions are readable, Read(address, length) works like elfcore.CoreFile.
+"""
+
+IMAGE_MAGIC = b"LUAIMAGE"
+IMAGE_VERSION = 1
+# magic, version, header offset, header length
+IMAGE_HEADER = struct.Struct("<8sIQQ")
+# offsets of the regions in the file are aligned to this
+IMAGE_ALIGN = 8
+
+
+class ImageMemoryError(Exception):
+    pass
+
+
+def IsImage(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+
+class ImageFile(object):
+
+    def __init__(self, path: str, memoryError=ImageMemoryError):
+        """
+        memoryError is the exception raised for addresses out of the captured regions, like gdb.MemoryError
+        """
+        self.path = path
+        self.memoryError = memoryError
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version, headerOffset, headerLength = IMAGE_HEADER.unpack_from(self.view)
+        if magic != IMAGE_MAGIC:
+            raise ValueError("%s is not a Lua image" % path)
+        if version != IMAGE_VERSION:
+            raise ValueError("%s is an image of version %d, expected %d" % (path, version, IMAGE_VERSION))
+        header = json.loads(bytes(self.view[headerOffset: headerOffset + headerLength]).decode("utf-8"))
+        self.layout: dict = header["layout"]
+        # captures of the same binary have the same key
+        self.layoutKey = hashlib.sha1(json.dumps(self.layout, sort_keys=True).encode("utf-8")).hexdigest()
+        self.symbols: Dict[str, int] = header["symbols"]
+        # (address, length, offset in the file) sorted by address
+        self.regions: List[Tuple[int, int, int]] = [tuple(region) for region in header["regions"]]
+        self._starts = [region[0] for region in self.regions]
+
+    def _Find(self, address: int) -> Optional[Tuple[int, int, int]]:
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i >= 0:
+            region = self.regions[i]
+            if address < region[0] + region[1]:
+                return region
+        return None
+
+    def Read(self, address: int, length: int) -> memoryview:
+        region = self._Find(address)
+        if region is None:
+            raise self.memoryError("Cannot access memory at address %s" % hex(address))
+        regionAddress, regionLength, offset = region
+        start = offset + address - regionAddress
+        if address + length <= regionAddress + regionLength:
+            return self.view[start: start + length]
+        # merged regions never touch, the rest of the range was not captured
+        raise self.memoryError("Cannot access memory at address %s" % hex(regionAddress + regionLength))
+
+    def IterWritableSegments(self) -> Iterator[Tuple[int, memoryview]]:
+        for address, length, offset in self.regions:
+            yield address, self.view[offset: offset + length]
+
+    def Close(self) -> None:
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # slices still referenced somewhere, the map is closed when they are collected
+            pass
+        self.file.close()
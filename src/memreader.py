@@ -0,0 +1,407 @@
+import gdb
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Sequence, Tuple
+import perfstats
+import typecache
+
+"""
+Bulk memory access for the plugin.
+
+Reading a field through gdb.Value costs one round-trip to the inferior
+(usually a ptrace call) per field. The helpers here read whole structs or
+whole arrays with a single read_memory call and decode them with struct,
+using the offsets resolved by typecache.
+"""
+
+# read at most this many bytes per read_memory call when walking arrays
+CHUNK_BYTES = 1 << 20
+
+_LUA_VSHRSTR = 0X04
+
+# bytes read after the TString header in the first read, enough for most short strings
+TSTRING_SPECULATIVE_BYTES = 64
+
+# block size of ReadAhead
+BLOCK_BYTES = 1 << 16
+# blocks kept by ReadAhead, the least recently used are dropped first.
+# The GC list walks are mostly sequential, a few hundred blocks are enough for them
+MAX_BLOCKS = 256
+
+_byteOrder = None
+_blockCache: "OrderedDict[int, memoryview]" = None
+_readAheadDepth = 0
+_decoderCache: Dict[Tuple[str, Tuple[str, ...]], "StructDecoder"] = {}
+_formatCache: Dict[str, struct.Struct] = {}
+_tValueLayout = None
+
+
+def ByteOrder() -> str:
+    """
+    struct byte order prefix of the target, '<' or '>'
+    """
+    global _byteOrder
+    if _byteOrder is None:
+        manifest = typecache.GetManifest()
+        if manifest is not None:
+            _byteOrder = manifest["byteOrder"]
+            return _byteOrder
+        try:
+            endian = gdb.execute("show endian", to_string=True)
+        except gdb.error:
+            endian = ""
+        if "big endian" in endian:
+            _byteOrder = ">"
+        elif "little endian" in endian:
+            _byteOrder = "<"
+        else:
+            _byteOrder = "<" if sys.byteorder == "little" else ">"
+    return _byteOrder
+
+
+def _ReadInferior(address: int, length: int) -> memoryview:
+    if perfstats.enabled:
+        perfstats.stats.memoryReads += 1
+        perfstats.stats.memoryBytes += length
+    return memoryview(gdb.selected_inferior().read_memory(address, length))
+
+
+def ReadMemory(address: int, length: int) -> memoryview:
+    if _blockCache is None or length > BLOCK_BYTES:
+        return _ReadInferior(address, length)
+    first = address // BLOCK_BYTES
+    last = (address + length - 1) // BLOCK_BYTES
+    offset = address - first * BLOCK_BYTES
+    if first == last:
+        block = _GetBlock(first)
+        if block is not None and offset + length <= len(block):
+            if perfstats.enabled:
+                perfstats.stats.blockHits += 1
+            return block[offset: offset + length]
+    else:
+        block = _GetBlock(first)
+        nextBlock = _GetBlock(last)
+        if block is not None and nextBlock is not None:
+            if perfstats.enabled:
+                perfstats.stats.blockHits += 1
+            return memoryview(bytes(block[offset:]) + bytes(nextBlock[: length - (BLOCK_BYTES - offset)]))
+    return _ReadInferior(address, length)
+
+
+def _GetBlock(index: int) -> memoryview:
+    if index in _blockCache:
+        _blockCache.move_to_end(index)
+        return _blockCache[index]
+    if perfstats.enabled:
+        perfstats.stats.blockMisses += 1
+    try:
+        block = _ReadInferior(index * BLOCK_BYTES, BLOCK_BYTES)
+    except gdb.MemoryError:
+        # partially mapped block, those reads go straight to the inferior
+        block = None
+    _blockCache[index] = block
+    if len(_blockCache) > MAX_BLOCKS:
+        _blockCache.popitem(last=False)
+    return block
+
+
+class ReadAhead(object):
+    """
+    Within this context small reads are served from BLOCK_BYTES aligned blocks
+    read once from the inferior. Objects allocated close to each other (GC lists,
+    CallInfo chains) then cost one read_memory call per block instead of one per object.
+    At most MAX_BLOCKS blocks are kept. Only use it while the inferior is stopped, the blocks are dropped on exit.
+    """
+
+    def __enter__(self):
+        global _blockCache, _readAheadDepth
+        if _readAheadDepth == 0:
+            _blockCache = OrderedDict()
+        _readAheadDepth += 1
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        global _blockCache, _readAheadDepth
+        _readAheadDepth -= 1
+        if _readAheadDepth == 0:
+            _blockCache = None
+        return False
+
+
+def _IsSigned(scalarType: gdb.Type) -> bool:
+    if scalarType.code == gdb.TYPE_CODE_BOOL:
+        return False
+    if hasattr(scalarType, "is_signed"):
+        return scalarType.is_signed
+    return "unsigned" not in str(scalarType)
+
+
+def ScalarFormat(scalarType: gdb.Type) -> str:
+    """
+    struct format character for a scalar type.
+    Structs and unions are decoded as raw unsigned integers of the same size.
+    """
+    scalarType = scalarType.strip_typedefs()
+    size = int(scalarType.sizeof)
+    if scalarType.code == gdb.TYPE_CODE_FLT:
+        return {4: "f", 8: "d"}[size]
+    fmt = {1: "b", 2: "h", 4: "i", 8: "q"}[size]
+    if scalarType.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_CHAR) and _IsSigned(scalarType):
+        return fmt
+    return fmt.upper()
+
+
+def _DescFormat(desc: dict) -> str:
+    """
+    Same as ScalarFormat for a type description of the layout manifest
+    """
+    size = desc["size"]
+    if desc["kind"] == "float":
+        return {4: "f", 8: "d"}[size]
+    fmt = {1: "b", 2: "h", 4: "i", 8: "q"}[size]
+    if desc["kind"] in ("int", "enum", "char") and desc.get("signed"):
+        return fmt
+    return fmt.upper()
+
+
+def TypeFormat(typeName: str) -> str:
+    desc = typecache.ManifestType(typeName)
+    if desc is not None:
+        return _DescFormat(desc)
+    return ScalarFormat(typecache.LookupType(typeName))
+
+
+def FieldFormat(typeName: str, fieldPath: str) -> str:
+    desc = typecache.ManifestField(typeName, fieldPath)
+    if desc is not None:
+        return _DescFormat(desc)
+    return ScalarFormat(typecache.FieldType(typeName, fieldPath))
+
+
+def _Struct(fmt: str) -> struct.Struct:
+    s = _formatCache.get(fmt)
+    if s is None:
+        s = struct.Struct(ByteOrder() + fmt)
+        _formatCache[fmt] = s
+    return s
+
+
+def _PackedFormat(size: int, fields: Sequence[Tuple[int, str]]) -> Tuple[str, List[int]]:
+    """
+    Build one struct format for non overlapping fields.
+    Return the format and, for each field, its position in the unpacked tuple.
+    """
+    order = sorted(range(len(fields)), key=lambda i: fields[i][0])
+    fmt = ""
+    position = 0
+    slots = [0] * len(fields)
+    for slot, i in enumerate(order):
+        offset, fieldFmt = fields[i]
+        if offset < position:
+            raise ValueError("overlapping fields")
+        if offset > position:
+            fmt += "%dx" % (offset - position)
+        fmt += fieldFmt
+        position = offset + struct.calcsize("=" + fieldFmt)
+        slots[i] = slot
+    if size > position:
+        fmt += "%dx" % (size - position)
+    return fmt, slots
+
+
+class StructDecoder(object):
+    """
+    Decode some fields of a struct from raw bytes.
+    Field paths are the same as typecache.Offsetof, like "func.p".
+    """
+
+    def __init__(self, typeName: str, fieldPaths: Sequence[str]):
+        self.typeName = typeName
+        self.fieldPaths = tuple(fieldPaths)
+        self.size = typecache.Sizeof(typeName)
+        fields = [(typecache.Offsetof(typeName, path), FieldFormat(typeName, path)) for path in self.fieldPaths]
+        try:
+            fmt, self._slots = _PackedFormat(self.size, fields)
+            self._packed = _Struct(fmt)
+            self._fields = None
+        except ValueError:
+            # union members share bytes, decode them one by one
+            self._packed = None
+            self._fields = [(offset, _Struct(fieldFmt)) for offset, fieldFmt in fields]
+
+    def Decode(self, buffer, base: int = 0) -> Tuple:
+        if self._packed is not None:
+            values = self._packed.unpack_from(buffer, base)
+            return tuple(values[slot] for slot in self._slots)
+        return tuple(s.unpack_from(buffer, base + offset)[0] for offset, s in self._fields)
+
+    def Read(self, address: int) -> Tuple:
+        return self.Decode(ReadMemory(address, self.size))
+
+
+def GetDecoder(typeName: str, fieldPaths: Sequence[str]) -> StructDecoder:
+    key = (typeName, tuple(fieldPaths))
+    decoder = _decoderCache.get(key)
+    if decoder is None:
+        decoder = StructDecoder(typeName, fieldPaths)
+        _decoderCache[key] = decoder
+    return decoder
+
+
+def ReadStruct(address: int, typeName: str, fieldPaths: Sequence[str]) -> Tuple:
+    """
+    Read a whole struct with one read_memory call and return the given fields
+    """
+    return GetDecoder(typeName, fieldPaths).Read(address)
+
+
+def ReadPointer(address: int) -> int:
+    fmt = TypeFormat("void *")
+    return _Struct(fmt).unpack_from(ReadMemory(address, struct.calcsize("=" + fmt)))[0]
+
+
+def WriteField(address: int, typeName: str, fieldPath: str, value: int) -> None:
+    """
+    Write one scalar field of the struct at address in the inferior
+    """
+    data = _Struct(FieldFormat(typeName, fieldPath)).pack(value)
+    gdb.selected_inferior().write_memory(address + typecache.Offsetof(typeName, fieldPath), data)
+
+
+def IterPointers(address: int, count: int) -> Iterator[int]:
+    """
+    Yield count pointers starting at address, read in chunks of CHUNK_BYTES
+    """
+    pointerStruct = _Struct(TypeFormat("void *"))
+    perChunk = max(1, CHUNK_BYTES // pointerStruct.size)
+    start = 0
+    while start < count:
+        n = min(perChunk, count - start)
+        for pointer, in pointerStruct.iter_unpack(ReadMemory(address + start * pointerStruct.size, n * pointerStruct.size)):
+            yield pointer
+        start += n
+
+
+class TValueLayout(object):
+    """
+    Offsets and formats needed to decode TValues and their 'value_' union
+    """
+
+    def __init__(self):
+        self.size = typecache.Sizeof("TValue")
+        self.valueOffset = typecache.Offsetof("TValue", "value_")
+        self.ttOffset = typecache.Offsetof("TValue", "tt_")
+        self.rawFmt = FieldFormat("TValue", "value_")
+        self.rawStruct = _Struct(self.rawFmt)
+        self.intStruct = _Struct(TypeFormat("lua_Integer"))
+        self.floatStruct = _Struct(TypeFormat("lua_Number"))
+        self.ttStruct = _Struct("B")
+        self._arrayStructs: Dict[int, Tuple[struct.Struct, bool]] = {}
+
+    def ArrayStruct(self, stride: int) -> Tuple[struct.Struct, bool]:
+        """
+        struct for one element of an array of TValue-like elements,
+        and whether it unpacks tt before the raw value
+        """
+        s = self._arrayStructs.get(stride)
+        if s is None:
+            fmt, slots = _PackedFormat(stride, [(self.valueOffset, self.rawFmt), (self.ttOffset, "B")])
+            s = (_Struct(fmt), slots[1] == 0)
+            self._arrayStructs[stride] = s
+        return s
+
+
+def GetTValueLayout() -> TValueLayout:
+    global _tValueLayout
+    if _tValueLayout is None:
+        _tValueLayout = TValueLayout()
+    return _tValueLayout
+
+
+def RawToInteger(raw: int) -> int:
+    layout = GetTValueLayout()
+    return layout.intStruct.unpack_from(layout.rawStruct.pack(raw))[0]
+
+
+def RawToFloat(raw: int) -> float:
+    layout = GetTValueLayout()
+    return layout.floatStruct.unpack_from(layout.rawStruct.pack(raw))[0]
+
+
+def DecodeTValue(buffer, base: int = 0) -> Tuple[int, int]:
+    """
+    return (tt, raw value) of the TValue at buffer[base:]
+    """
+    layout = GetTValueLayout()
+    raw = layout.rawStruct.unpack_from(buffer, base + layout.valueOffset)[0]
+    tt = layout.ttStruct.unpack_from(buffer, base + layout.ttOffset)[0]
+    return tt, raw
+
+
+def ReadTValue(address: int) -> Tuple[int, int]:
+    return DecodeTValue(ReadMemory(address, GetTValueLayout().size))
+
+
+def IterTValues(address: int, count: int, stride: int = 0, reverse: bool = False) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (tt, raw value) for count TValues starting at address.
+    stride is the distance between two elements (Sizeof("StackValue") for a Lua stack),
+    elements are read in chunks of CHUNK_BYTES. With reverse the last element comes first.
+    """
+    if count <= 0:
+        return
+    if stride == 0:
+        stride = GetTValueLayout().size
+    elementStruct, ttFirst = GetTValueLayout().ArrayStruct(stride)
+    perChunk = max(1, CHUNK_BYTES // stride)
+    if not reverse:
+        start = 0
+        while start < count:
+            n = min(perChunk, count - start)
+            elements = elementStruct.iter_unpack(ReadMemory(address + start * stride, n * stride))
+            for first, second in elements:
+                yield (first, second) if ttFirst else (second, first)
+            start += n
+    else:
+        end = count
+        while end > 0:
+            n = min(perChunk, end)
+            elements = list(elementStruct.iter_unpack(ReadMemory(address + (end - n) * stride, n * stride)))
+            for first, second in reversed(elements):
+                yield (first, second) if ttFirst else (second, first)
+            end -= n
+
+
+def ReadTString(address: int, maxLength: int = -1) -> str:
+    """
+    Same as common.Getstr but with at most two reads.
+    When maxLength >= 0 only the first maxLength bytes are read.
+    """
+    decoder = GetDecoder("TString", ("tt", "shrlen", "u.lnglen"))
+    contentsOffset = typecache.Offsetof("TString", "contents")
+    headerSize = max(decoder.size, contentsOffset)
+    try:
+        buffer = ReadMemory(address, headerSize + TSTRING_SPECULATIVE_BYTES)
+    except gdb.MemoryError:
+        buffer = ReadMemory(address, headerSize)
+    tt, shrlen, lnglen = decoder.Decode(buffer)
+    length = shrlen if (tt & 0X3F) == _LUA_VSHRSTR else lnglen
+    if maxLength >= 0:
+        length = min(length, maxLength)
+    if contentsOffset + length <= len(buffer):
+        contents = buffer[contentsOffset: contentsOffset + length]
+    else:
+        contents = ReadMemory(address + contentsOffset, length)
+    return bytes(contents).decode("utf-8", errors="backslashreplace")
+
+
+def _Invalidate() -> None:
+    global _byteOrder, _tValueLayout
+    _byteOrder = None
+    _tValueLayout = None
+    _decoderCache.clear()
+    _formatCache.clear()
+
+
+typecache.RegisterInvalidateCallback(_Invalidate)
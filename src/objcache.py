@@ -0,0 +1,97 @@
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+import perfstats
+import typecache
+
+"""
+Cache of the data decoded from Lua objects that never change once created: the code, line
+table, local variables and upvalue names of a Proto, its source string...
+
+Entries are keyed by (kind, address) and kept across stops. Each entry stores the signature
+it was built from, fields of the object read again on every lookup (the GC tag tt first),
+so a freed object whose memory was reused by another object is a miss, not a wrong answer.
+The least recently used entries are dropped when the estimated size goes over the cap,
+$LUA_GDB_CACHE_MB megabytes (default 64).
+"""
+
+CACHE_MB_ENV = "LUA_GDB_CACHE_MB"
+DEFAULT_CACHE_MB = 64
+
+
+def _MaxBytes() -> int:
+    try:
+        return int(float(os.environ.get(CACHE_MB_ENV, DEFAULT_CACHE_MB)) * (1 << 20))
+    except ValueError:
+        return DEFAULT_CACHE_MB << 20
+
+
+class ObjectCache(object):
+
+    def __init__(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (kind, address) -> (signature, value, size), least recently used first
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Tuple, Any, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def Get(self, kind: str, address: int, signature: Tuple) -> Optional[Any]:
+        key = (kind, address)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != signature:
+            if entry is not None:
+                # the object was freed and its memory reused
+                self._Remove(key)
+            self.misses += 1
+            if perfstats.enabled:
+                perfstats.stats.objectCacheMisses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if perfstats.enabled:
+            perfstats.stats.objectCacheHits += 1
+        return entry[1]
+
+    def Put(self, kind: str, address: int, signature: Tuple, value: Any, size: int) -> None:
+        key = (kind, address)
+        if key in self._entries:
+            self._Remove(key)
+        if size > self.maxBytes:
+            return
+        self._entries[key] = (signature, value, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes:
+            oldKey = next(iter(self._entries))
+            self._Remove(oldKey)
+            self.evictions += 1
+
+    def _Remove(self, key: Tuple[str, int]) -> None:
+        signature, value, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def Clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+
+_cache = ObjectCache(_MaxBytes())
+
+
+def GetCache() -> ObjectCache:
+    return _cache
+
+
+def Get(kind: str, address: int, signature: Tuple) -> Optional[Any]:
+    return _cache.Get(kind, address, signature)
+
+
+def Put(kind: str, address: int, signature: Tuple, value: Any, size: int) -> None:
+    _cache.Put(kind, address, signature, value, size)
+
+
+typecache.RegisterInvalidateCallback(_cache.Clear)
@@ -0,0 +1,144 @@
+import gdb
+import cProfile
+import time
+from typing import Dict, List, Optional
+
+"""
+Counters of what the plugin itself does while running a command, for lua-perfstats.
+
+The hot helpers of common.py, ldebug.py, memreader.py, typecache.py and objcache.py count
+inline, behind `if perfstats.enabled:`. enabled is only True while lua-perfstats runs a
+command, otherwise the instrumentation costs one module attribute read per call.
+
+gdb.Value field reads are counted by common.ValueField, one per field, where the helpers that
+walk Lua structs through gdb.Value (CallInfoValue, Rawtt, S2V, Getstr, LuaGetinfo, findlocal...)
+read them, not for every gdb.Value in the plugin. Phases are timed exclusively: the time of a phase run inside another one is not
+counted in the outer one, what is in no phase is reported as other.
+"""
+
+enabled = False
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.seconds = 0.0
+        # output of the command when it was run with toString
+        self.output: Optional[str] = None
+        # gdb.Value field reads in the instrumented helpers
+        self.valueReads = 0
+        # gdb.lookup_type calls, and LookupType answered from typecache
+        self.lookupTypes = 0
+        self.typeCacheHits = 0
+        # read_memory calls and bytes read from the inferior
+        self.memoryReads = 0
+        self.memoryBytes = 0
+        # reads served by a ReadAhead block, blocks read
+        self.blockHits = 0
+        self.blockMisses = 0
+        # objcache
+        self.objectCacheHits = 0
+        self.objectCacheMisses = 0
+        # phase name -> [seconds, count]
+        self.phases: Dict[str, List] = {}
+
+
+stats = Stats()
+_phaseStack: List["_PhaseTimer"] = []
+
+
+class _PhaseTimer(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def _Add(self, seconds: float, count: int) -> None:
+        phase = stats.phases.get(self.name)
+        if phase is None:
+            phase = stats.phases[self.name] = [0.0, 0]
+        phase[0] += seconds
+        phase[1] += count
+
+    def __enter__(self):
+        now = time.perf_counter()
+        if _phaseStack:
+            # the outer phase is paused
+            outer = _phaseStack[-1]
+            outer._Add(now - outer.start, 0)
+        self._Add(0.0, 1)
+        self.start = now
+        _phaseStack.append(self)
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        now = time.perf_counter()
+        _phaseStack.pop()
+        self._Add(now - self.start, 0)
+        if _phaseStack:
+            _phaseStack[-1].start = now
+        return False
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def Phase(name: str):
+    """
+    with perfstats.Phase("line lookup"): ...
+    """
+    return _PhaseTimer(name) if enabled else _NULL_PHASE
+
+
+def Run(command: str, profilePath: Optional[str] = None, toString: bool = False) -> Stats:
+    """
+    Run a gdb command with the counters on, and cProfile when profilePath is given.
+    Return the counters, with the output of the command in stats.output when toString.
+    """
+    global enabled, stats
+    stats = Stats()
+    del _phaseStack[:]
+    profile = cProfile.Profile() if profilePath else None
+    enabled = True
+    start = time.perf_counter()
+    try:
+        if profile is not None:
+            profile.enable()
+        stats.output = gdb.execute(command, to_string=toString)
+    finally:
+        if profile is not None:
+            profile.disable()
+        stats.seconds = time.perf_counter() - start
+        enabled = False
+    if profile is not None:
+        profile.dump_stats(profilePath)
+    return stats
+
+
+def FormatStats(command: str, result: Stats) -> List[str]:
+    lines = [
+        "%s: %.3f s" % (command, result.seconds),
+        "%-28s %10d" % ("gdb.Value field reads", result.valueReads),
+        "%-28s %10d   typecache hits %d" % ("gdb.lookup_type calls", result.lookupTypes, result.typeCacheHits),
+        "%-28s %10d   %d bytes" % ("read_memory calls", result.memoryReads, result.memoryBytes),
+        "%-28s %10d   blocks read %d" % ("read-ahead hits", result.blockHits, result.blockMisses),
+        "%-28s %10d   misses %d" % ("object cache hits", result.objectCacheHits, result.objectCacheMisses),
+        "",
+        "%-20s %10s %10s" % ("phase", "seconds", "count"),
+    ]
+    inPhases = 0.0
+    for name, (seconds, count) in sorted(result.phases.items(), key=lambda item: -item[1][0]):
+        lines.append("%-20s %10.3f %10d" % (name, seconds, count))
+        inPhases += seconds
+    lines.append("%-20s %10.3f" % ("other", max(0.0, result.seconds - inPhases)))
+    return lines
@@ -0,0 +1,227 @@
+import gdb
+import gdb.printing
+from typing import Iterator, Tuple
+import common
+import ltable
+import memreader
+import typecache
+
+"""
+gdb pretty-printers for the Lua types.
+
+children() are generators, gdb (and MI varobjs) only pull the children it shows,
+so a big table or stack is never read as a whole just to be displayed.
+The tables inside a table are children of type Table *, printed as "table 0x..." without children,
+so _G._G or any other cycle is not expanded again.
+"""
+
+
+def _TValueAt(address: int) -> gdb.Value:
+    return gdb.Value(address).cast(typecache.LookupPointerType("TValue")).dereference()
+
+
+def _DecodeTValue(val: gdb.Value) -> Tuple[int, int]:
+    if val.address is not None:
+        return memreader.ReadTValue(int(val.address))
+    # not in memory, like a value returned by a function
+    rawBits = 8 * typecache.Sizeof("Value")
+    return int(val['tt_']), int(val['value_']['i']) % (1 << rawBits)
+
+
+def _TableChild(address: int, tt: int, raw: int) -> gdb.Value:
+    if common.WithVariant(tt) == common.LUA_VTABLE:
+        # a leaf, see TablePointerPrinter
+        return gdb.Value(raw).cast(typecache.LookupPointerType("Table"))
+    return _TValueAt(address)
+
+
+def _IterTableChildren(tableAddress: int) -> Iterator[Tuple[str, gdb.Value]]:
+    header = ltable.TableHeader(tableAddress)
+    tValueSize = typecache.Sizeof("TValue")
+    nodeSize = typecache.Sizeof("Node")
+    nodeValueOffset = typecache.Offsetof("Node", "i_val")
+    for index, tt, raw in ltable.IterArray(header):
+        yield "[%d]" % index, _TableChild(header.array + (index - 1) * tValueSize, tt, raw)
+    for nodeIndex, keyTt, keyRaw, tt, raw in ltable.IterNodes(header):
+        yield ltable.FormatKey(keyTt, keyRaw), _TableChild(header.node + nodeIndex * nodeSize + nodeValueOffset, tt, raw)
+
+
+class TValuePrinter(object):
+    """Print a TValue as its Lua value, tables expand to their entries"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def _TValue(self) -> gdb.Value:
+        return self.val
+
+    def to_string(self):
+        try:
+            tt, raw = _DecodeTValue(self._TValue())
+            if common.WithVariant(tt) == common.LUA_VTABLE:
+                return "table %s" % hex(raw)
+            return "%s %s" % (common.LuaType2TypeName.get(common.Novariant(tt), tt), ltable.FormatValue(tt, raw))
+        except gdb.MemoryError:
+            return "<unreadable TValue>"
+
+    def children(self):
+        try:
+            tt, raw = _DecodeTValue(self._TValue())
+        except gdb.MemoryError:
+            return
+        if common.WithVariant(tt) == common.LUA_VTABLE:
+            yield from _IterTableChildren(raw)
+
+
+class StackValuePrinter(TValuePrinter):
+    """Print a StackValue as the TValue it holds"""
+
+    def _TValue(self) -> gdb.Value:
+        return self.val['val']
+
+
+class TStringPrinter(object):
+    """Print a TString as its content"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        if self.val.address is None:
+            return common.Getstr(self.val)
+        try:
+            return memreader.ReadTString(int(self.val.address))
+        except gdb.MemoryError:
+            return "<unreadable TString>"
+
+    def display_hint(self):
+        return "string"
+
+
+class TablePrinter(object):
+    """Print a Table as its entries, array part first"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        try:
+            header = ltable.TableHeader(int(self.val.address))
+        except gdb.MemoryError:
+            return "<unreadable Table>"
+        return "table (array %d, hash %d)" % (header.arraySize, header.nodeSize)
+
+    def children(self):
+        try:
+            yield from _IterTableChildren(int(self.val.address))
+        except gdb.MemoryError:
+            return
+
+
+class TablePointerPrinter(object):
+    """Print a Table * as table 0x..., the entries are printed by p *pointer"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        return "table %s" % hex(int(self.val))
+
+
+def LookupTablePointer(val: gdb.Value):
+    valueType = val.type.strip_typedefs()
+    if valueType.code == gdb.TYPE_CODE_PTR and valueType.target().strip_typedefs().tag == "Table":
+        return TablePointerPrinter(val)
+    return None
+
+
+def _ProtoDescription(protoPointer: gdb.Value) -> str:
+    source = "=?"
+    if protoPointer['source']:
+        source = memreader.ReadTString(int(protoPointer['source']))
+    return "%s:%d" % (source, int(protoPointer['linedefined']))
+
+
+class ClosurePrinter(object):
+    """Print a Closure with its function and upvalues"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        tt = int(self.val['c']['tt'])
+        if tt == common.LUA_VLCL:
+            return "Lua closure <%s>" % _ProtoDescription(self.val['l']['p'])
+        return "C closure %s" % self.val['c']['f']
+
+    def children(self):
+        tt = int(self.val['c']['tt'])
+        nupvalues = int(self.val['c']['nupvalues'])
+        if tt == common.LUA_VLCL:
+            protoPointer = self.val['l']['p']
+            for i in range(nupvalues):
+                name = protoPointer['upvalues'][i]['name']
+                label = memreader.ReadTString(int(name)) if name else "(no name)"
+                yield label, self.val['l']['upvals'][i]['v']['p'].dereference()
+        else:
+            for i in range(nupvalues):
+                yield "[%d]" % (i + 1), self.val['c']['upvalue'][i]
+
+
+class ProtoPrinter(object):
+    """Print a Proto with its constants and nested functions"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        return "proto <%s-%d>" % (_ProtoDescription(self.val.address), int(self.val['lastlinedefined']))
+
+    def children(self):
+        for field in ("numparams", "is_vararg", "maxstacksize", "sizecode"):
+            yield field, self.val[field]
+        for i in range(int(self.val['sizek'])):
+            yield "k[%d]" % i, self.val['k'][i]
+        for i in range(int(self.val['sizep'])):
+            yield "p[%d]" % i, self.val['p'][i]
+
+
+class LuaStatePrinter(object):
+    """Print a lua_State with its stack slots, from the bottom of the stack"""
+
+    def __init__(self, val: gdb.Value):
+        self.val = val
+
+    def to_string(self):
+        stackValueSize = typecache.Sizeof("StackValue")
+        used = (int(self.val['top']['p']) - int(self.val['stack']['p'])) // stackValueSize
+        return "thread (status %d, %d stack slots used)" % (int(self.val['status']), used)
+
+    def children(self):
+        for field in ("status", "l_G", "ci", "openupval"):
+            yield field, self.val[field]
+        stackValue = self.val['stack']['p']
+        top = self.val['top']['p']
+        index = 1
+        while stackValue < top:
+            yield "[%d]" % index, stackValue.dereference()
+            stackValue = stackValue + 1
+            index += 1
+
+
+def BuildPrettyPrinter() -> gdb.printing.RegexpCollectionPrettyPrinter:
+    pp = gdb.printing.RegexpCollectionPrettyPrinter("lua")
+    pp.add_printer("TValue", "^TValue$", TValuePrinter)
+    pp.add_printer("StackValue", "^StackValue$", StackValuePrinter)
+    pp.add_printer("TString", "^TString$", TStringPrinter)
+    pp.add_printer("Table", "^Table$", TablePrinter)
+    pp.add_printer("Closure", "^Closure$", ClosurePrinter)
+    pp.add_printer("Proto", "^Proto$", ProtoPrinter)
+    pp.add_printer("lua_State", "^lua_State$", LuaStatePrinter)
+    return pp
+
+
+def Register(objfile=None) -> None:
+    gdb.printing.register_pretty_printer(objfile, BuildPrettyPrinter(), replace=True)
+    # the regexp printers only match the name of a type, not a pointer to it
+    gdb.printing.register_pretty_printer(objfile, LookupTablePointer)
@@ -0,0 +1,268 @@
+import gdb
+import subprocess
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+import common
+import ldebug
+import memreader
+import typecache
+
+"""
+Sampling profiler of the Lua code running in the inferior.
+
+The inferior is stopped hz times per second with SIGSTOP, sent by a small shell
+loop so that the timing does not depend on gdb. At each stop the CallInfo chain of
+the running lua_State is read with memreader, and every frame is turned into a label
+cached by (Proto, pc), so that a sample costs a few reads and dictionary lookups.
+"""
+
+CI_SAMPLE_FIELDS = ("func.p", "u.l.savedpc", "callstatus", "previous")
+# read at every sample of a Proto, the labels cached for it are kept while they do not change
+PROTO_SAMPLE_FIELDS = ("code", "sizecode", "lineinfo", "source", "linedefined")
+
+# sleeps $0 seconds and stops process $1 for every line read on stdin
+_STOPPER_SCRIPT = 'while read line; do sleep "$0"; kill -STOP "$1" 2>/dev/null; done'
+
+
+def _CleanLabel(label: str) -> str:
+    # ';' separates frames and ' ' the count in the folded format
+    return label.replace(";", ":").replace("\n", " ")
+
+
+class _ProtoLabels(object):
+    """
+    The labels of one Proto, valid while the Proto still has the fields of signature
+    """
+
+    def __init__(self, signature: Tuple[int, ...], shortSrc: str):
+        self.signature = signature
+        self.code = signature[0]
+        self.linedefined = signature[4]
+        self.shortSrc = shortSrc
+        # pc -> "src:line"
+        self.lines: Dict[int, str] = {}
+        # pc of a call -> name of the called function, or None
+        self.callNames: Dict[int, Optional[str]] = {}
+
+
+class StackSampler(object):
+    """
+    Turn the Lua stack of a lua_State into a tuple of frame labels, outermost first.
+    Labels are like "format (m.lua:12)" for Lua functions and "[C] print" for C functions.
+    The labels of a Proto are dropped when its code, line info or source change, like the
+    signatures of objcache, so a Proto freed and allocated again at the same address is decoded again.
+    """
+
+    def __init__(self):
+        self.baseCiOffset = typecache.Offsetof("lua_State", "base_ci")
+        self.instructionSize = typecache.Sizeof("Instruction")
+        self.lclTag = common.Ctb(common.LUA_VLCL)
+        self.cclTag = common.Ctb(common.LUA_VCCL)
+        # Proto -> its labels
+        self._protos: Dict[int, _ProtoLabels] = {}
+        # C function -> its symbol
+        self._cNames: Dict[int, str] = {}
+
+    def _Proto(self, proto: int) -> _ProtoLabels:
+        signature = memreader.ReadStruct(proto, "Proto", PROTO_SAMPLE_FIELDS)
+        labels = self._protos.get(proto)
+        if labels is None or labels.signature != signature:
+            source = signature[3]
+            ar = ldebug.LuaDebug()
+            if source:
+                ar.source = memreader.ReadTString(source)
+                ar.srclen = len(ar.source)
+            else:
+                ar.source, ar.srclen = "=?", 2
+            ldebug.LuaOChunkId(ar)
+            labels = _ProtoLabels(signature, ar.shortSrc)
+            self._protos[proto] = labels
+        return labels
+
+    def _Line(self, proto: int, labels: _ProtoLabels, pc: int) -> str:
+        where = labels.lines.get(pc)
+        if where is None:
+            protoPointer = gdb.Value(proto).cast(typecache.LookupPointerType("Proto"))
+            where = "%s:%d" % (labels.shortSrc, ldebug.LuaG_Getfuncline(protoPointer, pc))
+            labels.lines[pc] = where
+        return where
+
+    def _CallName(self, proto: int, labels: _ProtoLabels, pc: int) -> Optional[str]:
+        if pc not in labels.callNames:
+            protoCode = ldebug.GetProtoCode(proto)
+            name = None
+            if 0 <= pc < len(protoCode.code):
+                namewhat, name = ldebug.FuncNameFromCode(protoCode, pc)
+            labels.callNames[pc] = name
+        return labels.callNames[pc]
+
+    def _CName(self, function: int) -> str:
+        name = self._cNames.get(function)
+        if name is None:
+            name = hex(function)
+            try:
+                block = gdb.block_for_pc(function)
+                if block is not None and block.function is not None:
+                    name = block.function.name
+            except RuntimeError:
+                pass
+            self._cNames[function] = name
+        return name
+
+    def Sample(self, luaStateAddress: int) -> Tuple[str, ...]:
+        baseCi = luaStateAddress + self.baseCiOffset
+        ci, = memreader.ReadStruct(luaStateAddress, "lua_State", ("ci",))
+        # (Proto, its labels, pc, callstatus) of Lua frames, (None, None, lua_CFunction, callstatus) of C frames,
+        # innermost first
+        frames = []
+        while ci != baseCi and ci != 0:
+            func, savedpc, callstatus, previous = memreader.ReadStruct(ci, "CallInfo", CI_SAMPLE_FIELDS)
+            tt, raw = memreader.ReadTValue(func)
+            if tt == self.lclTag and not (callstatus & common.CallInfoValue.CIST_C):
+                proto, = memreader.ReadStruct(raw, "LClosure", ("p",))
+                protoLabels = self._Proto(proto)
+                frames.append((proto, protoLabels, (savedpc - protoLabels.code) // self.instructionSize - 1, callstatus))
+            elif tt == self.cclTag:
+                function, = memreader.ReadStruct(raw, "CClosure", ("f",))
+                frames.append((None, None, function, callstatus))
+            else:
+                # light C function, raw is the lua_CFunction
+                frames.append((None, None, raw if tt == common.LUA_VLCF else 0, callstatus))
+            ci = previous
+
+        labels = []
+        for i, (proto, protoLabels, pcOrFunction, callstatus) in enumerate(frames):
+            name = None
+            if i + 1 < len(frames) and not (callstatus & common.CallInfoValue.CIST_TAIL):
+                callerProto, callerLabels, callerPc, callerStatus = frames[i + 1]
+                if callerProto is not None and not (callerStatus & common.CallInfoValue.CIST_HOOKED):
+                    name = self._CallName(callerProto, callerLabels, callerPc)
+            if proto is not None:
+                if name is None:
+                    name = ("main chunk" if protoLabels.linedefined == 0
+                            else "<%s:%d>" % (protoLabels.shortSrc, protoLabels.linedefined))
+                labels.append("%s (%s)" % (name, self._Line(proto, protoLabels, pcOrFunction)))
+            else:
+                labels.append("[C] %s" % (name or self._CName(pcOrFunction)))
+        labels.reverse()
+        return tuple(_CleanLabel(label) for label in labels)
+
+
+class FoldedProfile(object):
+    """
+    Identical stacks aggregated in memory, written in the folded format of flamegraph.pl
+    """
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.missed = 0
+        self.sampleSeconds = 0.0
+
+    def Add(self, stack: Tuple[str, ...]) -> None:
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def Write(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (";".join(stack) if stack else "[no Lua frame]", count))
+
+
+def _SignalHandling(signalName: str) -> str:
+    """
+    Current "stop print pass" setting of the signal, to restore it after the profile
+    """
+    output = gdb.execute("info signals %s" % signalName, to_string=True)
+    for line in output.splitlines():
+        fields = line.split()
+        if fields and fields[0] == signalName and len(fields) >= 4:
+            words = [("" if field == "Yes" else "no") for field in fields[1:4]]
+            return "%sstop %sprint %spass" % tuple(words)
+    return "stop print pass"
+
+
+class _StopWatcher(object):
+
+    def __init__(self):
+        self.signal = None
+        self.exited = False
+        self.other = False
+
+    def OnStop(self, event) -> None:
+        if isinstance(event, gdb.SignalEvent):
+            self.signal = event.stop_signal
+        else:
+            self.other = True
+
+    def OnExit(self, event) -> None:
+        self.exited = True
+
+
+def _SelectLuaThread(preferred: "Optional[gdb.InferiorThread]") -> "Tuple[Optional[gdb.InferiorThread], Optional[int]]":
+    """
+    Thread running Lua code and its L, trying the thread of the previous sample first
+    """
+    threads = list(gdb.selected_inferior().threads())
+    if preferred is not None and preferred in threads:
+        threads.remove(preferred)
+        threads.insert(0, preferred)
+    for thread in threads:
+        if not thread.is_valid():
+            continue
+        thread.switch()
+        luaStatePointer = common.FindLuaState()
+        if luaStatePointer is not None and int(luaStatePointer) != 0:
+            return thread, int(luaStatePointer)
+    return None, None
+
+
+def Profile(duration: float, hz: int) -> FoldedProfile:
+    """
+    Sample the inferior for duration seconds, hz times per second.
+    The inferior must be stopped, it is stopped again at the end.
+    """
+    inferior = gdb.selected_inferior()
+    if inferior.pid == 0:
+        raise gdb.GdbError("The program is not being run.")
+
+    profile = FoldedProfile()
+    sampler = StackSampler()
+    watcher = _StopWatcher()
+    handling = _SignalHandling("SIGSTOP")
+    gdb.execute("handle SIGSTOP stop noprint nopass", to_string=True)
+    gdb.events.stop.connect(watcher.OnStop)
+    gdb.events.exited.connect(watcher.OnExit)
+    stopper = subprocess.Popen(["/bin/sh", "-c", _STOPPER_SCRIPT, "%f" % (1.0 / hz), str(inferior.pid)],
+                               stdin=subprocess.PIPE)
+    thread = None
+    try:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            watcher.signal = None
+            stopper.stdin.write(b"\n")
+            stopper.stdin.flush()
+            gdb.execute("continue", to_string=True)
+            if watcher.exited:
+                print("The program exited, profile stopped")
+                break
+            if watcher.other or watcher.signal != "SIGSTOP":
+                print("The program stopped for another reason, profile stopped")
+                break
+            start = time.perf_counter()
+            thread, luaStateAddress = _SelectLuaThread(thread)
+            if luaStateAddress is None:
+                profile.missed += 1
+                continue
+            with memreader.ReadAhead():
+                profile.Add(sampler.Sample(luaStateAddress))
+            profile.sampleSeconds += time.perf_counter() - start
+    finally:
+        stopper.stdin.close()
+        stopper.kill()
+        stopper.wait()
+        gdb.events.stop.disconnect(watcher.OnStop)
+        gdb.events.exited.disconnect(watcher.OnExit)
+        gdb.execute("handle SIGSTOP %s" % handling, to_string=True)
+    return profile
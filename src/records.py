@@ -0,0 +1,80 @@
+import gdb
+import itertools
+import json
+import math
+from typing import Any, Iterable, Iterator
+import common
+
+"""
+JSON Lines output and --from/--count windows of the listing commands.
+
+With --json every entry is printed as one JSON object on its own line as soon as it is decoded,
+so a script or an IDE reads the output of lua-backtrace, lua-printStack, lua-localVal, lua-upVal
+and lua-coroutines without parsing the text. --from N skips the first N entries and --count M
+stops after M entries, the entries out of the window are not decoded.
+"""
+
+
+def AddArguments(parser: common.ArgumentParser) -> None:
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--from", dest="start", type=int, default=0)
+    parser.add_argument("--count", type=int, default=None)
+
+
+def _CheckWindow(options) -> None:
+    if options.start < 0 or (options.count is not None and options.count < 0):
+        raise gdb.GdbError("--from and --count can not be negative")
+
+
+def Window(iterable: Iterable, options, skipped: bool = False) -> Iterator:
+    """
+    The entries of iterable in the window of options, the iteration stops at the end of the window.
+    skipped is True when iterable already starts at --from.
+    """
+    _CheckWindow(options)
+    start = 0 if skipped else options.start
+    stop = None if options.count is None else start + options.count
+    return itertools.islice(iterable, start, stop)
+
+
+def WindowEnd(total: int, options) -> int:
+    """
+    Index after the last entry of the window, for a listing of total entries read by index
+    """
+    _CheckWindow(options)
+    if options.count is None:
+        return total
+    return min(total, options.start + options.count)
+
+
+def Emit(record: dict) -> None:
+    print(json.dumps(record))
+
+
+def JsonValue(value: Any) -> Any:
+    # inf and nan are not JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+def TValueRecord(tValue: common.TValueObj, **fields) -> dict:
+    record = dict(fields)
+    record["type"] = tValue.GetTypeName()
+    record["value"] = JsonValue(tValue.GetValue())
+    return record
+
+
+def FrameRecord(ar) -> dict:
+    """
+    A level of the Lua stack, from a LuaDebug filled with "Slnt"
+    """
+    return {
+        "source": ar.shortSrc,
+        "line": ar.currentLine,
+        "namewhat": ar.namewhat,
+        "name": ar.name,
+        "what": ar.what,
+        "linedefined": ar.linedefined,
+        "tailcall": bool(ar.istailcall),
+    }
@@ -0,0 +1,331 @@
+import gdb
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+import common
+import lgc
+import ltable
+import memreader
+import typecache
+
+"""
+Who keeps an object alive: the references between all the objects of the GC lists,
+stored as a reverse adjacency in CSR form (one offsets array and two edge arrays),
+and a BFS from the object back to the roots of the collector.
+
+The graph is built once per stop and reused by the next queries until the inferior runs again.
+"""
+
+BIT_ISCOLLECTABLE = 1 << 6
+
+# roots of the collector, see markroot in lgc.c
+ROOT_REGISTRY = "registry"
+ROOT_MAINTHREAD = "mainthread"
+
+MT_TYPE_NAMES = ("nil", "boolean", "lightuserdata", "number", "string", "table", "function", "userdata", "thread")
+
+
+def IsCollectable(tt: int) -> bool:
+    return bool(tt & BIT_ISCOLLECTABLE)
+
+
+class ReferenceGraph(object):
+    """
+    Objects are numbered in the order of the GC lists, addresses[n] and tags[n] describe object n.
+    The sources of the references to object n are revSources[revOffsets[n]:revOffsets[n + 1]],
+    with the field names labels[revLabels[...]]. roots[n] is the name of a root object.
+    """
+
+    def __init__(self):
+        self.addresses = array("Q")
+        self.tags = array("B")
+        self.indexes: Dict[int, int] = {}
+        self.labels: List[str] = [""]
+        self._labelIds: Dict[str, int] = {"": 0}
+        self.roots: Dict[int, str] = {}
+        self.revOffsets = array("I")
+        self.revSources = array("I")
+        self.revLabels = array("I")
+        # edges while building, in the order they are found
+        self._sources = array("I")
+        self._targets = array("I")
+        self._edgeLabels = array("I")
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def AddObject(self, address: int, tt: int) -> None:
+        self.indexes[address] = len(self.addresses)
+        self.addresses.append(address)
+        self.tags.append(tt)
+
+    def Label(self, label: str) -> int:
+        labelId = self._labelIds.get(label)
+        if labelId is None:
+            labelId = len(self.labels)
+            self.labels.append(label)
+            self._labelIds[label] = labelId
+        return labelId
+
+    def AddEdge(self, source: int, targetAddress: int, labelId: int) -> None:
+        target = self.indexes.get(targetAddress)
+        if target is not None:
+            self._sources.append(source)
+            self._targets.append(target)
+            self._edgeLabels.append(labelId)
+
+    def Finish(self) -> None:
+        """
+        Sort the edges by target (counting sort) into the CSR arrays
+        """
+        count = len(self.addresses)
+        offsets = array("I", bytes(4 * (count + 1)))
+        for target in self._targets:
+            offsets[target + 1] += 1
+        for n in range(count):
+            offsets[n + 1] += offsets[n]
+        edgeCount = len(self._targets)
+        self.revSources = array("I", bytes(4 * edgeCount))
+        self.revLabels = array("I", bytes(4 * edgeCount))
+        cursor = array("I", offsets[:count])
+        for source, target, labelId in zip(self._sources, self._targets, self._edgeLabels):
+            position = cursor[target]
+            self.revSources[position] = source
+            self.revLabels[position] = labelId
+            cursor[target] = position + 1
+        self.revOffsets = offsets
+        self._sources = self._targets = self._edgeLabels = None
+
+    def FindPath(self, address: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Shortest chain of (object, label of the reference to it) from a root to the object at address,
+        the first element is the root with label 0. None when no root reaches it.
+        """
+        start = self.indexes.get(address)
+        if start is None:
+            raise gdb.GdbError("%s is not in the GC lists" % hex(address))
+        count = len(self.addresses)
+        visited = bytearray(count)
+        # next object towards the target and the label of that reference
+        nextObject = array("i", [-1]) * count
+        nextLabel = array("I", bytes(4 * count))
+        queue = array("I", [start])
+        visited[start] = 1
+        head = 0
+        while head < len(queue):
+            n = queue[head]
+            head += 1
+            if n in self.roots:
+                path = [(n, 0)]
+                while n != start:
+                    path.append((nextObject[n], nextLabel[n]))
+                    n = nextObject[n]
+                return path
+            for position in range(self.revOffsets[n], self.revOffsets[n + 1]):
+                source = self.revSources[position]
+                if not visited[source]:
+                    visited[source] = 1
+                    nextObject[source] = n
+                    nextLabel[source] = self.revLabels[position]
+                    queue.append(source)
+        return None
+
+    def FormatPath(self, path: List[Tuple[int, int]]) -> str:
+        text = self.roots[path[0][0]]
+        for n, labelId in path[1:]:
+            label = self.labels[labelId]
+            if label and not label.startswith("["):
+                text += "."
+            text += label
+        return text
+
+
+class _GraphBuilder(object):
+
+    def __init__(self, globalStateAddress: int):
+        self.globalStateAddress = globalStateAddress
+        self.graph = ReferenceGraph()
+        self.tValueSize = typecache.Sizeof("TValue")
+        self.stackValueSize = typecache.Sizeof("StackValue")
+        self.pointerSize = typecache.Sizeof("void *")
+        self._keyLabels: Dict[int, str] = {}
+        self._weakModes: Dict[int, str] = {}
+        self._upvalueNames: Dict[int, List[str]] = {}
+
+    def Build(self) -> ReferenceGraph:
+        graph = self.graph
+        with memreader.ReadAhead():
+            for listName, address, tt, marked in lgc.IterGCObjects(self.globalStateAddress):
+                graph.AddObject(address, tt)
+            # the main thread is allocated with the global_State, it is in no list
+            mainthread, = memreader.ReadStruct(self.globalStateAddress, "global_State", ("mainthread",))
+            if mainthread not in graph.indexes:
+                graph.AddObject(mainthread, common.LUA_VTHREAD)
+            self._AddRoots()
+            for n in range(len(graph)):
+                self._AddReferences(n, graph.addresses[n], graph.tags[n])
+        graph.Finish()
+        return graph
+
+    def _AddRoots(self) -> None:
+        g = self.globalStateAddress
+        graph = self.graph
+        tt, registry = memreader.ReadTValue(g + typecache.Offsetof("global_State", "l_registry"))
+        if IsCollectable(tt) and registry in graph.indexes:
+            graph.roots[graph.indexes[registry]] = ROOT_REGISTRY
+        mainthread, = memreader.ReadStruct(g, "global_State", ("mainthread",))
+        graph.roots[graph.indexes[mainthread]] = ROOT_MAINTHREAD
+        mtOffset = typecache.Offsetof("global_State", "mt")
+        for i, typeName in enumerate(MT_TYPE_NAMES):
+            metatable = memreader.ReadPointer(g + mtOffset + i * self.pointerSize)
+            if metatable in graph.indexes:
+                graph.roots.setdefault(graph.indexes[metatable], "mt[%s]" % typeName)
+
+    def _KeyLabel(self, keyTt: int, keyRaw: int) -> str:
+        if common.Novariant(keyTt) == common.LuaType.LUA_TSTRING:
+            label = self._keyLabels.get(keyRaw)
+            if label is None:
+                label = ltable.FormatKey(keyTt, keyRaw)
+                self._keyLabels[keyRaw] = label
+            return label
+        if IsCollectable(keyTt):
+            return "[%s %s]" % (lgc.GetTagName(keyTt & 0X3F), hex(keyRaw))
+        return ltable.FormatKey(keyTt, keyRaw)
+
+    def _WeakMode(self, metatable: int) -> str:
+        """
+        __mode of the metatable, "" for strong tables
+        """
+        if metatable == 0:
+            return ""
+        mode = self._weakModes.get(metatable)
+        if mode is None:
+            mode = ""
+            for nodeIndex, keyTt, keyRaw, tt, raw in ltable.IterNodes(ltable.TableHeader(metatable)):
+                if common.Novariant(keyTt) == common.LuaType.LUA_TSTRING and \
+                        common.Novariant(tt) == common.LuaType.LUA_TSTRING and memreader.ReadTString(keyRaw) == "__mode":
+                    mode = memreader.ReadTString(raw)
+                    break
+            self._weakModes[metatable] = mode
+        return mode
+
+    def _UpvalueNames(self, proto: int) -> List[str]:
+        names = self._upvalueNames.get(proto)
+        if names is None:
+            upvalues, sizeupvalues = memreader.ReadStruct(proto, "Proto", ("upvalues", "sizeupvalues"))
+            decoder = memreader.GetDecoder("Upvaldesc", ("name",))
+            names = []
+            if sizeupvalues > 0:
+                buffer = memreader.ReadMemory(upvalues, sizeupvalues * decoder.size)
+                for i in range(sizeupvalues):
+                    name, = decoder.Decode(buffer, i * decoder.size)
+                    names.append(memreader.ReadTString(name) if name else "?")
+            self._upvalueNames[proto] = names
+        return names
+
+    def _AddTValues(self, source: int, address: int, count: int, stride: int, labelFormat: str) -> None:
+        graph = self.graph
+        i = 0
+        for tt, raw in memreader.IterTValues(address, count, stride):
+            if IsCollectable(tt):
+                graph.AddEdge(source, raw, graph.Label(labelFormat % i))
+            i += 1
+
+    def _AddReferences(self, n: int, address: int, tt: int) -> None:
+        graph = self.graph
+        if tt == common.LUA_VTABLE:
+            header = ltable.TableHeader(address)
+            mode = self._WeakMode(header.metatable)
+            if header.metatable:
+                graph.AddEdge(n, header.metatable, graph.Label("<metatable>"))
+            if "v" not in mode:
+                for index, valueTt, raw in ltable.IterArray(header):
+                    if IsCollectable(valueTt):
+                        graph.AddEdge(n, raw, graph.Label("[%d]" % index))
+            for nodeIndex, keyTt, keyRaw, valueTt, raw in ltable.IterNodes(header):
+                if "v" not in mode and IsCollectable(valueTt):
+                    graph.AddEdge(n, raw, graph.Label(self._KeyLabel(keyTt, keyRaw)))
+                if "k" not in mode and IsCollectable(keyTt):
+                    graph.AddEdge(n, keyRaw, graph.Label("<key %s>" % self._KeyLabel(keyTt, keyRaw)))
+        elif tt == common.LUA_VLCL:
+            nupvalues, proto = memreader.ReadStruct(address, "LClosure", ("nupvalues", "p"))
+            graph.AddEdge(n, proto, graph.Label("<proto>"))
+            names = self._UpvalueNames(proto)
+            upvals = address + typecache.Offsetof("LClosure", "upvals")
+            for i in range(nupvalues):
+                upval = memreader.ReadPointer(upvals + i * self.pointerSize)
+                graph.AddEdge(n, upval, graph.Label("<upvalue %s>" % (names[i] if i < len(names) else i + 1)))
+        elif tt == common.LUA_VCCL:
+            nupvalues, = memreader.ReadStruct(address, "CClosure", ("nupvalues",))
+            self._AddTValues(n, address + typecache.Offsetof("CClosure", "upvalue"), nupvalues, self.tValueSize, "<upvalue %d>")
+        elif tt == common.LUA_VUPVAL:
+            value, = memreader.ReadStruct(address, "UpVal", ("v.p",))
+            valueTt, raw = memreader.ReadTValue(value)
+            if IsCollectable(valueTt):
+                graph.AddEdge(n, raw, 0)
+        elif tt == common.LUA_VUSERDATA:
+            nuvalue, metatable = memreader.ReadStruct(address, "Udata", ("nuvalue", "metatable"))
+            if metatable:
+                graph.AddEdge(n, metatable, graph.Label("<metatable>"))
+            self._AddTValues(n, address + typecache.Offsetof("Udata", "uv"), nuvalue, typecache.Sizeof("UValue"), "<uservalue %d>")
+        elif tt == common.LUA_VTHREAD:
+            stack, top, openupval = memreader.ReadStruct(address, "lua_State", ("stack.p", "top.p", "openupval"))
+            if stack:
+                self._AddTValues(n, stack, (top - stack) // self.stackValueSize, self.stackValueSize, "<stack %d>")
+            upval = openupval
+            while upval:
+                graph.AddEdge(n, upval, graph.Label("<open upvalue>"))
+                upval, = memreader.ReadStruct(upval, "UpVal", ("u.open.next",))
+        elif tt == common.LUA_VPROTO:
+            k, sizek, p, sizep, source = memreader.ReadStruct(address, "Proto", ("k", "sizek", "p", "sizep", "source"))
+            if source:
+                graph.AddEdge(n, source, graph.Label("<source>"))
+            self._AddTValues(n, k, sizek, self.tValueSize, "<constant %d>")
+            for i in range(sizep):
+                graph.AddEdge(n, memreader.ReadPointer(p + i * self.pointerSize), graph.Label("<proto %d>" % i))
+
+
+_graph: ReferenceGraph = None
+_graphGlobalState = None
+
+
+def GetGraph(globalStateAddress: int) -> ReferenceGraph:
+    """
+    The reference graph of the heap, built on the first query after each stop
+    """
+    global _graph, _graphGlobalState
+    if _graph is None or _graphGlobalState != globalStateAddress:
+        _graph = _GraphBuilder(globalStateAddress).Build()
+        _graphGlobalState = globalStateAddress
+    return _graph
+
+
+def _Invalidate(event=None) -> None:
+    global _graph, _graphGlobalState
+    _graph = None
+    _graphGlobalState = None
+
+
+def ResolveObjectAddress(value: gdb.Value) -> int:
+    """
+    value may be a pointer to a GC object, a TValue *, a StackValue * or a plain address
+    """
+    valueType = value.type.strip_typedefs()
+    if valueType.code == gdb.TYPE_CODE_PTR:
+        target = valueType.target().strip_typedefs()
+        if (target.tag or target.name) in ("TValue", "StackValue"):
+            tt, raw = memreader.ReadTValue(int(value))
+            if not IsCollectable(tt):
+                raise gdb.GdbError("%s does not hold a collectable value" % value)
+            return raw
+    return int(value)
+
+
+def IterPathLines(graph: ReferenceGraph, path: List[Tuple[int, int]]) -> Iterator[str]:
+    for n, labelId in path:
+        label = graph.roots[n] if labelId == 0 and n in graph.roots else graph.labels[labelId]
+        yield "    %-40s %-16s %s" % (label or "<value>", lgc.GetTagName(graph.tags[n]), hex(graph.addresses[n]))
+
+
+typecache.RegisterInvalidateCallback(_Invalidate)
+gdb.events.stop.connect(_Invalidate)
+gdb.events.cont.connect(_Invalidate)
@@ -0,0 +1,246 @@
+"""
+Group the cores of a crash storm by Lua stack.
+
+    python3 triage.py --binary ./lua -j 8 --out triage/ /var/crash/cores/
+
+Every core is opened by a `gdb --batch` worker that sources luaGdb.py, locates the
+innermost L of the crashing thread (or of any thread) and prints the lua-backtrace
+frames as one JSON record. Cores with the same normalized stack (source, line and
+function name of every frame) end in the same bucket. The buckets are printed by count,
+and with --out each one gets a link to (or with --copy, a copy of) its smallest core,
+its backtrace and the list of its cores.
+
+EmitRecord is the part that runs inside gdb.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# prefix of the record line in the output of a worker
+RECORD_PREFIX = "LUA-TRIAGE-RECORD "
+
+
+def EmitRecord() -> None:
+    """
+    Run in gdb with the core loaded: print the record of the crash, see RECORD_PREFIX
+    """
+    import gdb
+    import common
+    import ldebug
+    import records
+
+    record = {"state": None, "thread": None, "cFrame": None, "signal": None, "frames": [], "error": None}
+    try:
+        try:
+            record["cFrame"] = gdb.newest_frame().name()
+            record["signal"] = int(gdb.parse_and_eval("$_siginfo.si_signo"))
+        except (gdb.error, RuntimeError):
+            pass
+        selected = gdb.selected_thread()
+        threads = [thread for thread in gdb.selected_inferior().threads() if thread != selected]
+        # the crashing thread first
+        for thread in ([selected] if selected is not None else []) + threads:
+            thread.switch()
+            luaStatePointer = common.FindLuaState()
+            if luaStatePointer is not None and int(luaStatePointer) != 0:
+                record["state"] = hex(int(luaStatePointer))
+                record["thread"] = thread.num
+                record["frames"] = [records.FrameRecord(ar) for ar in ldebug.IterStackInfo(luaStatePointer, "Slnt")]
+                break
+    except Exception as e:
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    print(RECORD_PREFIX + json.dumps(record))
+
+
+def _WorkerCommand(gdbPath: str, binary: str, corePath: str) -> List[str]:
+    return [
+        gdbPath, "--batch", "-nx", "-q",
+        "-ex", "set pagination off",
+        "-ex", "python import sys; sys.path.insert(0, %r)" % SRC_DIR,
+        "-x", os.path.join(SRC_DIR, "luaGdb.py"),
+        "-ex", "python import triage; triage.EmitRecord()",
+        binary, corePath,
+    ]
+
+
+def RunWorker(gdbPath: str, binary: str, corePath: str, timeout: float) -> dict:
+    """
+    Record of one core, with "error" set when gdb failed or printed no record
+    """
+    try:
+        result = subprocess.run(_WorkerCommand(gdbPath, binary, corePath), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=timeout, universal_newlines=True)
+        output = result.stdout
+    except subprocess.TimeoutExpired:
+        output = ""
+        error = "timeout after %ds" % timeout
+    except OSError as e:
+        output = ""
+        error = str(e)
+    else:
+        error = "no record in the gdb output (exit code %d)" % result.returncode
+    for line in output.splitlines():
+        if line.startswith(RECORD_PREFIX):
+            record = json.loads(line[len(RECORD_PREFIX):])
+            break
+    else:
+        record = {"frames": [], "error": error, "output": output[-2000:]}
+    record["core"] = corePath
+    return record
+
+
+def FrameKey(frame: dict) -> str:
+    """
+    Normalized frame: source, line and the function name when there is one
+    """
+    key = "%s:%d" % (frame["source"], frame["line"])
+    if frame.get("name"):
+        key += " %s" % frame["name"]
+    return key
+
+
+def StackSignature(record: dict, maxFrames: int) -> Tuple[str, ...]:
+    frames = record.get("frames") or []
+    if maxFrames > 0:
+        frames = frames[:maxFrames]
+    if frames:
+        return tuple(FrameKey(frame) for frame in frames)
+    # no Lua stack, group by where it failed
+    if record.get("error"):
+        return ("[error] %s" % record["error"].splitlines()[0],)
+    return ("[C] %s" % record.get("cFrame"),)
+
+
+class Bucket(object):
+
+    def __init__(self, signature: Tuple[str, ...]):
+        self.signature = signature
+        self.id = hashlib.sha1("\n".join(signature).encode("utf-8")).hexdigest()[:12]
+        self.records: List[dict] = []
+
+    def Representative(self) -> dict:
+        # the smallest core is the cheapest to share and open
+        return min(self.records, key=lambda record: (_FileSize(record["core"]), record["core"]))
+
+
+def _FileSize(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return sys.maxsize
+
+
+def GroupRecords(records: List[dict], maxFrames: int) -> List[Bucket]:
+    buckets: Dict[Tuple[str, ...], Bucket] = {}
+    for record in records:
+        signature = StackSignature(record, maxFrames)
+        bucket = buckets.get(signature)
+        if bucket is None:
+            bucket = Bucket(signature)
+            buckets[signature] = bucket
+        bucket.records.append(record)
+    return sorted(buckets.values(), key=lambda bucket: (-len(bucket.records), bucket.signature))
+
+
+def FormatBacktrace(record: dict) -> str:
+    lines = ["stack traceback:"]
+    for frame in record.get("frames") or []:
+        where = frame["source"] if frame["line"] <= 0 else "%s:%d" % (frame["source"], frame["line"])
+        if frame.get("namewhat"):
+            function = "%s '%s'" % (frame["namewhat"], frame["name"])
+        elif frame.get("what") == "main":
+            function = "main chunk"
+        elif frame.get("what") != "C":
+            function = "function <%s:%d>" % (frame["source"], frame["linedefined"])
+        else:
+            function = "?"
+        lines.append("\t%s: in %s" % (where, function))
+        if frame.get("tailcall"):
+            lines.append("\t(...tail calls...)")
+    if record.get("error"):
+        lines.append("error: %s" % record["error"])
+    return "\n".join(lines) + "\n"
+
+
+def WriteBuckets(buckets: List[Bucket], outDir: str, copy: bool) -> None:
+    os.makedirs(outDir, exist_ok=True)
+    summary = []
+    for index, bucket in enumerate(buckets, 1):
+        representative = bucket.Representative()
+        name = "bucket-%03d-%s" % (index, bucket.id)
+        corePath = os.path.join(outDir, name + ".core")
+        if os.path.lexists(corePath):
+            os.remove(corePath)
+        if copy:
+            shutil.copyfile(representative["core"], corePath)
+        else:
+            os.symlink(os.path.abspath(representative["core"]), corePath)
+        with open(os.path.join(outDir, name + ".txt"), "w") as f:
+            f.write("%d cores, representative %s\n\n" % (len(bucket.records), representative["core"]))
+            f.write(FormatBacktrace(representative))
+            f.write("\ncores:\n")
+            for record in bucket.records:
+                f.write("%s\n" % record["core"])
+        summary.append({
+            "bucket": name,
+            "count": len(bucket.records),
+            "signature": list(bucket.signature),
+            "representative": representative["core"],
+            "cores": [record["core"] for record in bucket.records],
+        })
+    with open(os.path.join(outDir, "buckets.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+
+
+def _CorePaths(paths: List[str]) -> List[str]:
+    corePaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    corePaths.append(os.path.join(path, name))
+        else:
+            corePaths.append(path)
+    return corePaths
+
+
+def Main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="triage.py", description="Group core files by Lua stack")
+    parser.add_argument("--binary", required=True, help="the executable that dumped the cores")
+    parser.add_argument("--gdb", default="gdb", help="gdb to run the workers with")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of gdb processes")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per core")
+    parser.add_argument("--frames", type=int, default=0, help="only compare the N innermost frames, 0 for all")
+    parser.add_argument("--out", help="directory for the buckets, their backtraces and representative cores")
+    parser.add_argument("--copy", action="store_true", help="copy the representative cores instead of linking them")
+    parser.add_argument("cores", nargs="+", help="core files or directories of core files")
+    options = parser.parse_args(argv)
+
+    corePaths = _CorePaths(options.cores)
+    with ThreadPoolExecutor(max_workers=max(1, options.jobs)) as executor:
+        records = list(executor.map(lambda corePath: RunWorker(options.gdb, options.binary, corePath, options.timeout),
+                                    corePaths))
+
+    buckets = GroupRecords(records, options.frames)
+    print("%d cores, %d buckets" % (len(records), len(buckets)))
+    for index, bucket in enumerate(buckets, 1):
+        print("")
+        print("[%d] %d cores, %s" % (index, len(bucket.records), bucket.id))
+        for frame in bucket.signature:
+            print("\t%s" % frame)
+    if options.out:
+        WriteBuckets(buckets, options.out, options.copy)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -0,0 +1,273 @@
+import gdb
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+import perfstats
+
+"""
+Central registry of the Lua types and field offsets used by the plugin.
+
+gdb.lookup_type() has to search the symbol tables of every objfile, which is
+very slow on big binaries with thousands of CUs. Every type and field offset
+is resolved once here and reused until the objfiles change.
+
+Sizes and offsets can also come from a layout manifest written by lua-export-layout
+(see layout.py). When one of the loaded objfiles has a build-id with a manifest in
+ManifestDir(), Sizeof and Offsetof answer from it without touching the DWARF.
+"""
+
+# where the manifests are written and searched, one <build-id>.json per binary
+MANIFEST_DIR_ENV = "LUA_GDB_LAYOUT_DIR"
+DEFAULT_MANIFEST_DIR = os.path.join("~", ".cache", "lua-gdb")
+MANIFEST_VERSION = 1
+
+# Types that almost every command needs
+LUA_TYPE_NAMES = (
+    "lua_State",
+    "CallInfo",
+    "TValue",
+    "StackValue",
+    "union GCUnion",
+    "Table",
+    "Proto",
+)
+
+_typeCache: Dict[str, gdb.Type] = {}
+_fieldCache: Dict[Tuple[str, str], Tuple[int, gdb.Type]] = {}
+_invalidateCallbacks: List[Callable[[], None]] = []
+
+_manifest: Optional[dict] = None
+_manifestSearched = False
+_manifestPinned = False
+_manifestFieldCache: Dict[Tuple[str, str], Tuple[int, str]] = {}
+
+
+def LookupType(typeName: str) -> gdb.Type:
+    """
+    Same as gdb.lookup_type, but cached.
+    A trailing '*' is allowed, like "TValue *".
+    """
+    targetType = _typeCache.get(typeName)
+    if targetType is None:
+        if typeName.endswith("*"):
+            targetType = LookupType(typeName[:-1].rstrip()).pointer()
+        else:
+            if perfstats.enabled:
+                perfstats.stats.lookupTypes += 1
+            targetType = gdb.lookup_type(typeName)
+        _typeCache[typeName] = targetType
+    elif perfstats.enabled:
+        perfstats.stats.typeCacheHits += 1
+    return targetType
+
+
+def LookupPointerType(typeName: str) -> gdb.Type:
+    return LookupType(typeName + " *")
+
+
+def Sizeof(typeName: str) -> int:
+    desc = ManifestType(typeName)
+    if desc is not None:
+        return desc["size"]
+    return int(LookupType(typeName).sizeof)
+
+
+def _FindField(structType: gdb.Type, fieldName: str) -> Tuple[int, gdb.Type]:
+    for field in structType.fields():
+        if field.name == fieldName:
+            return field.bitpos // 8, field.type
+        if field.name is None:
+            # anonymous struct or union member
+            try:
+                offset, fieldType = _FindField(field.type.strip_typedefs(), fieldName)
+                return field.bitpos // 8 + offset, fieldType
+            except KeyError:
+                pass
+    raise KeyError("%s has no field named %s" % (structType, fieldName))
+
+
+def _ResolveField(typeName: str, fieldPath: str) -> Tuple[int, gdb.Type]:
+    key = (typeName, fieldPath)
+    resolved = _fieldCache.get(key)
+    if resolved is None:
+        offset = 0
+        fieldType = LookupType(typeName)
+        for fieldName in fieldPath.split("."):
+            fieldOffset, fieldType = _FindField(fieldType.strip_typedefs(), fieldName)
+            offset += fieldOffset
+        resolved = (offset, fieldType)
+        _fieldCache[key] = resolved
+    return resolved
+
+
+def Offsetof(typeName: str, fieldPath: str) -> int:
+    """
+    offsetof(typeName, fieldPath), fieldPath may be nested like "func.p" or "u.l.savedpc"
+    """
+    if GetManifest() is not None:
+        resolved = _ResolveManifestField(typeName, fieldPath)
+        if resolved is not None:
+            return resolved[0]
+    return _ResolveField(typeName, fieldPath)[0]
+
+
+def FieldType(typeName: str, fieldPath: str) -> gdb.Type:
+    return _ResolveField(typeName, fieldPath)[1]
+
+
+def ManifestDir() -> str:
+    return os.path.expanduser(os.environ.get(MANIFEST_DIR_ENV) or DEFAULT_MANIFEST_DIR)
+
+
+def ManifestPath(buildId: str) -> str:
+    return os.path.join(ManifestDir(), buildId + ".json")
+
+
+def _LoadedBuildIds() -> List[str]:
+    buildIds = []
+    for objfile in getattr(gdb, "objfiles", list)():
+        buildId = getattr(objfile, "build_id", None)
+        if buildId:
+            buildIds.append(buildId)
+    return buildIds
+
+
+def _FindManifest() -> Optional[dict]:
+    for buildId in _LoadedBuildIds():
+        path = ManifestPath(buildId)
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print("lua-gdb: ignoring %s: %s" % (path, e))
+            continue
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("buildId") == buildId:
+            return manifest
+    return None
+
+
+def GetManifest() -> Optional[dict]:
+    """
+    The layout manifest matching one of the loaded objfiles, None when there is none
+    """
+    global _manifest, _manifestSearched
+    if not _manifestSearched:
+        _manifest = _FindManifest()
+        _manifestSearched = True
+    return _manifest
+
+
+def SetManifest(manifest: Optional[dict]) -> None:
+    """
+    Use manifest whatever the loaded objfiles are, it is kept by Invalidate.
+    None goes back to searching ManifestDir().
+    """
+    global _manifest, _manifestSearched, _manifestPinned
+    _manifest = manifest
+    _manifestSearched = manifest is not None
+    _manifestPinned = manifest is not None
+    _manifestFieldCache.clear()
+
+
+def ManifestType(typeName: str) -> Optional[dict]:
+    """
+    Description of typeName in the manifest with the typedefs stripped, see layout.py
+    """
+    manifest = GetManifest()
+    if manifest is None:
+        return None
+    types = manifest["types"]
+    desc = types.get(typeName)
+    if desc is None and typeName.endswith("*"):
+        # pointers to types that no field points to, like "Table *"
+        if ManifestType(typeName[:-1].rstrip()) is None:
+            return None
+        desc = {"kind": "pointer", "size": manifest["pointerSize"], "target": typeName[:-1].rstrip()}
+    while desc is not None and desc["kind"] == "typedef":
+        desc = types.get(desc["target"])
+    return desc
+
+
+def _FindManifestField(structDesc: dict, fieldName: str) -> Optional[Tuple[int, str]]:
+    for field in structDesc.get("fields", ()):
+        if field["name"] == fieldName:
+            return field["offset"], field["type"]
+        if field["name"] is None:
+            found = _FindManifestField(ManifestType(field["type"]) or {}, fieldName)
+            if found is not None:
+                return field["offset"] + found[0], found[1]
+    return None
+
+
+def _ResolveManifestField(typeName: str, fieldPath: str) -> Optional[Tuple[int, str]]:
+    """
+    (offset, type name in the manifest) of fieldPath, None when the manifest does not have it
+    """
+    key = (typeName, fieldPath)
+    if key in _manifestFieldCache:
+        return _manifestFieldCache[key]
+    resolved = None
+    desc = ManifestType(typeName)
+    if desc is not None:
+        offset = 0
+        fieldTypeName = typeName
+        for fieldName in fieldPath.split("."):
+            found = _FindManifestField(desc or {}, fieldName)
+            if found is None:
+                break
+            offset += found[0]
+            fieldTypeName = found[1]
+            desc = ManifestType(fieldTypeName)
+        else:
+            resolved = (offset, fieldTypeName)
+    _manifestFieldCache[key] = resolved
+    return resolved
+
+
+def ManifestField(typeName: str, fieldPath: str) -> Optional[dict]:
+    """
+    Description of the type of fieldPath in the manifest, with the typedefs stripped
+    """
+    if GetManifest() is None:
+        return None
+    resolved = _ResolveManifestField(typeName, fieldPath)
+    if resolved is None:
+        return None
+    return ManifestType(resolved[1])
+
+
+def ManifestOption(name: str) -> Optional[int]:
+    """
+    Build option like LUA_IDSIZE recorded in the manifest, see luaconf.py
+    """
+    manifest = GetManifest()
+    if manifest is None:
+        return None
+    return manifest.get("options", {}).get(name)
+
+
+def RegisterInvalidateCallback(callback: Callable[[], None]) -> None:
+    """
+    callback is called every time the cached types are dropped,
+    so that modules holding values derived from them can drop them too.
+    """
+    _invalidateCallbacks.append(callback)
+
+
+def Invalidate(event=None) -> None:
+    global _manifest, _manifestSearched
+    _typeCache.clear()
+    _fieldCache.clear()
+    if not _manifestPinned:
+        _manifest = None
+        _manifestSearched = False
+        _manifestFieldCache.clear()
+    for callback in _invalidateCallbacks:
+        callback()
+
+
+gdb.events.new_objfile.connect(Invalidate)
+if hasattr(gdb.events, "clear_objfiles"):
+    gdb.events.clear_objfiles.connect(Invalidate)
@@ -0,0 +1,294 @@
+import gdb
+import re
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import common
+import ldebug
+import lgc
+import ltable
+import memreader
+import typecache
+
+"""
+Hardware watchpoints on Lua values: a table field reached by a path like _ENV.config.timeout,
+or an upvalue of the running Lua function.
+
+The path is resolved to the address of the TValue with the hash lookup of ltable.c, and two
+hardware watchpoints are set on its value_ and tt_. They stop the program only when the value
+changes, and print the old and the new Lua value with the Lua backtrace. The VM writes value_
+and tt_ one after the other, so a change of type may be reported in two steps.
+
+A rehash moves the slots of a table: a breakpoint on luaH_resize, with a native condition on
+the table, re-arms the watchpoints on the new slot once luaH_resize has returned.
+"""
+
+# lualib.h, index of the globals table in the registry
+LUA_RIDX_GLOBALS = 2
+
+_PATH_ROOT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_PATH_KEY = re.compile(r"\.([A-Za-z_][A-Za-z0-9_]*)|\[(-?\d+)\]|\[\"((?:[^\"\\]|\\.)*)\"\]")
+
+RESIZE_FUNCTION = "luaH_resize"
+
+
+def ParsePath(path: str) -> Tuple[str, List[Union[bytes, int]]]:
+    """
+    'config.servers[2]["host name"]' -> ("config", [b"servers", 2, b"host name"])
+    """
+    match = _PATH_ROOT.match(path)
+    if match is None:
+        raise gdb.GdbError("a path starts with a name, like _ENV.config.timeout, not %s" % path)
+    root = match.group(0)
+    keys: List[Union[bytes, int]] = []
+    position = match.end()
+    while position < len(path):
+        match = _PATH_KEY.match(path, position)
+        if match is None:
+            raise gdb.GdbError("can not parse %s at %s" % (path, path[position:]))
+        field, index, string = match.groups()
+        if field is not None:
+            keys.append(field.encode("utf-8"))
+        elif index is not None:
+            keys.append(int(index))
+        else:
+            keys.append(string.encode("utf-8").decode("unicode_escape").encode("latin-1"))
+        position = match.end()
+    return root, keys
+
+
+def GlobalsTable(globalStateAddress: int) -> int:
+    registryOffset = typecache.Offsetof("global_State", "l_registry")
+    tt, registry = memreader.ReadTValue(globalStateAddress + registryOffset)
+    slot = ltable.GetSlot(registry, LUA_RIDX_GLOBALS, 0)
+    tt, globalsTable = memreader.ReadTValue(slot)
+    return globalsTable
+
+
+def UpvalueSlot(luaStatePointer: gdb.Value, name: str) -> Optional[int]:
+    """
+    Address of the TValue of the upvalue of the innermost Lua function, None if it has no such upvalue.
+    The TValue of an open upvalue is in the stack.
+    """
+    ci = luaStatePointer['ci']
+    baseCi = luaStatePointer['base_ci'].address
+    while ci != 0 and ci != baseCi:
+        if common.CallInfoValue(luaStatePointer, ci).IsLua():
+            funcPointer = ci['func']['p']['val'].address
+            n = 1
+            while True:
+                upvalueName, tValueObj = ldebug.AuxUpValue(funcPointer, n)
+                if tValueObj is None:
+                    return None
+                if upvalueName == name:
+                    return int(tValueObj.tValuePointer)
+                n += 1
+        ci = ci['previous']
+    return None
+
+
+def _KeyText(key: Union[bytes, int]) -> str:
+    if isinstance(key, int):
+        return "[%d]" % key
+    text = key.decode("utf-8", "backslashreplace")
+    return "." + text if ltable.LUA_IDENTIFIER.match(text) else "[\"%s\"]" % text
+
+
+class ResolvedPath(object):
+    """
+    slot is the TValue watched. For a table field, table and key are where it was found,
+    to find it again after a rehash; table is None for an upvalue.
+    """
+
+    def __init__(self, slot: int, table: Optional[int], key: Union[bytes, int, None], seed: int):
+        self.slot = slot
+        self.table = table
+        self.key = key
+        self.seed = seed
+
+
+def ResolvePath(path: str, luaStatePointer: gdb.Value) -> ResolvedPath:
+    """
+    The root of the path is an upvalue of the innermost Lua function (like _ENV), _G, or a global variable
+    """
+    root, keys = ParsePath(path)
+    globalStateAddress = lgc.GetGlobalState(luaStatePointer)
+    seed, = memreader.ReadStruct(globalStateAddress, "global_State", ("seed",))
+    resolved = None
+    walked = root
+    slot = UpvalueSlot(luaStatePointer, root)
+    if slot is not None:
+        resolved = ResolvedPath(slot, None, None, seed)
+        tt, raw = memreader.ReadTValue(slot)
+    else:
+        if root not in ("_G", "_ENV"):
+            # a global variable
+            keys = [root.encode("utf-8")] + keys
+            walked = "_G"
+        tt, raw = common.Ctb(common.LUA_VTABLE), GlobalsTable(globalStateAddress)
+
+    for key in keys:
+        if common.WithVariant(tt) != common.LUA_VTABLE:
+            raise gdb.GdbError("%s is a %s, not a table" % (walked, common.LuaType2TypeName.get(common.Novariant(tt), tt)))
+        slot = ltable.GetSlot(raw, key, seed)
+        if slot is None:
+            raise gdb.GdbError("%s has no key %s" % (walked, _KeyText(key)))
+        resolved = ResolvedPath(slot, raw, key, seed)
+        tt, raw = memreader.ReadTValue(slot)
+        walked += _KeyText(key)
+    if resolved is None:
+        raise gdb.GdbError("%s is the globals table, watch one of its fields" % root)
+    return resolved
+
+
+def FormatTValue(tt: int, raw: int) -> str:
+    try:
+        return ltable.FormatValue(tt, raw)
+    except gdb.error:
+        # value_ and tt_ are written one after the other, this is the half written value
+        return "<%s %s>" % (common.LuaType2TypeName.get(common.Novariant(tt), tt), hex(raw))
+
+
+class _SlotWatchpoint(gdb.Breakpoint):
+
+    def __init__(self, luaWatch: "LuaWatch", expression: str):
+        super(_SlotWatchpoint, self).__init__(expression, gdb.BP_WATCHPOINT, gdb.WP_WRITE, internal=True)
+        self.silent = True
+        self.luaWatch = luaWatch
+
+    def stop(self) -> bool:
+        return self.luaWatch.OnWrite()
+
+
+class LuaWatch(object):
+    """
+    The watchpoints of one Lua value, and the luaH_resize breakpoint of its table
+    """
+
+    def __init__(self, number: int, path: str, resolved: ResolvedPath):
+        self.number = number
+        self.path = path
+        self.resolved = resolved
+        self.tt, self.raw = memreader.ReadTValue(resolved.slot)
+        self.resizing = False
+        self.watchpoints: List[_SlotWatchpoint] = []
+        self.resizeBreakpoint = None
+        self._Arm()
+        if resolved.table is not None:
+            # only stops when luaH_resize is called for this table
+            self.resizeBreakpoint = gdb.Breakpoint(RESIZE_FUNCTION, internal=True)
+            self.resizeBreakpoint.condition = "t == (Table *)0x%x" % resolved.table
+            self.resizeBreakpoint.commands = "silent\npython import watchpoints; watchpoints.OnResize(%d)\ncontinue" % number
+
+    def _Arm(self) -> None:
+        slot = self.resolved.slot
+        self.watchpoints = [
+            _SlotWatchpoint(self, "((TValue *)0x%x)->value_" % slot),
+            _SlotWatchpoint(self, "((TValue *)0x%x)->tt_" % slot),
+        ]
+
+    def _Disarm(self) -> None:
+        for watchpoint in self.watchpoints:
+            if watchpoint.is_valid():
+                watchpoint.delete()
+        self.watchpoints = []
+
+    def Describe(self) -> str:
+        return "Lua watchpoint %d: %s at %s = %s" % (self.number, self.path, hex(self.resolved.slot),
+                                                     FormatTValue(self.tt, self.raw))
+
+    def OnWrite(self) -> bool:
+        if self.resizing:
+            # luaH_resize moves the nodes and frees the old ones, the slot is found again when it returns
+            return False
+        tt, raw = memreader.ReadTValue(self.resolved.slot)
+        if (tt, raw) == (self.tt, self.raw):
+            return False
+        print("Lua watchpoint %d: %s" % (self.number, self.path))
+        print("Old value = %s" % FormatTValue(self.tt, self.raw))
+        print("New value = %s" % FormatTValue(tt, raw))
+        self.tt, self.raw = tt, raw
+        luaStatePointer = common.FindLuaState()
+        if luaStatePointer is not None:
+            print("stack traceback:")
+            for ar in ldebug.IterStackInfo(luaStatePointer, "Slnt"):
+                where = ar.shortSrc if ar.currentLine <= 0 else "%s:%d" % (ar.shortSrc, ar.currentLine)
+                print("\t%s: in %s" % (where, ldebug.GetFuncDescription(ar)))
+                if ar.istailcall:
+                    print("\t(...tail calls...)")
+        return True
+
+    def Rearm(self) -> bool:
+        """
+        Find the slot of the key again after a rehash, return False if the key is no longer in the table
+        """
+        self.resizing = False
+        self._Disarm()
+        slot = ltable.GetSlot(self.resolved.table, self.resolved.key, self.resolved.seed)
+        if slot is None:
+            return False
+        self.resolved.slot = slot
+        self._Arm()
+        return True
+
+    def Delete(self) -> None:
+        self._Disarm()
+        if self.resizeBreakpoint is not None and self.resizeBreakpoint.is_valid():
+            self.resizeBreakpoint.delete()
+
+
+# Lua watchpoint number -> LuaWatch
+_watches: Dict[int, LuaWatch] = {}
+_lastNumber = 0
+
+
+def Watch(path: str, luaStatePointer: gdb.Value) -> LuaWatch:
+    global _lastNumber
+    resolved = ResolvePath(path, luaStatePointer)
+    _lastNumber += 1
+    luaWatch = LuaWatch(_lastNumber, path, resolved)
+    _watches[luaWatch.number] = luaWatch
+    return luaWatch
+
+
+def Unwatch(number: int) -> None:
+    luaWatch = _watches.pop(number, None)
+    if luaWatch is None:
+        raise gdb.GdbError("no Lua watchpoint %d" % number)
+    luaWatch.Delete()
+
+
+def IterWatches() -> Iterator[LuaWatch]:
+    for number in sorted(_watches):
+        yield _watches[number]
+
+
+def OnResize(number: int) -> None:
+    """
+    Run by the commands of the luaH_resize breakpoint, the program is stopped at the start of luaH_resize
+    """
+    luaWatch = _watches.get(number)
+    if luaWatch is None:
+        return
+    luaWatch.resizing = True
+    finish = gdb.FinishBreakpoint(gdb.newest_frame(), internal=True)
+    finish.silent = True
+    finish.commands = "python import watchpoints; watchpoints.OnResized(%d)\ncontinue" % number
+
+
+def OnResized(number: int) -> None:
+    """
+    Run by the commands of the FinishBreakpoint of luaH_resize
+    """
+    luaWatch = _watches.get(number)
+    if luaWatch is None:
+        return
+    if not luaWatch.Rearm():
+        print("Lua watchpoint %d: %s was removed from its table by a rehash, deleted" % (number, luaWatch.path))
+        Unwatch(number)
+
+
+def _OnExited(event) -> None:
+    for number in list(_watches):
+        Unwatch(number)
+
+
+gdb.events.exited.connect(_OnExited)